@@ -0,0 +1,66 @@
+"""
+Benchmarks the time to import pollution_assessment, and which plotting
+libraries get imported, in fresh Python processes.
+
+Usage:
+    python sandbox/import_time.py [repeats]
+
+For a per-module breakdown, run:
+    python -X importtime -c "import pollution_assessment.calc"
+"""
+import statistics
+import subprocess
+import sys
+
+CASES = {
+    'package only': 'import pollution_assessment as pa',
+    'calc': 'import pollution_assessment as pa; pa.calc',
+    'calc + network': 'import pollution_assessment as pa; pa.calc; pa.network',
+    'plot': 'import pollution_assessment as pa; pa.plot',
+    'make_map': 'import pollution_assessment as pa; pa.make_map',
+}
+
+PLOTTING_LIBRARIES = [
+    'holoviews', 'geoviews', 'bokeh', 'hvplot', 'cartopy', 'contextily',
+    'colorcet', 'matplotlib',
+]
+
+SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+loaded = [name for name in {libraries!r} if name in sys.modules]
+print(elapsed, ','.join(loaded))
+'''
+
+
+def time_import(statement: str) -> tuple[float, list[str]]:
+    """Seconds to run an import statement in a new process, and the plotting
+    libraries it imported.
+    """
+    result = subprocess.run(
+        [sys.executable, '-c', SCRIPT.format(
+            statement=statement, libraries=PLOTTING_LIBRARIES,
+        )],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1]
+        raise RuntimeError(error)
+    elapsed, loaded = result.stdout.strip().split(' ', 1) + ['']
+    return float(elapsed), [name for name in loaded.split(',') if name]
+
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print(f'{"case":<16} {"median (s)":>10}  plotting libraries imported')
+    for case, statement in CASES.items():
+        try:
+            results = [time_import(statement) for _ in range(repeats)]
+        except RuntimeError as error:
+            print(f'{case:<16} {"failed":>10}  {error}')
+            continue
+        median = statistics.median(elapsed for elapsed, _ in results)
+        loaded = ', '.join(results[-1][1]) or '-'
+        print(f'{case:<16} {median:>10.3f}  {loaded}')
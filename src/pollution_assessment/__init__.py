@@ -1,15 +1,39 @@
+import importlib
+
 # package version
 __version__ = '0.1.0'
 
-# populate package namespace
-from pollution_assessment import (
-    calc,
-    plot,
-    dynamic_plot,
-    plot_protected_land,
-    summary_stats,
-)
-
-from pollution_assessment.v2_plots.make_map import (
-    make_map,
-)
+# populate package namespace lazily, so that `import pollution_assessment` 
+# doesn't import the plotting stack until a plotting module is first used
+_submodules = [
+    'calc',
+    'network',
+    'outlets',
+    'storage',
+    'schema',
+    'manifest',
+    'telemetry',
+    'monthly',
+    'plot',
+    'dynamic_plot',
+    'plot_protected_land',
+    'summary_stats',
+]
+
+_attributes = {
+    'make_map': 'pollution_assessment.v2_plots.make_map',
+}
+
+
+def __getattr__(name: str):
+    if name in _submodules:
+        return importlib.import_module(f'{__name__}.{name}')
+    if name in _attributes:
+        value = getattr(importlib.import_module(_attributes[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__() -> list[str]:
+    return sorted([*globals(), *_submodules, *_attributes])
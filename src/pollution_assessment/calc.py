@@ -1,6 +1,9 @@
 import numpy as np
 import pandas as pd
 import geopandas as gpd
+from scipy import sparse
+
+from pollution_assessment import network, storage
 
 
 # *****************************************************************************
@@ -130,9 +133,160 @@ def convert_kgha_to_lbsac(
     return data_out
 
 
+class RunIndex:
+    """Index of wikiSRAT results by run group, run type and source.
+
+    Groups row positions once, so that every later selection of a run group 
+    is a lookup of a slice of a sorted table instead of a scan of the full 
+    results. `select_run()` builds and caches one for each results DataFrame 
+    it's called with, so it's only needed directly to hold on to an index 
+    for longer than the cache does.
+
+    The sorted table is a copy of the results, made once for each run type 
+    mode on first use. A selection from a single source (e.g. point sources) 
+    is then a slice of it, without copying, while a selection of several 
+    sources is gathered into a new frame in the original row order.
+
+    Args:
+        df_in: WikiSRAT results for multiple run groups
+    """
+
+    def __init__(self, df_in: pd.DataFrame):
+        self.df = df_in
+        self.shape = df_in.shape
+        # Sorted tables are built on first use, for each `_mode()`
+        self._tables = {}
+        self._selections = {}
+
+    def _mode(self, run_type: str) -> str:
+        if run_type not in run_types:
+            raise ValueError("run_type must be 'single' or 'combined'")
+        if run_type == 'single' and 'run_type' not in self.df:
+            return 'all'
+        return run_type
+
+    def _table(self, mode: str) -> tuple[pd.DataFrame, dict, np.ndarray]:
+        """Returns results sorted by group and indexed by COMID, slices for 
+        every group, and the original position of every sorted row.
+        """
+        if mode in self._tables:
+            return self._tables[mode]
+
+        rows = self.df
+        group_keys = ['run_group', 'run_type', 'Source']
+        if mode == 'combined':
+            # Drop 'single' row only if 'combined' doesn't also exist
+            rows = rows.loc[
+                ~rows.duplicated(subset=['comid', 'Source', 'run_group'], keep='last')
+            ]
+        if mode != 'single':
+            group_keys = ['run_group', 'Source']
+
+        # Row positions for every group, in original order within a group
+        indices = rows.groupby(
+            group_keys, sort=True, dropna=False, observed=True,
+        ).indices
+        slices = {}
+        start = 0
+        for key, positions in indices.items():
+            # Nest by run group (and run type), then by Source
+            slices.setdefault(key[:-1], {})[key[-1]] = slice(
+                start, start + len(positions)
+            )
+            start += len(positions)
+        order = (
+            np.concatenate(list(indices.values())) if indices 
+            else np.array([], dtype=np.int64)
+        )
+        self._tables[mode] = (rows.iloc[order].set_index('comid'), slices, order)
+        return self._tables[mode]
+
+    def select(
+        self,
+        comid_type: str,
+        run_group: str, 
+        run_type: str = 'single', 
+        ps: bool = False,
+    ) -> pd.DataFrame:
+        """Select wikiSRAT results by run_group, source name, or run_type.
+
+        Returns the same rows as `select_run()`, in the same order.
+
+        Args:
+            comid_type: 'reach' or 'catch'
+            run_group: Run group name
+            run_type: 'single' HUC08 or 'combined' HUC08s. Defaults to 'single'
+            ps: Values derived from point sources (True) or totals from all 
+                sources (False). Defaults to False.
+
+        Returns:
+            A dataframe of a single set of wikiSRAT results for every COMID,
+            with COMID set as the index. Without copy-on-write, a 
+            single-source selection shares data with the index, so copy it 
+            before editing values in place.
+        """
+        if comid_type == 'reach':
+            ps_name = 'Point Source Derived Concentration'
+        elif comid_type == 'catch':
+            ps_name = 'Point Sources'
+        else:
+            raise ValueError("comid_type must be 'reach' or 'catch'")
+
+        mode = self._mode(run_type)
+        table, slices, order = self._table(mode)
+        key = (mode, run_group, run_type, ps_name, ps)
+        if key not in self._selections:
+            group = (run_group, run_type) if mode == 'single' else (run_group,)
+            sources = slices.get(group, {})
+            selected = [
+                rows for source, rows in sources.items() 
+                if (source == ps_name) == ps
+            ]
+            if len(selected) == 1:
+                self._selections[key] = selected[0]
+            else:
+                # Several sources, so restore the original row order
+                positions = np.concatenate(
+                    [np.arange(rows.start, rows.stop) for rows in selected]
+                ) if selected else np.array([], dtype=np.int64)
+                self._selections[key] = positions[
+                    np.argsort(order[positions])
+                ]
+
+        return table.iloc[self._selections[key]]
+
+
+_run_indexes = {}
+"""dict: `RunIndex` of the results DataFrames most recently passed to 
+`select_run()`, by `id()` of the DataFrame.
+"""
+
+_run_index_cache_size = 4
+"""int: Number of results DataFrames to keep a `RunIndex` of."""
+
+
+def _run_index(df_in: pd.DataFrame) -> RunIndex:
+    """The cached `RunIndex` of a results DataFrame, or a new one if the 
+    DataFrame wasn't indexed, or changed shape since it was.
+
+    The cache holds a reference to each DataFrame, so an `id()` can't be 
+    reused by another frame while it's cached. Values edited in place, 
+    without changing the shape, aren't detected.
+    """
+    key = id(df_in)
+    index = _run_indexes.pop(key, None)
+    if index is None or index.df is not df_in or index.shape != df_in.shape:
+        index = RunIndex(df_in)
+    # Re-insert, so the least recently used index is first
+    _run_indexes[key] = index
+    while len(_run_indexes) > _run_index_cache_size:
+        del _run_indexes[next(iter(_run_indexes))]
+    return index
+
+
 def select_run(
     comid_type: str,
-    df_in: pd.DataFrame, 
+    df_in: pd.DataFrame | RunIndex, 
     run_group: str, 
     run_type: str = 'single', 
     ps: bool = False,
@@ -142,9 +296,13 @@ def select_run(
     Select a single set of values for every COMID, by selecting the run group 
     and whether or not you want point source values or totals (default)
 
+    The results are indexed by `RunIndex` on the first call with a 
+    DataFrame, and the index is cached for later calls with the same frame.
+
     Args:
         comid_type: 'reach' or 'catch'
-        df_in: WikiSRAT results for multiple run groups
+        df_in: WikiSRAT results for multiple run groups, or a `RunIndex` of 
+            them
         run_group: Run group name
         run_type: 'single' HUC08 or 'combined' HUC08s. Defaults to 'single'
         ps: Values derived from point sources (True) or totals from all 
@@ -154,42 +312,15 @@ def select_run(
         A dataframe of a single set of wikiSRAT results for every COMID,
         with COMID set as the index. 
     """
-    if comid_type == 'reach':
-        ps_name = 'Point Source Derived Concentration'
-    elif comid_type == 'catch':
-        ps_name = 'Point Sources'
-    else:
-        print("Error: comid_type must be 'reach' or 'catch'")
-
-    if (run_type=='combined') or ('run_type' not in df_in):
-        if run_type == 'combined':
-            # Drop 'single' row only if 'combined' doesn't also exist
-            df_in = df_in.drop_duplicates(
-                subset=['comid', 'Source', 'run_group'],
-                keep='last',
-            )
-        df_out = df_in.loc[
-            (df_in.run_group == run_group) 
-            & (df_in.Source == ps_name if ps == True else df_in.Source != ps_name)
-        ]
-    elif run_type == 'single':
-        df_out = df_in.loc[
-            (df_in.run_group == run_group) 
-            & (df_in.run_type == run_type)
-            & (df_in.Source == ps_name if ps == True else df_in.Source != ps_name)
-        ]
-    else:
-        print("run_type must be 'single' or 'combined'")
-
-    df_out.set_index('comid', inplace=True)
-
-    return df_out
+    if not isinstance(df_in, RunIndex):
+        df_in = _run_index(df_in)
+    return df_in.select(comid_type, run_group, run_type, ps)
 
 
 def join_results(
     comid_type: str,
     gdf: gpd.GeoDataFrame,
-    df_in: pd.DataFrame, 
+    df_in: pd.DataFrame | RunIndex, 
     run_group: str, 
     run_type: str = 'single', 
     ps: bool = False,
@@ -218,7 +349,7 @@ def join_results(
 
 def calc_loadrate(
     gdf: gpd.GeoDataFrame,
-    df_in: pd.DataFrame, 
+    df_in: pd.DataFrame | RunIndex, 
     pollutant_key: str,
     run_group: str, 
     run_type: str = 'single', 
@@ -296,7 +427,7 @@ def add_excess(comid_type: str, gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
 def add_ps(
     comid_type: str, 
     gdf: gpd.GeoDataFrame,
-    df_in: pd.DataFrame,
+    df_in: pd.DataFrame | RunIndex,
     run_type: str = 'single',
 ) -> gpd.GeoDataFrame:
     """ Add point source pollution columns to the combined 
@@ -338,7 +469,7 @@ def add_ps(
 def add_xsnps(
     comid_type: str, 
     gdf: gpd.GeoDataFrame,
-    df_in: pd.DataFrame,
+    df_in: pd.DataFrame | RunIndex,
     run_type: str = 'single',
 ) -> gpd.GeoDataFrame:
     """ Add calculated excess non-point source pollution columns to the combined 
@@ -388,7 +519,7 @@ def add_xsnps(
 def add_reduced(
     comid_type: str, 
     gdf: gpd.GeoDataFrame,
-    df_in: pd.DataFrame,
+    df_in: pd.DataFrame | RunIndex,
     group_key: int, 
     run_type: str = 'single',
 ) -> gpd.GeoDataFrame:
@@ -435,7 +566,7 @@ def add_reduced(
 def add_remaining(
     comid_type: str, 
     gdf: gpd.GeoDataFrame,
-    df_in: pd.DataFrame,
+    df_in: pd.DataFrame | RunIndex,
     group_key: int, 
     run_type: str = 'single',
 ) -> gpd.GeoDataFrame:
@@ -490,7 +621,7 @@ def add_remaining(
 def add_avoided(
     comid_type: str, 
     gdf: gpd.GeoDataFrame,
-    df_in: pd.DataFrame,
+    df_in: pd.DataFrame | RunIndex,
     group_key: int, 
     run_type: str = 'single',
 ) -> gpd.GeoDataFrame:
@@ -534,6 +665,148 @@ def add_avoided(
     
     return gdf
 
+def pivot_runs(
+    comid_type: str,
+    index: pd.Index,
+    df_in: pd.DataFrame | RunIndex,
+    run_type: str = 'single',
+) -> np.ndarray:
+    """ Pivot long wikiSRAT results into a dense array, in one pass.
+
+    Selects the same rows as `select_run()` for every run group and for both
+    point source and total values at once.
+
+    Args:
+        comid_type: 'reach' or 'catch'
+        index: COMIDs to pivot onto, such as the index of the PA2 results GDF
+        df_in: WikiSRAT results for multiple run groups
+        run_type: 'single' HUC08 or 'combined' HUC08s. Defaults to 'single'
+
+    Returns:
+        A float array with shape (COMID, run_group key, ps, pollutant), where 
+        ps is 0 for totals from all sources and 1 for point source values, 
+        and pollutants are ordered as in the `pollutants` dict. 
+        Missing values are NaN.
+    """
+    if isinstance(df_in, RunIndex):
+        df_in = df_in.df
+
+    if comid_type == 'reach':
+        ps_name = 'Point Source Derived Concentration'
+    elif comid_type == 'catch':
+        ps_name = 'Point Sources'
+    else:
+        raise ValueError("comid_type must be 'reach' or 'catch'")
+    if run_type not in run_types:
+        raise ValueError("run_type must be 'single' or 'combined'")
+
+    comid_pos = index.get_indexer(df_in['comid'])
+    group_pos = pd.Categorical(
+        df_in['run_group'], categories=list(run_groups.values()),
+    ).codes
+    ps_pos = (df_in['Source'] == ps_name).to_numpy(dtype=np.int64)
+    keep = (comid_pos >= 0) & (group_pos >= 0)
+    if run_type == 'single' and 'run_type' in df_in:
+        keep &= (df_in['run_type'] == run_type).to_numpy(dtype=bool)
+
+    # Flat cell number for every row, so duplicates can be resolved at once
+    shape = (len(index), len(run_groups), 2, len(pollutants))
+    cell = np.ravel_multi_index(
+        (comid_pos[keep], group_pos[keep], ps_pos[keep]), shape[:3],
+    )
+    values = df_in.loc[keep, list(pollutants.keys())].to_numpy(dtype=np.float64)
+    # Keep the last row for each cell, like `drop_duplicates(keep='last')`
+    _, last = np.unique(cell[::-1], return_index=True)
+    last = len(cell) - 1 - last
+
+    pivot = np.full((np.prod(shape[:3]), shape[3]), np.nan)
+    pivot[cell[last]] = values[last]
+    return pivot.reshape(shape)
+
+
+def compute_scenarios(
+    comid_type: str, 
+    gdf: gpd.GeoDataFrame,
+    df_in: pd.DataFrame | RunIndex,
+    run_type: str = 'single',
+    restoration_keys: tuple[int, ...] = (1, 2, 3),
+    protection_key: int = 4,
+) -> gpd.GeoDataFrame:
+    """ Add all calculated scenario columns to the PA2 results GeoDataFrame, 
+    from a single pivot of the wikiSRAT results.
+
+    Gives the same `_xs`, `_ps`, `_xsnps`, `_red`, `_rem` and `_avoid` columns 
+    as calling `add_excess()`, `add_ps()`, `add_xsnps()`, `add_reduced()`, 
+    `add_remaining()` and `add_avoided()` with the same `run_type`. Like 
+    `add_excess()`, excess values are from the GDF's existing 
+    `{pollutant}_{quantity_type}` columns, which can be from another run type 
+    than the reductions (e.g. combined baseline with single HUC08 reductions).
+
+    Args:
+        comid_type: 'reach' or 'catch'
+        gdf: PA2 results GeoDataFrame with geometries for mapping
+        df_in: WikiSRAT results for multiple run groups
+        run_type: 'single' HUC08 or 'combined' HUC08s. Defaults to 'single'
+        restoration_keys: Run group keys for reduced and remaining columns.
+            Defaults to (1, 2, 3).
+        protection_key: Run group key for avoided columns. Defaults to 4.
+
+    Returns:
+        The input GeoDataFrame with all scenario columns added.
+    """
+    if comid_type == 'reach':
+        quantity_type = 'conc'
+        normalize_by = np.ones(len(gdf.index))
+    elif comid_type == 'catch':
+        quantity_type = 'loadrate'
+        normalize_by = gdf.catchment_hectares.to_numpy(dtype=np.float64)
+    else:
+        raise ValueError("comid_type must be 'reach' or 'catch'")
+
+    pivot = pivot_runs(comid_type, gdf.index, df_in, run_type)
+    # Broadcast area over (COMID, pollutant) slices of the pivot
+    normalize_by = normalize_by[:, np.newaxis]
+    names = list(pollutants.values())
+    target = np.array(
+        [targets[pollutant][f'{quantity_type}_target'] for pollutant in names]
+    )
+
+    base = pivot[:, 0, 0, :]
+    ps = pivot[:, 0, 1, :] / normalize_by
+    xs = (
+        gdf[[f'{pollutant}_{quantity_type}' for pollutant in names]]
+        .to_numpy(dtype=np.float64) 
+        - target
+    )
+    xsnps = xs - ps
+    if comid_type == 'catch':
+        # Set 'tss_loadrate_xsnps' = 'tss_loadrate_xs', to avoid NaN
+        xsnps[:, names.index('tss')] = xs[:, names.index('tss')]
+    reduced = {
+        key: (base - pivot[:, key, 0, :]) / normalize_by 
+        for key in restoration_keys
+    }
+    avoided = (pivot[:, protection_key, 0, :] - base) / normalize_by
+
+    # Add columns in the same order as the `add_` functions
+    def add_columns(calc_suffix: str, values: np.ndarray) -> None:
+        for i, pollutant in enumerate(names):
+            gdf[f'{pollutant}_{quantity_type}_{calc_suffix}'] = values[:, i]
+
+    add_columns('xs', xs)
+    add_columns('ps', ps)
+    if comid_type == 'catch':
+        gdf['tss_loadrate_xsnps'] = xsnps[:, names.index('tss')]
+    add_columns('xsnps', xsnps)
+    for key in restoration_keys:
+        add_columns(f'red{key}', reduced[key])
+    for key in restoration_keys:
+        add_columns(f'rem{key}', xsnps - reduced[key])
+    add_columns('avoid', avoided)
+
+    return gdf
+
+
 # Adapted from `are_fromhucs_in_index()` in `stage2/PA2_2b_AggregateAttenuated.ipynb`
 def are_inlets_in_index(
     df: pd.DataFrame,
@@ -541,9 +814,11 @@ def are_inlets_in_index(
 ) -> np.ndarray[bool]:
     """Determines if each HUC or basin ID in an array is in a dataframe's index.
     Returns a boolean array corresponding to the input array.
+    Inlets can be an array, or a list like the cells of the Arrow list
+    columns from `storage.read_parquet()`.
     """
-    if type(inlets) == np.ndarray:
-        inarray = np.isin(inlets, df.index)
+    if isinstance(inlets, (np.ndarray, list, tuple)):
+        inarray = np.isin(np.asarray(inlets), df.index)
     else:
         inarray = False
     return inarray
@@ -558,7 +833,8 @@ def get_inlet_loads(
     var = f'{pollutant}_load{var_suffix}'
     """
     inlets_array = df.at[index_value,inlets_column]
-    if type(inlets_array) == np.ndarray:
+    if isinstance(inlets_array, (np.ndarray, list, tuple)):
+        inlets_array = np.asarray(inlets_array)
         inlets_mask = are_inlets_in_index(df, inlets_array)
         ds = df[var][inlets_array[inlets_mask]]
     else:
@@ -578,4 +854,503 @@ def calc_net_load(
     net = (df.at[index_value,var]
         - sum(get_inlet_loads(df, inlets_column, index_value, var))
     )
-    return net
\ No newline at end of file
+    return net
+
+
+# *****************************************************************************
+# Network functions
+# *****************************************************************************
+
+def inlet_pairs(
+    df: pd.DataFrame,
+    inlets_column: str,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Flattens an inlets column (e.g. `from_comids`) into (row, inlet) 
+    positional pairs. 
+
+    Inlets that aren't in the dataframe's index are dropped, like in 
+    `are_inlets_in_index()`. Rows with no inlets (None or NaN) are skipped.
+    Arrow list columns from `storage.read_parquet()` are flattened without
+    per-row conversion.
+
+    Args:
+        df: DataFrame indexed by COMID or HUC, with an inlets column
+        inlets_column: Name of the column with arrays of upstream IDs, as an
+            object column or Arrow list column
+
+    Returns:
+        Two integer arrays of equal length, with the position of each row and 
+        the position of each of that row's inlets.
+    """
+    offsets, values = storage.list_offsets(df[inlets_column])
+    rows = np.repeat(np.arange(len(df.index), dtype=np.int64), np.diff(offsets))
+    cols = df.index.get_indexer(values)
+    in_index = cols >= 0
+    return rows[in_index], cols[in_index].astype(np.int64)
+
+
+def inlet_matrix(
+    df: pd.DataFrame,
+    inlets_column: str,
+) -> sparse.csr_array:
+    """Builds a sparse adjacency matrix from an inlets column.
+
+    Element [i, j] is 1 when the row at position j flows into the row at 
+    position i, so that `inlet_matrix @ values` sums the inlet values of every
+    row in a single sparse matrix product.
+
+    Args:
+        df: DataFrame indexed by COMID or HUC, with an inlets column
+        inlets_column: Name of the column with arrays of upstream IDs, 
+            such as 'from_comids' or 'from_huc12s'
+
+    Returns:
+        A square (n x n) CSR matrix, where n is the length of the dataframe.
+    """
+    rows, cols = inlet_pairs(df, inlets_column)
+    n = len(df.index)
+    return sparse.csr_array(
+        (np.ones(len(rows), dtype=np.float64), (rows, cols)), shape=(n, n),
+    )
+
+
+def calc_net_loads(
+    df: pd.DataFrame, 
+    inlets_column: str,
+    vars: list[str],
+    adjacency: sparse.csr_array | None = None,
+) -> pd.DataFrame:
+    """Calculates net loads for many variables at once, 
+    by subtracting inflow loads from outflow load.
+
+    A vectorized version of `calc_net_load()`, giving identical results 
+    (including NaN when any inlet value is NaN) for every row and variable.
+
+    Args:
+        df: DataFrame indexed by COMID or HUC, with an inlets column
+        inlets_column: Name of the column with arrays of upstream IDs
+        vars: Columns to net, e.g. [f'{pollutant}_load{var_suffix}', ...]
+        adjacency: Optional matrix from `inlet_matrix()`, to reuse across 
+            calls. Defaults to None, which builds it from `inlets_column`.
+
+    Returns:
+        A DataFrame with the same index as `df` and a `{var}_net` column 
+        for every variable.
+    """
+    if adjacency is None:
+        adjacency = inlet_matrix(df, inlets_column)
+    values = df[vars].to_numpy(dtype=np.float64)
+    net = values - adjacency @ values
+    return pd.DataFrame(
+        net, index=df.index, columns=[f'{var}_net' for var in vars],
+    )
+
+
+def add_net_loads(
+    df: pd.DataFrame, 
+    inlets_column: str,
+    vars: list[str],
+) -> pd.DataFrame:
+    """Add net load columns (`{var}_net`) to a DataFrame, for every variable.
+
+    Args:
+        df: DataFrame indexed by COMID or HUC, with an inlets column
+        inlets_column: Name of the column with arrays of upstream IDs
+        vars: Columns to net, e.g. [f'{pollutant}_load{var_suffix}', ...]
+
+    Returns:
+        The input DataFrame with an extra `_net` column for each variable.
+    """
+    net_df = calc_net_loads(df, inlets_column, vars)
+    for column in net_df.columns:
+        df[column] = net_df[column]
+
+    return df
+
+
+def nested_set_matrix(
+    df: pd.DataFrame,
+    nord_column: str = 'nord',
+    nordstop_column: str = 'nordstop',
+) -> sparse.csr_array:
+    """Builds the same sparse adjacency matrix as `inlet_matrix()`, from 
+    NHDPlus nested-set ordering instead of an inlets column.
+
+    Each reach's upstream network has `nord` values in the interval 
+    [`nord`, `nordstop`], so the reach directly downstream of another is the 
+    nearest enclosing interval. Rows missing either value are left 
+    unconnected.
+
+    Args:
+        df: DataFrame indexed by COMID, with nested-set ordering columns
+        nord_column: Name of the column with each reach's nested-set order.
+            Defaults to 'nord'.
+        nordstop_column: Name of the column with the largest `nord` upstream 
+            of each reach. Defaults to 'nordstop'.
+
+    Returns:
+        A square (n x n) CSR matrix, where element [i, j] is 1 when the row 
+        at position j flows into the row at position i.
+    """
+    n = len(df.index)
+    valid = (df[nord_column].notna() & df[nordstop_column].notna()).to_numpy()
+    rows = np.flatnonzero(valid)
+    nord = df[nord_column].to_numpy()[valid].astype(np.int64)
+    nordstop = df[nordstop_column].to_numpy()[valid].astype(np.int64)
+
+    # Sort by nord, which orders reaches from outlets to headwaters
+    order = np.argsort(nord, kind='stable')
+    nord, nordstop, rows = nord[order], nordstop[order], rows[order]
+    parents = network.nested_set_parents(nord, nordstop)
+    has_downstream = parents >= 0
+    downstream = parents[has_downstream]
+
+    return sparse.csr_array(
+        (
+            np.ones(len(downstream), dtype=np.float64),
+            (rows[downstream], rows[has_downstream]),
+        ),
+        shape=(n, n),
+    )
+
+
+def network_levels(
+    df: pd.DataFrame,
+    inlets_column: str = 'from_comids',
+    adjacency: sparse.csr_array | None = None,
+) -> pd.Series:
+    """Topologically orders a network into levels, from headwaters down.
+
+    Headwaters (rows without inlets) are level 0, and every other row is one 
+    level below its deepest inlet, so all of a row's inlets are always on 
+    lower levels.
+
+    Args:
+        df: DataFrame indexed by COMID or HUC, with an inlets column
+        inlets_column: Name of the column with arrays of upstream IDs. 
+            Defaults to 'from_comids'.
+        adjacency: Optional matrix from `inlet_matrix()` or 
+            `nested_set_matrix()`. Defaults to None, which builds it from 
+            `inlets_column`.
+
+    Returns:
+        A Series of integer levels, with the same index as `df`.
+    """
+    if adjacency is None:
+        adjacency = inlet_matrix(df, inlets_column)
+    adjacency = sparse.csr_array(adjacency)
+    adjacency.sum_duplicates()
+    n = adjacency.shape[0]
+    # Row j of `outlets` lists the rows that row j flows into
+    outlets = sparse.csr_array(adjacency.T)
+
+    level = np.full(n, -1, dtype=np.int64)
+    remaining = np.diff(adjacency.indptr)
+    frontier = np.flatnonzero(remaining == 0)
+    current = 0
+    while frontier.size > 0:
+        level[frontier] = current
+        downstream, counts = np.unique(
+            outlets[frontier].indices, return_counts=True,
+        )
+        remaining[downstream] -= counts
+        frontier = downstream[remaining[downstream] == 0]
+        current += 1
+
+    if (level < 0).any():
+        raise ValueError(
+            'Network contains cycles, including: '
+            f'{list(df.index[level < 0][:10])}'
+        )
+    return pd.Series(level, index=df.index, name='level')
+
+
+def accumulate_loads(
+    df: pd.DataFrame,
+    inlets_column: str,
+    vars: list[str],
+    attenuation: pd.Series | pd.DataFrame | None = None,
+    adjacency: sparse.csr_array | None = None,
+    skipna: bool = True,
+) -> pd.DataFrame:
+    """Accumulates local loads downstream through a stream network.
+
+    Routes loads level by level from the headwaters, so that each row's 
+    cumulative load is its local load plus the cumulative loads of its inlets,
+    reduced by that row's attenuation:
+
+    ```
+    var_cum = (var + sum(inlet var_cum)) * (1 - attenuation)
+    ```
+
+    Args:
+        df: DataFrame indexed by COMID or HUC, with an inlets column
+        inlets_column: Name of the column with arrays of upstream IDs
+        vars: Local load columns to accumulate, e.g. ['tp_load', ...]
+        attenuation: Optional fraction of load lost in each reach, as a 
+            Series for all variables or a DataFrame with a column for each 
+            variable. Missing values are treated as no attenuation. 
+            Defaults to None, for conservative (unattenuated) routing.
+        adjacency: Optional matrix from `inlet_matrix()` or 
+            `nested_set_matrix()`. Defaults to None, which builds it from 
+            `inlets_column`.
+        skipna: Treat missing local loads as zero (True) or propagate them 
+            downstream (False). Defaults to True.
+
+    Returns:
+        A DataFrame with the same index as `df` and a `{var}_cum` column 
+        for every variable.
+    """
+    if adjacency is None:
+        adjacency = inlet_matrix(df, inlets_column)
+    level = network_levels(df, adjacency=adjacency).to_numpy()
+
+    local = df[vars].to_numpy(dtype=np.float64)
+    if skipna:
+        local = np.nan_to_num(local, nan=0.0)
+    if attenuation is None:
+        passed = np.ones_like(local)
+    elif isinstance(attenuation, pd.DataFrame):
+        attenuation = attenuation.reindex(index=df.index, columns=vars)
+        passed = 1 - attenuation.fillna(0).to_numpy(dtype=np.float64)
+    else:
+        attenuation = attenuation.reindex(df.index).fillna(0)
+        passed = np.repeat(
+            1 - attenuation.to_numpy(dtype=np.float64)[:, np.newaxis],
+            len(vars), axis=1,
+        )
+
+    # Permute rows into level order, so each level is a contiguous block 
+    # whose inlets are all in earlier blocks
+    order = np.argsort(level, kind='stable')
+    routed = sparse.csr_array(adjacency)[order][:, order]
+    bounds = np.searchsorted(level[order], np.arange(level.max(initial=-1) + 2))
+    local, passed = local[order], passed[order]
+
+    cum = np.zeros_like(local)
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        cum[start:stop] = (
+            local[start:stop] + routed[start:stop] @ cum
+        ) * passed[start:stop]
+
+    out = np.empty_like(cum)
+    out[order] = cum
+    return pd.DataFrame(
+        out, index=df.index, columns=[f'{var}_cum' for var in vars],
+    )
+
+
+# *****************************************************************************
+# Aggregation functions
+# *****************************************************************************
+
+def _group_codes(series: pd.Series) -> tuple[np.ndarray, pd.Index]:
+    """Integer codes for a grouping column, with missing values coded as the 
+    number of groups (i.e. sorted last), and the group labels.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy(dtype=np.int64)
+        labels = series.cat.categories
+    else:
+        codes, labels = pd.factorize(series, sort=True)
+        codes = codes.astype(np.int64)
+    codes[codes < 0] = len(labels)
+    return codes, labels
+
+
+def _group_sums(
+    codes: np.ndarray,
+    values: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Sums rows of a 2D array by integer codes, with one sort and one 
+    `np.add.reduceat()` pass. Returns the observed codes and their sums.
+    """
+    order = np.argsort(codes, kind='stable')
+    observed, starts = np.unique(codes[order], return_index=True)
+    if len(starts) == 0:
+        return observed, np.zeros((0, values.shape[1]))
+    return observed, np.add.reduceat(values[order], starts, axis=0)
+
+
+def rollup(
+    df: pd.DataFrame,
+    levels: tuple[str | tuple[str, ...], ...] = ('huc12', 'huc10', 'huc08'),
+    columns: list[str] | None = None,
+    dropna: bool = True,
+) -> dict[str | tuple[str, ...], pd.DataFrame]:
+    """Sums columns by several grouping levels at once, such as summing 
+    catchment loads by HUC12, HUC10, HUC08, cluster and focus area.
+
+    Catchments are summed once, by each distinct combination of all grouping 
+    columns, and every level is then summed from those combinations. So 
+    HUC10 and HUC08 sums come from HUC12 sums rather than re-scanning all 
+    COMIDs. Results match `df.groupby(level, observed=True)[columns].sum()` 
+    for each level.
+
+    Args:
+        df: DataFrame with grouping columns, such as `catch_loads_gdf`
+        levels: Columns to group by. A tuple of columns groups by their 
+            combinations, such as ('cluster', 'fa_name_phase'). 
+            Defaults to ('huc12', 'huc10', 'huc08').
+        columns: Columns to sum. Defaults to all numeric columns that aren't 
+            grouping columns. Missing values count as zero.
+        dropna: Drop groups with missing grouping values, as with 
+            `groupby()`. If False, missing values are kept as their own 
+            group (e.g. Cluster loads not in Focus Areas). Defaults to True.
+
+    Returns:
+        A dictionary of DataFrames, one per level, plus a 'total' DataFrame 
+        with sums over all rows ('all') and over rows missing each single 
+        column level (e.g. 'no_cluster').
+    """
+    keys = list(dict.fromkeys(
+        column
+        for level in levels
+        for column in (level if isinstance(level, tuple) else (level,))
+    ))
+    if columns is None:
+        columns = [
+            column for column in df.select_dtypes('number').columns
+            if column not in keys
+        ]
+
+    values = df[columns].to_numpy(dtype=np.float64, na_value=np.nan, copy=True)
+    values[np.isnan(values)] = 0
+
+    # Number every distinct combination of grouping values
+    codes = {}
+    labels = {}
+    combination = np.zeros(len(df.index), dtype=np.int64)
+    for key in keys:
+        codes[key], labels[key] = _group_codes(df[key])
+        combination = combination * (len(labels[key]) + 1) + codes[key]
+        combination = pd.factorize(combination)[0].astype(np.int64)
+
+    # The single pass over all rows
+    observed, sums = _group_sums(combination, values)
+    # First row of each combination, in the order of `observed`
+    _, first = np.unique(combination, return_index=True)
+    codes = {key: codes[key][first] for key in keys}
+
+    # Sums are float64, except for integer, boolean & other float columns
+    dtypes = {}
+    for column in columns:
+        dtype = df[column].dtype
+        if pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+            dtypes[column] = np.int64
+        elif pd.api.types.is_float_dtype(dtype) and dtype != np.float64:
+            dtypes[column] = dtype
+
+    out = {}
+    for level in levels:
+        level_keys = level if isinstance(level, tuple) else (level,)
+        shape = tuple(len(labels[key]) + 1 for key in level_keys)
+        level_codes = np.ravel_multi_index(
+            tuple(codes[key] for key in level_keys), shape,
+        )
+        level_observed, level_sums = _group_sums(level_codes, sums)
+        key_codes = np.unravel_index(level_observed, shape)
+        keep = np.ones(len(level_observed), dtype=bool)
+        arrays = []
+        for key, key_code in zip(level_keys, key_codes):
+            missing = key_code == len(labels[key])
+            keep &= ~missing
+            key_code = np.where(missing, -1, key_code)
+            if isinstance(df[key].dtype, pd.CategoricalDtype):
+                arrays.append(pd.Categorical.from_codes(key_code, dtype=df[key].dtype))
+            else:
+                arrays.append(labels[key].take(key_code, allow_fill=True))
+        if dropna:
+            arrays = [array[keep] for array in arrays]
+            level_sums = level_sums[keep]
+        if isinstance(level, tuple):
+            index = pd.MultiIndex.from_arrays(arrays, names=list(level))
+        else:
+            index = pd.Index(arrays[0], name=level)
+        out[level] = pd.DataFrame(
+            level_sums, index=index, columns=columns,
+        ).astype(dtypes)
+
+    totals = {'all': sums.sum(axis=0)}
+    for level in levels:
+        if not isinstance(level, tuple):
+            missing = codes[level] == len(labels[level])
+            totals[f'no_{level}'] = sums[missing].sum(axis=0)
+    out['total'] = pd.DataFrame.from_dict(
+        totals, orient='index', columns=columns,
+    ).astype(dtypes)
+
+    return out
+
+
+def disaggregate(
+    parent_values: pd.DataFrame,
+    child_to_parent: pd.Series,
+    weights: pd.Series | pd.DataFrame,
+    weight_columns: dict[str, str] | None = None,
+) -> pd.DataFrame:
+    """Distributes values from parents to children in proportion to weights, 
+    such as HUC12 net loads to catchments by each catchment's share of the 
+    HUC12 load.
+
+    Each child's share is its weight over the sum of weights for its parent, 
+    computed once per weight column, and every parent column is then 
+    multiplied by the shares in one step.
+
+    Args:
+        parent_values: DataFrame indexed by parent ID, such as the `*_net` 
+            columns of `huc12_outlet_loads_gdf`
+        child_to_parent: Parent ID of each child, indexed by child ID, such 
+            as `catch_loads_gdf.huc12`
+        weights: Weights indexed by child ID. A Series weights every column 
+            the same, or a DataFrame has weights for each parent column, 
+            such as `catch_loads_gdf[['tn_load', 'tp_load', 'tss_load']]`.
+            Missing weights count as zero in parent totals.
+        weight_columns: Weight column for each parent column. Defaults to 
+            the weight column with the longest name that starts the parent 
+            column's name, e.g. 'tp_load' for 'tp_load_rem3_net'.
+
+    Returns:
+        A DataFrame indexed like `child_to_parent`, with the columns of 
+        `parent_values`. Children with a missing parent, or whose parent has 
+        no weight, are NaN.
+    """
+    columns = list(parent_values.columns)
+    if isinstance(weights, pd.Series):
+        weights = weights.to_frame()
+        weight_columns = {column: weights.columns[0] for column in columns}
+    elif weight_columns is None:
+        weight_columns = {}
+        for column in columns:
+            matches = [
+                name for name in weights.columns if column.startswith(name)
+            ]
+            if not matches:
+                raise ValueError(f'No weight column for {column}')
+            weight_columns[column] = max(matches, key=len)
+    used = list(dict.fromkeys(weight_columns[column] for column in columns))
+
+    codes = parent_values.index.get_indexer(child_to_parent)
+    has_parent = codes >= 0
+    w = weights.reindex(child_to_parent.index)[used].to_numpy(dtype=np.float64)
+
+    # Sum weights by parent, over category codes
+    totals = np.zeros((len(parent_values.index), len(used)))
+    observed, sums = _group_sums(
+        codes[has_parent], np.nan_to_num(w[has_parent], nan=0.0),
+    )
+    totals[observed] = sums
+
+    shares = np.full_like(w, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares[has_parent] = w[has_parent] / totals[codes[has_parent]]
+    shares[~np.isfinite(shares)] = np.nan
+
+    values = np.full((len(codes), len(columns)), np.nan)
+    values[has_parent] = parent_values.to_numpy(dtype=np.float64)[codes[has_parent]]
+    share_position = [used.index(weight_columns[column]) for column in columns]
+    return pd.DataFrame(
+        values * shares[:, share_position],
+        index=child_to_parent.index,
+        columns=columns,
+    )
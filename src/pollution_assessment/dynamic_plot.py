@@ -8,14 +8,22 @@ import geoviews as gv
 import hvplot
 import matplotlib
 import matplotlib.pyplot as plt
+from functools import cache
 from mpl_toolkits.axes_grid1 import AxesGrid
-hv.extension("bokeh")
 from bokeh.models import HoverTool
 
 warnings.filterwarnings('ignore', message='.*Iteration over multi-part geometries is deprecated and will be removed in Shapely 2.0. Use the `geoms` property to access the constituent parts of a multi-part geometry*')
 
 DIFF_SUFFIXES = ['xs', 'rem']
 
+@cache
+def load_extension() -> None:
+	'''
+	Loads the holoviews bokeh extension, on the first plot call rather than 
+	on import. 
+	'''
+	hv.extension("bokeh")
+
 def project_gdf(gdf: gpd.geodataframe.GeoDataFrame) -> gpd.geodataframe.GeoDataFrame:
 	'''
 	Geoviews requires certain projections for plotting
@@ -266,6 +274,8 @@ def plot(
 	Returns:
 		TBD
 	''' 
+	load_extension()
+
 	# determine if HUC plot 
 	if gdf.index.name == 'huc12':
 		huc = True
@@ -338,6 +348,7 @@ def plot_polys(gdf: gpd.geodataframe.GeoDataFrame, var: str, **kwargs) -> gv.ele
 	Returns:
 		poly_map: 	Polygon map colored by variable of choice plotted on basemap. 
 	'''
+	load_extension()
 	gdf[gdf.index.name] = gdf.index 
 	poly_map = gv.Polygons(gdf, vdims=[gdf.index.name, var]).opts(
 																	height = kwargs['height'],
@@ -366,6 +377,7 @@ def plot_lines(gdf: gpd.geodataframe.GeoDataFrame, var: str, **kwargs) -> gv.ele
 	Returns:
 		line_map: Polyline map colored by variable of choice plotted on basemap.  
 	'''
+	load_extension()
 	line_map = gv.Path(gdf, vdims=[var]).opts(
 												height = kwargs['height'],
 												width = kwargs['width'],
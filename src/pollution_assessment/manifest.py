@@ -0,0 +1,216 @@
+import json
+import hashlib
+import sqlite3
+import traceback
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import NamedTuple
+
+import pandas as pd
+
+
+# *****************************************************************************
+# Global variable objects
+# *****************************************************************************
+
+statuses = ['running', 'complete', 'failed']
+"""list: Status of a unit of work in a `RunManifest`. Units left 'running'
+are from a run that crashed or was stopped, and are run again on resume.
+"""
+
+
+class RunUnit(NamedTuple):
+    """Key of a unit of work in a batch run, such as one HUC8 and run group of
+    a SRAT run, or one HUC of a GWLF-E run.
+
+    `run_group` is '' for runs without run groups, and `input_hash` is from
+    `input_hash()` of everything sent to the model, so a unit with changed
+    inputs isn't skipped.
+    """
+    huc: str
+    land_use_layer: str
+    weather_layer: str
+    run_group: str
+    input_hash: str
+
+
+# *****************************************************************************
+# Functions
+# *****************************************************************************
+
+def input_hash(*inputs) -> str:
+    """SHA-256 hex digest of JSON-serializable inputs, such as a request
+    payload, that doesn't depend on the order of dict keys.
+    """
+    canonical = json.dumps(
+        inputs, sort_keys=True, separators=(',', ':'), default=str,
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+
+class RunManifest:
+    """A SQLite record of the units of work of a batch run, so that a run
+    can be resumed after a failure without repeating completed units.
+
+    Usage:
+        manifest = RunManifest(save_path + 'run_manifest.sqlite')
+        unit = RunUnit(huc, land_use_layer, weather_layer, run_group,
+                       input_hash(payload))
+        if not manifest.is_complete(unit):
+            manifest.start(unit)
+            try:
+                outputs = run(...)
+            except Exception as e:
+                manifest.fail(unit, e)
+            else:
+                manifest.complete(unit, outputs)
+
+    Args:
+        path: Path of the SQLite file, which is created if it doesn't exist
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(self.path)
+        with self._connection:
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS units (
+                    huc TEXT NOT NULL,
+                    land_use_layer TEXT NOT NULL,
+                    weather_layer TEXT NOT NULL,
+                    run_group TEXT NOT NULL,
+                    input_hash TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    outputs TEXT,
+                    error TEXT,
+                    started TEXT,
+                    finished TEXT,
+                    PRIMARY KEY (
+                        huc, land_use_layer, weather_layer, run_group, input_hash
+                    )
+                )
+            ''')
+
+    def close(self):
+        self._connection.close()
+
+    def status(self, unit: RunUnit) -> str | None:
+        """Status of a unit, or None if it was never started."""
+        row = self._connection.execute(
+            'SELECT status FROM units WHERE huc = ? AND land_use_layer = ? '
+            'AND weather_layer = ? AND run_group = ? AND input_hash = ?',
+            tuple(unit),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def is_complete(self, unit: RunUnit) -> bool:
+        """True if a unit with the same key and inputs completed."""
+        return self.status(unit) == 'complete'
+
+    def outputs(self, unit: RunUnit) -> dict | None:
+        """Output locations recorded when a unit completed."""
+        row = self._connection.execute(
+            'SELECT outputs FROM units WHERE huc = ? AND land_use_layer = ? '
+            'AND weather_layer = ? AND run_group = ? AND input_hash = ? '
+            "AND status = 'complete'",
+            tuple(unit),
+        ).fetchone()
+        return None if row is None or row[0] is None else json.loads(row[0])
+
+    def start(self, unit: RunUnit):
+        """Records that a unit started, counting an attempt."""
+        with self._connection:
+            self._connection.execute(
+                'INSERT INTO units (huc, land_use_layer, weather_layer, '
+                'run_group, input_hash, status, attempts, started) '
+                "VALUES (?, ?, ?, ?, ?, 'running', 1, ?) "
+                'ON CONFLICT (huc, land_use_layer, weather_layer, run_group, '
+                "input_hash) DO UPDATE SET status = 'running', "
+                'attempts = attempts + 1, error = NULL, started = excluded.started, '
+                'finished = NULL',
+                (*unit, _now()),
+            )
+
+    def complete(self, unit: RunUnit, outputs: dict | None = None):
+        """Records that a unit completed, with the locations of its outputs,
+        such as file paths.
+        """
+        with self._connection:
+            self._connection.execute(
+                "UPDATE units SET status = 'complete', outputs = ?, "
+                'error = NULL, finished = ? WHERE huc = ? AND '
+                'land_use_layer = ? AND weather_layer = ? AND run_group = ? '
+                'AND input_hash = ?',
+                (json.dumps(outputs, default=str), _now(), *unit),
+            )
+
+    def fail(self, unit: RunUnit, error: BaseException | str):
+        """Records that a unit failed, with the error."""
+        if isinstance(error, BaseException):
+            error = ''.join(traceback.format_exception(error))
+        with self._connection:
+            self._connection.execute(
+                "UPDATE units SET status = 'failed', error = ?, finished = ? "
+                'WHERE huc = ? AND land_use_layer = ? AND weather_layer = ? '
+                'AND run_group = ? AND input_hash = ?',
+                (error, _now(), *unit),
+            )
+
+    def _units_query(self, latest: bool) -> str:
+        """SELECT of the units, or with `latest`, of only the most recently
+        started input hash of each unit, so units re-run with changed inputs
+        aren't counted twice.
+        """
+        if not latest:
+            return 'SELECT * FROM units'
+        return (
+            'SELECT * FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY huc, '
+            'land_use_layer, weather_layer, run_group ORDER BY started DESC, '
+            'rowid DESC) AS recency FROM units) WHERE recency = 1'
+        )
+
+    def to_frame(
+        self,
+        status: str | None = None,
+        latest: bool = True,
+    ) -> pd.DataFrame:
+        """The units in the manifest, optionally only those with a status.
+
+        Args:
+            status: Status of the units to return. Defaults to None, for all.
+            latest: Whether to return only the most recently started
+                `input_hash` of each unit, leaving out failures that a run
+                with changed inputs has since superseded. Defaults to True.
+
+        Returns:
+            A DataFrame with a row per unit, with the key columns, 'status',
+            'attempts', 'outputs' (as a dict), 'error', and 'started' and
+            'finished' times.
+        """
+        query = f'SELECT * FROM ({self._units_query(latest)})'
+        params = ()
+        if status is not None:
+            query += ' WHERE status = ?'
+            params = (status,)
+        df = pd.read_sql_query(query, self._connection, params=params)
+        df = df.drop(columns='recency', errors='ignore')
+        df['outputs'] = df['outputs'].astype(object).map(
+            lambda outputs: json.loads(outputs) if isinstance(outputs, str) else None
+        )
+        return df
+
+    def summary(self, latest: bool = True) -> pd.Series:
+        """Number of units with each status, by default counting only the
+        most recently started `input_hash` of each unit.
+        """
+        counts = self._connection.execute(
+            f'SELECT status, COUNT(*) FROM ({self._units_query(latest)}) '
+            'GROUP BY status'
+        ).fetchall()
+        return pd.Series(dict(counts), dtype=int).reindex(statuses, fill_value=0)
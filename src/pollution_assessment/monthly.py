@@ -0,0 +1,518 @@
+import os
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from pollution_assessment.calc import pollutants, targets
+
+
+# *****************************************************************************
+# Global variable objects
+# *****************************************************************************
+
+months = list(range(1, 13))
+"""list: Months of the month axis of a `MonthlyCube`. GWLF-E's monthly
+results are the mean of each calendar month over the years of the run.
+"""
+
+seasons = {
+    'winter': [12, 1, 2],
+    'spring': [3, 4, 5],
+    'summer': [6, 7, 8],
+    'fall': [9, 10, 11],
+}
+"""dict: Months of each season, for `seasonal()` and
+`estimated_flow_weighted_conc()`.
+"""
+
+water_variables = [
+    'AvPrecipitation',
+    'AvEvapoTrans',
+    'AvGroundWater',
+    'AvRunoff',
+    'AvStreamFlow',
+    'AvPtSrcFlow',
+    'AvTileDrain',
+    'AvWithdrawal',
+]
+"""list: The monthly water balance of GWLF-E, in cm of water over the area of
+the HUC.
+"""
+
+liters_per_cm_ha = 1e5
+"""float: Liters of water 1 cm deep over 1 ha."""
+
+
+# *****************************************************************************
+# Classes
+# *****************************************************************************
+
+class MonthlyCube:
+    """Monthly GWLF-E results of many HUCs as one dense array, with a HUC,
+    month and variable axis, for vectorized questions about seasonality.
+
+    The variables are the GWLF-E `water_variables` (cm), and monthly loads
+    (kg) of the `calc.pollutants` keys ('TotalN', 'TotalP', 'Sediment') once
+    added with `apportion_loads()`. GWLF-E doesn't output monthly loads: the
+    monthly loads are estimates, made by splitting the annual loads of GWLF-E
+    by a monthly water variable, recorded in `load_weights`. A saved cube is
+    opened memory-mapped, so only the parts of it that are used are read from
+    disk.
+
+    Usage:
+        cube = MonthlyCube.from_results(
+            gwlfe_monthly_q, gwlfe_summ_q, raw_load_summaries,
+        )
+        cube.save(save_path + 'monthly_cube')
+        cube = MonthlyCube.open(save_path + 'monthly_cube')
+        seasonal(cube, water_variables)
+
+    Args:
+        values: Array of shape (HUCs, 12, variables)
+        hucs: HUC IDs, in the order of the first axis
+        variables: Variable names, in the order of the last axis
+        area_ha: Area (ha) of each HUC, needed for flow volumes,
+            concentrations and load rates. Defaults to None.
+        load_weights: Water variable each pollutant's monthly loads were
+            split by, set by `apportion_loads()`. Defaults to none.
+    """
+
+    def __init__(
+        self,
+        values: np.ndarray,
+        hucs: list[str] | pd.Index,
+        variables: list[str],
+        area_ha: np.ndarray | None = None,
+        load_weights: dict[str, str] | None = None,
+    ):
+        self.values = values
+        self.hucs = pd.Index(hucs, name='huc')
+        self.variables = list(variables)
+        self.area_ha = None if area_ha is None else np.asarray(area_ha, dtype=float)
+        self.load_weights = {} if load_weights is None else dict(load_weights)
+        shape = (len(self.hucs), len(months), len(self.variables))
+        if values.shape != shape:
+            raise ValueError(f'values have shape {values.shape}, not {shape}')
+        if not self.hucs.is_unique:
+            raise ValueError('HUCs must be unique')
+        if self.area_ha is not None and self.area_ha.shape != (len(self.hucs),):
+            raise ValueError('area_ha must have one value per HUC')
+
+    def __repr__(self) -> str:
+        return (
+            f'MonthlyCube({len(self.hucs)} HUCs x {len(months)} months x '
+            f'{len(self.variables)} variables)'
+        )
+
+    def __contains__(self, variable: str) -> bool:
+        return variable in self.variables
+
+    def __getitem__(self, variable: str) -> np.ndarray:
+        """The (HUCs, 12) array of one variable, as a view of the cube."""
+        if variable not in self.variables:
+            raise KeyError(variable)
+        return self.values[:, :, self.variables.index(variable)]
+
+    def select(self, hucs: list[str]) -> 'MonthlyCube':
+        """A cube of some of the HUCs, in the order given."""
+        positions = self.hucs.get_indexer(hucs)
+        if (positions < 0).any():
+            missing = [huc for huc, i in zip(hucs, positions) if i < 0]
+            raise KeyError(f'HUCs not in the cube: {missing}')
+        return MonthlyCube(
+            self.values[positions],
+            self.hucs[positions],
+            self.variables,
+            None if self.area_ha is None else self.area_ha[positions],
+            self.load_weights,
+        )
+
+    def with_variables(
+        self,
+        new: dict[str, np.ndarray],
+        load_weights: dict[str, str] | None = None,
+    ) -> 'MonthlyCube':
+        """A cube in memory with (HUCs, 12) arrays added as variables, or
+        replacing variables with the same name, with the water variable any
+        new loads were split by.
+        """
+        variables = [v for v in self.variables if v not in new]
+        values = np.concatenate(
+            [self.values[:, :, [self.variables.index(v) for v in variables]]]
+            + [np.asarray(array, dtype=float)[:, :, None] for array in new.values()],
+            axis=2,
+        )
+        weights = {
+            name: weight for name, weight in self.load_weights.items()
+            if name not in new
+        }
+        weights.update(load_weights or {})
+        return MonthlyCube(
+            values, self.hucs, variables + list(new), self.area_ha, weights,
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        """The cube as a long DataFrame with a 'huc' and 'month' column and a
+        column per variable, like `gwlfe_monthly_q`.
+        """
+        df = pd.DataFrame(
+            self.values.reshape(-1, len(self.variables)), columns=self.variables,
+        )
+        df.insert(0, 'huc', np.repeat(self.hucs.to_numpy(), len(months)))
+        df.insert(1, 'month', np.tile(months, len(self.hucs)))
+        return df
+
+    @classmethod
+    def from_frame(
+        cls,
+        df: pd.DataFrame,
+        variables: list[str] | None = None,
+        area_ha: pd.Series | None = None,
+    ) -> 'MonthlyCube':
+        """Makes a cube from a long table with a 'huc' and 'month' (1 to 12)
+        column and a column per variable, such as the `gwlfe_monthly_q`
+        results of `run_gwlfe_srat_drb_v3.py`. Months without a row are NaN.
+
+        Args:
+            df: Monthly results. Read HUCs as strings, to keep leading zeros.
+            variables: Columns to use. Defaults to the `water_variables` and
+                `calc.pollutants` keys in `df`.
+            area_ha: Area (ha) indexed by HUC, such as the 'AreaTotal' of
+                `gwlfe_summ_q`. Defaults to None.
+        """
+        if variables is None:
+            variables = [
+                column for column in [*water_variables, *pollutants]
+                if column in df.columns
+            ]
+        codes, hucs = pd.factorize(df['huc'], sort=True)
+        values = np.full((len(hucs), len(months), len(variables)), np.nan)
+        values[codes, df['month'].to_numpy() - 1] = df[variables].to_numpy(dtype=float)
+        area = None if area_ha is None else area_ha.reindex(hucs).to_numpy(dtype=float)
+        return cls(values, hucs, variables, area)
+
+    @classmethod
+    def from_results(
+        cls,
+        monthly: pd.DataFrame,
+        summary: pd.DataFrame | None = None,
+        load_summaries: pd.DataFrame | None = None,
+        weights: str | dict[str, str] = 'AvRunoff',
+    ) -> 'MonthlyCube':
+        """Makes a cube from the GWLF-E results of `run_gwlfe_srat_drb_v3.py`.
+        The monthly loads are estimates from `apportion_loads()`, not GWLF-E
+        results.
+
+        Args:
+            monthly: The `gwlfe_monthly_q` results
+            summary: The `gwlfe_summ_q` results, for the area of each HUC.
+                Defaults to None.
+            load_summaries: The `raw_load_summaries` results, whose 'Total
+                Loads' are apportioned to months by `apportion_loads()`.
+                Defaults to None.
+            weights: Passed to `apportion_loads()`. Defaults to
+                'AvRunoff'.
+        """
+        area_ha = None
+        if summary is not None:
+            area_ha = summary.drop_duplicates('huc').set_index('huc')['AreaTotal']
+        cube = cls.from_frame(monthly, area_ha=area_ha)
+        if load_summaries is not None:
+            annual_loads = (
+                load_summaries.loc[load_summaries['Source'] == 'Total Loads']
+                .drop_duplicates('huc')
+                .set_index('huc')
+            )
+            cube = apportion_loads(
+                cube,
+                annual_loads[[p for p in pollutants if p in annual_loads.columns]],
+                weights,
+            )
+        return cube
+
+    def save(self, path: str | Path) -> Path:
+        """Saves the cube to a directory: the values as 'values.npy', which
+        `open()` memory-maps, and the HUCs, variables, areas and load
+        weights as 'index.json'.
+
+        Returns:
+            The directory.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        tmp_path = path / 'values.tmp.npy'
+        values = np.lib.format.open_memmap(
+            tmp_path, mode='w+', dtype=np.float64, shape=self.values.shape,
+        )
+        values[:] = self.values
+        values.flush()
+        del values
+        os.replace(tmp_path, path / 'values.npy')
+        with open(path / 'index.json', 'w') as fp:
+            json.dump({
+                'hucs': self.hucs.tolist(),
+                'variables': self.variables,
+                'area_ha': None if self.area_ha is None else self.area_ha.tolist(),
+                'load_weights': self.load_weights,
+            }, fp)
+        return path
+
+    @classmethod
+    def open(cls, path: str | Path, mode: str = 'r') -> 'MonthlyCube':
+        """Opens a cube saved by `save()`, memory-mapped.
+
+        Args:
+            path: Directory of the cube
+            mode: `np.load()` memory map mode. 'r+' writes changes to the
+                values back to disk. Defaults to 'r'.
+        """
+        path = Path(path)
+        with open(path / 'index.json') as fp:
+            index = json.load(fp)
+        values = np.load(path / 'values.npy', mmap_mode=mode)
+        return cls(
+            values, index['hucs'], index['variables'], index['area_ha'],
+            index.get('load_weights'),
+        )
+
+
+# *****************************************************************************
+# Functions
+# *****************************************************************************
+
+def apportion_loads(
+    cube: MonthlyCube,
+    annual_loads: pd.DataFrame,
+    weights: str | dict[str, str] = 'AvRunoff',
+) -> MonthlyCube:
+    """Adds monthly loads (kg) to a cube by splitting annual loads among the
+    months in proportion to a monthly water variable.
+
+    The monthly loads are estimates, not GWLF-E output: GWLF-E's monthly
+    results only have the water balance. Splitting by runoff puts the load in
+    the months with the most runoff. Splitting by stream flow gives every
+    month the annual flow-weighted concentration. Anything derived from
+    them depends on that choice of weights, so the functions that use them
+    are named `estimated_`, and their results aren't Pollution Assessment
+    results.
+
+    Args:
+        cube: Cube with the weight variables
+        annual_loads: Annual loads (kg) indexed by HUC, with a column per
+            pollutant ('TotalN', ...)
+        weights: Water variable to split by, or a dict of it by pollutant.
+            HUCs where it's 0 all year get an even split. Defaults to
+            'AvRunoff'.
+
+    Returns:
+        A cube with a variable per pollutant, and the water variable each
+        was split by in its `load_weights`.
+    """
+    loads = annual_loads.reindex(cube.hucs)
+    new = {}
+    load_weights = {
+        pollutant: weights if isinstance(weights, str) else weights[pollutant]
+        for pollutant in loads.columns
+    }
+    for pollutant in loads.columns:
+        weight = cube[load_weights[pollutant]]
+        total = weight.sum(axis=1, keepdims=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            share = np.where(total > 0, weight / total, 1 / len(months))
+        new[pollutant] = share * loads[pollutant].to_numpy(dtype=float)[:, None]
+    return cube.with_variables(new, load_weights)
+
+
+def volume_liters(
+    cube: MonthlyCube,
+    flow_variable: str = 'AvStreamFlow',
+) -> np.ndarray:
+    """Monthly flow volume (L) of each HUC, as a (HUCs, 12) array."""
+    if cube.area_ha is None:
+        raise ValueError('The cube has no HUC areas')
+    return cube[flow_variable] * cube.area_ha[:, None] * liters_per_cm_ha
+
+
+def _month_groups(
+    groups: dict[str, list[int]] | None,
+) -> tuple[np.ndarray, list]:
+    """A (12, groups) matrix of the months in each group, and the group
+    labels; each month on its own if `groups` is None.
+    """
+    if groups is None:
+        return np.eye(len(months)), months
+    matrix = np.zeros((len(months), len(groups)))
+    for i, group_months in enumerate(groups.values()):
+        matrix[np.asarray(group_months) - 1, i] = 1
+    return matrix, list(groups)
+
+
+def _pollutant_loads(cube: MonthlyCube) -> tuple[list[str], np.ndarray]:
+    """The pollutants with loads in a cube, and their loads as a
+    (HUCs, pollutants, 12) array.
+    """
+    names = [pollutant for pollutant in pollutants if pollutant in cube]
+    if len(names) == 0:
+        raise ValueError('The cube has no loads; see apportion_loads()')
+    return names, np.stack([cube[name] for name in names], axis=1)
+
+
+def seasonal(
+    cube: MonthlyCube,
+    variables: list[str] | None = None,
+    seasons: dict[str, list[int]] = seasons,
+) -> pd.DataFrame:
+    """Totals of variables by season.
+
+    Args:
+        cube: Monthly results
+        variables: Variables to total. Defaults to all.
+        seasons: Months of each season. Defaults to `seasons`.
+
+    Returns:
+        A DataFrame indexed by HUC, with a (variable, season) column for each
+        variable and season.
+    """
+    variables = cube.variables if variables is None else variables
+    matrix, labels = _month_groups(seasons)
+    values = cube.values[:, :, [cube.variables.index(v) for v in variables]]
+    totals = np.einsum('hmv,ms->hvs', values, matrix)
+    return pd.DataFrame(
+        totals.reshape(len(cube.hucs), -1),
+        index=cube.hucs,
+        columns=pd.MultiIndex.from_product(
+            [variables, labels], names=['variable', 'season'],
+        ),
+    )
+
+
+def estimated_seasonal_loads(
+    cube: MonthlyCube,
+    seasons: dict[str, list[int]] = seasons,
+) -> pd.DataFrame:
+    """Estimated loads (kg) of each pollutant by season, with a (pollutant,
+    season) column for each, indexed by HUC. The loads are from
+    `apportion_loads()`, not GWLF-E results.
+    """
+    names, _ = _pollutant_loads(cube)
+    return seasonal(cube, names, seasons)
+
+
+def estimated_flow_weighted_conc(
+    cube: MonthlyCube,
+    seasons: dict[str, list[int]] | None = None,
+    flow_variable: str = 'AvStreamFlow',
+) -> pd.DataFrame:
+    """Estimated flow-weighted concentrations (mg/l) of each pollutant, by
+    month or by season: the load over the flow volume of the months.
+
+    The monthly loads are estimates from `apportion_loads()`, so these are
+    a ratio of the weight variable to `flow_variable`, scaled by the annual
+    concentration. For loads split by `flow_variable`, every month and
+    season has the annual concentration.
+
+    Args:
+        cube: Monthly results with loads and HUC areas
+        seasons: Months of each season, or None for each month. Defaults
+            to None.
+        flow_variable: Water variable of the flow. Defaults to
+            'AvStreamFlow'.
+
+    Returns:
+        A DataFrame indexed by HUC, with a (pollutant, month or season)
+        column for each, with pollutants by their `calc.pollutants` values
+        ('tn', ...). Months without flow are NaN.
+    """
+    names, loads = _pollutant_loads(cube)
+    matrix, labels = _month_groups(seasons)
+    load_mg = loads @ matrix * 1e6
+    volume = volume_liters(cube, flow_variable) @ matrix
+    with np.errstate(invalid='ignore', divide='ignore'):
+        conc = np.where(volume[:, None, :] > 0, load_mg / volume[:, None, :], np.nan)
+    return pd.DataFrame(
+        conc.reshape(len(cube.hucs), -1),
+        index=cube.hucs,
+        columns=pd.MultiIndex.from_product(
+            [[pollutants[name] for name in names], labels],
+            names=['pollutant', 'month' if seasons is None else 'season'],
+        ),
+    )
+
+
+def estimated_exceedances(
+    cube: MonthlyCube,
+    quantity_type: str = 'conc',
+    flow_variable: str = 'AvStreamFlow',
+) -> pd.DataFrame:
+    """Whether the estimated values of each month of each HUC exceed the
+    `calc.targets`.
+
+    The monthly loads are estimates from `apportion_loads()`, not GWLF-E
+    results, and the months they exceed a target in depend on the water
+    variable they were split by. These are a screening of seasonality, not
+    exceedances of the Pollution Assessment.
+
+    Args:
+        cube: Monthly results with loads and HUC areas
+        quantity_type: 'conc' to compare the flow-weighted concentration
+            (mg/l) of each month to the 'conc_target', or 'loadrate' to
+            compare the load rate of each month, as kg/ha/yr, to the
+            'loadrate_target'. Defaults to 'conc'.
+        flow_variable: Water variable of the flow, for concentrations.
+            Defaults to 'AvStreamFlow'.
+
+    Returns:
+        A boolean DataFrame indexed by HUC, with a (pollutant, month) column
+        for each, with pollutants by their `calc.pollutants` values.
+
+    Raises:
+        ValueError: For concentrations of loads split by `flow_variable`,
+            which have the annual concentration in every month, so a HUC
+            would exceed a target in all 12 months or none
+    """
+    if quantity_type == 'conc':
+        split_by_flow = [
+            pollutant for pollutant, weight in cube.load_weights.items()
+            if weight == flow_variable
+        ]
+        if split_by_flow:
+            raise ValueError(
+                f'The loads of {split_by_flow} were split by {flow_variable}, '
+                f'so their monthly concentrations are all the annual one'
+            )
+        values = estimated_flow_weighted_conc(cube, None, flow_variable)
+    elif quantity_type == 'loadrate':
+        if cube.area_ha is None:
+            raise ValueError('The cube has no HUC areas')
+        names, loads = _pollutant_loads(cube)
+        annual_rate = loads / cube.area_ha[:, None, None] * len(months)
+        values = pd.DataFrame(
+            annual_rate.reshape(len(cube.hucs), -1),
+            index=cube.hucs,
+            columns=pd.MultiIndex.from_product(
+                [[pollutants[name] for name in names], months],
+                names=['pollutant', 'month'],
+            ),
+        )
+    else:
+        raise ValueError("quantity_type must be 'conc' or 'loadrate'")
+    target = np.array([
+        targets[pollutant][f'{quantity_type}_target']
+        for pollutant in values.columns.get_level_values('pollutant')
+    ])
+    return values > target
+
+
+def estimated_months_exceeding(
+    cube: MonthlyCube,
+    quantity_type: str = 'conc',
+    flow_variable: str = 'AvStreamFlow',
+) -> pd.DataFrame:
+    """The estimated number of months each HUC exceeds the `calc.targets`
+    of each pollutant, from `estimated_exceedances()`, with a column per
+    pollutant.
+    """
+    exceeded = estimated_exceedances(cube, quantity_type, flow_variable)
+    return exceeded.T.groupby(level='pollutant', sort=False).sum().T
@@ -0,0 +1,212 @@
+import numpy as np
+import pandas as pd
+
+
+# *****************************************************************************
+# Functions
+# *****************************************************************************
+
+def nested_set_parents(
+    nord: np.ndarray,
+    nordstop: np.ndarray,
+) -> np.ndarray:
+    """Finds the downstream neighbor of every reach from nested-set ordering.
+
+    Each reach's upstream network has `nord` values in the interval
+    [`nord`, `nordstop`], so the reach directly downstream of another is the
+    nearest enclosing interval.
+
+    Args:
+        nord: Nested-set order of each reach, sorted ascending (i.e. from
+            outlets to headwaters)
+        nordstop: Largest `nord` upstream of each reach, in the same order
+
+    Returns:
+        The position of each reach's downstream neighbor, or -1 for outlets.
+    """
+    n = len(nord)
+    # Depth = number of enclosing intervals, which all precede a reach
+    depth = np.arange(n) - np.searchsorted(np.sort(nordstop), nord)
+
+    # The downstream reach is the nearest preceding reach one level shallower
+    key = depth * n + np.arange(n)
+    key_order = np.argsort(key)
+    parents = np.full(n, -1, dtype=np.int64)
+    has_parent = depth > 0
+    target = (depth[has_parent] - 1) * n + np.flatnonzero(has_parent)
+    parents[has_parent] = key_order[
+        np.searchsorted(key[key_order], target, side='right') - 1
+    ]
+    return parents
+
+
+# *****************************************************************************
+# Classes
+# *****************************************************************************
+
+class NestedSetIndex:
+    """Upstream and downstream queries over a reach network, using NHDPlus
+    nested-set ordering (`nord` and `nordstop`).
+
+    Reaches are stored sorted by `nord`, so every reach's upstream network
+    is a contiguous slice that's found with a binary search. Methods accept
+    a single COMID or an array of COMIDs for batch queries.
+
+    Args:
+        comids: COMID of each reach
+        nord: Nested-set order of each reach
+        nordstop: Largest `nord` upstream of each reach
+    """
+
+    def __init__(
+        self,
+        comids: np.ndarray,
+        nord: np.ndarray,
+        nordstop: np.ndarray,
+    ):
+        order = np.argsort(nord, kind='stable')
+        self.comids = np.asarray(comids)[order]
+        self.nord = np.asarray(nord, dtype=np.int64)[order]
+        self.nordstop = np.asarray(nordstop, dtype=np.int64)[order]
+        # End of each reach's upstream slice
+        self.stop = np.searchsorted(self.nord, self.nordstop, side='right')
+        self.parents = nested_set_parents(self.nord, self.nordstop)
+
+        # Sorted COMIDs, for binary search lookups of positions
+        self._comid_order = np.argsort(self.comids, kind='stable')
+        self._comids_sorted = self.comids[self._comid_order]
+
+    @classmethod
+    def from_dataframe(
+        cls,
+        df: pd.DataFrame,
+        nord_column: str = 'nord',
+        nordstop_column: str = 'nordstop',
+    ) -> 'NestedSetIndex':
+        """Creates an index from a DataFrame indexed by COMID, such as
+        `reach_gdf`. Reaches missing `nord` or `nordstop` are skipped.
+        """
+        valid = df[nord_column].notna() & df[nordstop_column].notna()
+        return cls(
+            df.index[valid].to_numpy(),
+            df.loc[valid, nord_column].to_numpy(dtype=np.int64),
+            df.loc[valid, nordstop_column].to_numpy(dtype=np.int64),
+        )
+
+    def __len__(self) -> int:
+        return len(self.comids)
+
+    def __contains__(self, comid: int) -> bool:
+        return bool(self.contains(comid))
+
+    def contains(self, comids: int | np.ndarray) -> bool | np.ndarray:
+        """True for each COMID in the index."""
+        comids = np.asarray(comids)
+        i = np.searchsorted(self._comids_sorted, comids).clip(0, len(self) - 1)
+        found = self._comids_sorted[i] == comids if len(self) else comids != comids
+        return found if found.ndim else bool(found)
+
+    def locate(self, comids: int | np.ndarray) -> int | np.ndarray:
+        """Position of each COMID in `nord` order.
+
+        Raises a `KeyError` for COMIDs that aren't in the index.
+        """
+        comids = np.asarray(comids)
+        found = np.asarray(self.contains(comids))
+        if not found.all():
+            raise KeyError(f'COMIDs not in index: {comids[~found].ravel()[:10]}')
+        positions = self._comid_order[np.searchsorted(self._comids_sorted, comids)]
+        return positions if positions.ndim else int(positions)
+
+    def upstream(
+        self,
+        comids: int | np.ndarray,
+        include_self: bool = True,
+    ) -> np.ndarray | pd.Series:
+        """All COMIDs upstream of a COMID (or of each COMID in an array).
+
+        Args:
+            comids: A COMID, or an array of COMIDs for a batch query
+            include_self: Include the COMID itself. Defaults to True.
+
+        Returns:
+            An array of upstream COMIDs for a single COMID, or a Series of
+            arrays indexed by COMID for a batch query.
+        """
+        positions = np.atleast_1d(self.locate(comids))
+        starts = positions if include_self else positions + 1
+        upstream = [
+            self.comids[start:stop]
+            for start, stop in zip(starts, self.stop[positions])
+        ]
+        if np.ndim(comids) == 0:
+            return upstream[0]
+        return pd.Series(upstream, index=np.asarray(comids), dtype=object)
+
+    def upstream_count(
+        self,
+        comids: int | np.ndarray,
+        include_self: bool = True,
+    ) -> int | np.ndarray:
+        """Number of COMIDs upstream of each COMID."""
+        positions = self.locate(comids)
+        counts = self.stop[positions] - positions
+        return counts if include_self else counts - 1
+
+    def is_upstream(
+        self,
+        a: int | np.ndarray,
+        b: int | np.ndarray,
+    ) -> bool | np.ndarray:
+        """True where COMID `a` is upstream of (and not equal to) COMID `b`.
+
+        Arrays of COMIDs are compared element-wise, with broadcasting.
+        """
+        a_nord = self.nord[self.locate(a)]
+        b_position = self.locate(b)
+        upstream = (
+            (a_nord > self.nord[b_position])
+            & (a_nord <= self.nordstop[b_position])
+        )
+        return upstream if np.ndim(upstream) else bool(upstream)
+
+    def outlet(self, comids: int | np.ndarray) -> int | np.ndarray:
+        """COMID of the most downstream reach below each COMID."""
+        positions = np.atleast_1d(self.locate(comids))
+        # Outlets are reaches without parents, which enclose their networks
+        roots = np.flatnonzero(self.parents < 0)
+        outlets = self.comids[
+            roots[np.searchsorted(roots, positions, side='right') - 1]
+        ]
+        return outlets if np.ndim(comids) else outlets[0]
+
+    def path_to_outlet(self, comid: int) -> np.ndarray:
+        """COMIDs of each reach from a COMID down to its outlet, in order."""
+        path = [self.locate(comid)]
+        while self.parents[path[-1]] >= 0:
+            path.append(self.parents[path[-1]])
+        return self.comids[path]
+
+    def upstream_sum(
+        self,
+        values: pd.Series,
+        include_self: bool = True,
+    ) -> pd.Series:
+        """Sums values over the upstream network of every reach in the index,
+        such as `catchment_hectares` for watershed areas.
+
+        Args:
+            values: Values indexed by COMID. Missing values count as zero.
+            include_self: Include each reach's own value. Defaults to True.
+
+        Returns:
+            A Series of upstream totals, indexed by COMID in `nord` order.
+        """
+        local = values.reindex(self.comids).fillna(0).to_numpy(dtype=np.float64)
+        cumulative = np.concatenate([[0.0], np.cumsum(local)])
+        starts = np.arange(len(self)) + (0 if include_self else 1)
+        return pd.Series(
+            cumulative[self.stop] - cumulative[starts],
+            index=pd.Index(self.comids, name='comid'),
+            name=values.name,
+        )
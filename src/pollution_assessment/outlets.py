@@ -0,0 +1,281 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from pollution_assessment.network import NestedSetIndex
+
+
+# *****************************************************************************
+# Functions
+# *****************************************************************************
+
+def _to_arrays(
+    keys: np.ndarray,
+    values: np.ndarray,
+    index: pd.Index,
+    dtype: np.dtype | type,
+) -> pd.Series:
+    """Groups values by key into one array per key in `index`, with None for
+    keys without values, like the `from_huc12s` column.
+    """
+    order = np.argsort(keys, kind='stable')
+    keys, values = keys[order], values[order]
+    unique, starts = np.unique(keys, return_index=True)
+    groups = dict(zip(unique, np.split(values, starts[1:])))
+    arrays = np.full(len(index), None, dtype=object)
+    for i, key in enumerate(index):
+        if key in groups:
+            arrays[i] = groups[key].astype(dtype)
+    return pd.Series(arrays, index=index)
+
+
+def outlet_reaches(
+    reach_df: pd.DataFrame,
+    huc_column: str = 'huc12',
+) -> pd.DataFrame:
+    """Finds every reach that drains out of its HUC, from the reach network.
+
+    A reach is an outlet when no other reach in the same HUC is downstream of
+    it, i.e. its `nord` isn't within the [`nord`, `nordstop`] interval of
+    another reach in the HUC. This is the same as repeatedly taking the
+    lowest `nord` left in a HUC and removing its upstream tributary, but for
+    all HUCs at once.
+
+    Args:
+        reach_df: DataFrame indexed by COMID, such as `reach_gdf`, with
+            `nord`, `nordstop`, `maflowv` and HUC columns
+        huc_column: Name of the HUC column. Defaults to 'huc12'.
+
+    Returns:
+        A DataFrame indexed by outlet COMID, sorted by HUC and `nord`, with
+        the HUC, `nord`, `nordstop`, `maflowv`, `nord_span` (`nordstop` -
+        `nord`), and the COMID and HUC of the downstream reach ('to_comid'
+        and f'to_{huc_column}').
+    """
+    columns = [huc_column, 'nord', 'nordstop', 'maflowv']
+    reach_df = reach_df.loc[
+        reach_df[['nord', 'nordstop']].notna().all(axis=1), columns
+    ]
+    index = NestedSetIndex.from_dataframe(reach_df)
+
+    # Downstream reach of every reach, from nested-set ordering
+    df = reach_df.loc[index.comids].copy()
+    to_position = index.parents
+    df['to_comid'] = pd.Series(
+        index.comids[to_position], index=df.index, dtype=pd.Int64Dtype(),
+    ).mask(to_position < 0)
+    to_huc = df[huc_column].to_numpy(dtype=object)[to_position]
+    to_huc[to_position < 0] = None
+    df[f'to_{huc_column}'] = to_huc
+
+    # Sort by HUC then nord, so a reach is covered by an earlier one
+    df = df.loc[df[huc_column].notna()]
+    codes = pd.factorize(df[huc_column], sort=True)[0].astype(np.int64)
+    nord = df['nord'].to_numpy(dtype=np.int64)
+    nordstop = df['nordstop'].to_numpy(dtype=np.int64)
+    order = np.lexsort((nord, codes))
+    codes, nord, nordstop = codes[order], nord[order], nordstop[order]
+    df = df.iloc[order]
+
+    # Running max of `nordstop` within each HUC, offset so it can't carry
+    # across HUCs. A reach is an outlet if nothing earlier in its HUC covers it
+    scale = nordstop.max(initial=0) + 1
+    running = np.maximum.accumulate(codes * scale + nordstop)
+    previous = np.concatenate([[-1], running[:-1]])
+    covered = (previous // scale == codes) & (previous % scale >= nord)
+
+    outlets = df.loc[~covered].copy()
+    outlets['nord_span'] = outlets['nordstop'] - outlets['nord']
+    return outlets
+
+
+def detect_outlets(
+    reach_df: pd.DataFrame,
+    huc_column: str = 'huc12',
+) -> pd.DataFrame:
+    """Builds the HUC outlet and inlet table from the reach network.
+
+    Each HUC's primary outlet is the outlet reach with the largest mean
+    annual flow (`maflowv`), then the largest upstream network
+    (`nordstop` - `nord`), then the lowest `nord`. HUCs are connected by
+    where their outlet reaches flow into, so `from_huc12s` lists every HUC
+    with an outlet draining into a HUC, even if that HUC's primary outlet
+    drains elsewhere.
+
+    Args:
+        reach_df: DataFrame indexed by COMID, such as `reach_gdf`, with
+            `nord`, `nordstop`, `maflowv` and HUC columns
+        huc_column: Name of the HUC column. Defaults to 'huc12'.
+
+    Returns:
+        A DataFrame indexed by HUC, with the same columns as
+        `huc12_outlets_drwi_gdf` ('comid', 'nord', f'to_{huc_column}',
+        'outlet_comid', f'from_{huc_column}s', 'inlet_comids',
+        'outlet_comids'), plus 'n_outlets' and 'ambiguous_outlet', which is
+        True when the lowest `nord`, largest `maflowv` and largest upstream
+        network don't all pick the same primary outlet.
+    """
+    to_huc_column = f'to_{huc_column}'
+    from_hucs_column = f'from_{huc_column}s'
+    outlets = outlet_reaches(reach_df, huc_column)
+    hucs = pd.Index(outlets[huc_column].unique(), name=huc_column)
+    huc = outlets[huc_column].to_numpy(dtype=object)
+
+    # Rank outlets within each HUC for each criterion, with one sort each
+    first = {}
+    for criterion, ascending in {
+        'primary': None,
+        'nord': True,
+        'maflowv': False,
+        'nord_span': False,
+    }.items():
+        if criterion == 'primary':
+            ranked = outlets.sort_values(
+                [huc_column, 'maflowv', 'nord_span', 'nord'],
+                ascending=[True, False, False, True],
+                kind='stable',
+            )
+        else:
+            ranked = outlets.sort_values(
+                [huc_column, criterion], ascending=[True, ascending],
+                kind='stable',
+            )
+        ranked = ranked.loc[~ranked[huc_column].duplicated()]
+        first[criterion] = pd.Series(
+            ranked.index, index=ranked[huc_column].to_numpy(dtype=object),
+        ).reindex(hucs)
+
+    primary = outlets.loc[first['primary']]
+    df = pd.DataFrame(index=hucs)
+    df['comid'] = pd.array(primary.index, dtype=pd.Int64Dtype())
+    df['nord'] = pd.array(primary['nord'], dtype=pd.Int64Dtype())
+    df[to_huc_column] = pd.Categorical(primary[f'to_{huc_column}'].to_numpy())
+    df['outlet_comid'] = df['comid']
+
+    # Inflows from outlets of other HUCs, in `nord` order
+    inflow = outlets.loc[outlets[to_huc_column].notna()]
+    inflow = inflow.sort_values('nord', kind='stable')
+    pairs = inflow[[to_huc_column, huc_column]].astype(str).drop_duplicates()
+    df[from_hucs_column] = _to_arrays(
+        pairs[to_huc_column].to_numpy(dtype=object),
+        pairs[huc_column].to_numpy(dtype=object),
+        hucs, object,
+    )
+    df['inlet_comids'] = _to_arrays(
+        inflow[to_huc_column].to_numpy(dtype=object),
+        inflow.index.to_numpy(),
+        hucs, np.int64,
+    )
+    df['outlet_comids'] = _to_arrays(huc, outlets.index.to_numpy(), hucs, np.int64)
+    df['n_outlets'] = df['outlet_comids'].map(len)
+    df['ambiguous_outlet'] = ~(
+        (first['nord'] == first['maflowv'])
+        & (first['maflowv'] == first['nord_span'])
+    ).to_numpy()
+
+    return df
+
+
+def _array_pairs(arrays: pd.Series) -> pd.MultiIndex:
+    """(index, item) pairs for a column of arrays, such as `from_huc12s`."""
+    exploded = arrays.explode().dropna()
+    return pd.MultiIndex.from_arrays(
+        [exploded.index.astype(str), exploded.astype(str).to_numpy()],
+    )
+
+
+def repair_outlets(
+    huc_gdf: gpd.GeoDataFrame,
+    reach_df: pd.DataFrame,
+    huc_column: str = 'huc12',
+) -> tuple[gpd.GeoDataFrame, pd.DataFrame]:
+    """Corrects HUC outlets and upstream HUCs from the reach network.
+
+    Replaces the manual `huc12_reassign_outlet()` and
+    `huc12_reassign_from_huc12s()` fixes from
+    `stage2/PA2_2b_AggregateAttenuated.ipynb`, using `detect_outlets()`.
+
+    Args:
+        huc_gdf: HUC outlets table, such as `huc12_outlets_drwi_gdf`
+        reach_df: DataFrame indexed by COMID, such as `reach_gdf`, with
+            `nord`, `nordstop`, `maflowv` and HUC columns
+        huc_column: Name of the HUC column. Defaults to 'huc12'.
+
+    Returns:
+        A tuple of the corrected copy of `huc_gdf`, and a diff report
+        indexed by HUC for each HUC with a changed outlet, changed
+        downstream or upstream HUCs, multiple outlets, or an ambiguous
+        primary outlet.
+    """
+    to_huc_column = f'to_{huc_column}'
+    from_hucs_column = f'from_{huc_column}s'
+    detected = detect_outlets(reach_df, huc_column)
+    known = detected.index.astype(str)
+    detected = detected.reindex(huc_gdf.index)
+    found = detected['comid'].notna()
+
+    gdf = huc_gdf.copy()
+    for column in ['comid', 'outlet_comid', 'nord']:
+        gdf[column] = gdf[column].where(~found, detected[column])
+    for column in ['inlet_comids', 'outlet_comids']:
+        gdf[column] = gdf[column].where(~found, detected[column])
+    # Keep the original downstream HUC where the outlet leaves the reaches
+    to_huc = detected[to_huc_column].astype(object)
+    gdf[to_huc_column] = pd.Categorical(
+        to_huc.where(to_huc.notna(), huc_gdf[to_huc_column].astype(object))
+    )
+
+    # Upstream HUCs as (HUC, upstream HUC) pairs, keeping original pairs
+    # where either HUC has no reaches to check them against
+    original = _array_pairs(huc_gdf[from_hucs_column])
+    unchecked = (
+        ~original.get_level_values(0).isin(found.index[found].astype(str))
+        | ~original.get_level_values(1).isin(known)
+    )
+    corrected = _array_pairs(detected[from_hucs_column]).append(
+        original[unchecked]
+    ).drop_duplicates()
+    gdf[from_hucs_column] = _to_arrays(
+        corrected.get_level_values(0).to_numpy(dtype=object),
+        corrected.get_level_values(1).to_numpy(dtype=object),
+        huc_gdf.index, object,
+    )
+    added = corrected.difference(original, sort=False)
+    removed = original.difference(corrected, sort=False)
+
+    report = pd.DataFrame(index=huc_gdf.index)
+    report['outlet_comid_original'] = huc_gdf['outlet_comid']
+    report['outlet_comid'] = gdf['outlet_comid']
+    report['outlet_changed'] = (
+        report['outlet_comid_original'].ne(report['outlet_comid'])
+        .fillna(False).astype(bool)
+    )
+    report[f'{to_huc_column}_original'] = huc_gdf[to_huc_column].astype(object)
+    report[to_huc_column] = gdf[to_huc_column].astype(object)
+    report[f'{to_huc_column}_changed'] = (
+        report[f'{to_huc_column}_original'].fillna('')
+        != report[to_huc_column].fillna('')
+    )
+    report[f'{from_hucs_column}_added'] = _to_arrays(
+        added.get_level_values(0).to_numpy(dtype=object),
+        added.get_level_values(1).to_numpy(dtype=object),
+        report.index, object,
+    )
+    report[f'{from_hucs_column}_removed'] = _to_arrays(
+        removed.get_level_values(0).to_numpy(dtype=object),
+        removed.get_level_values(1).to_numpy(dtype=object),
+        report.index, object,
+    )
+    report['n_outlets'] = detected['n_outlets'].astype(pd.Int64Dtype())
+    report['multi_outlet'] = report['n_outlets'].gt(1).fillna(False).astype(bool)
+    report['ambiguous_outlet'] = detected['ambiguous_outlet'].fillna(False).astype(bool)
+
+    issues = (
+        report['outlet_changed']
+        | report[f'{to_huc_column}_changed']
+        | report[f'{from_hucs_column}_added'].notna()
+        | report[f'{from_hucs_column}_removed'].notna()
+        | report['multi_outlet']
+        | report['ambiguous_outlet']
+    )
+    return gdf, report.loc[issues]
@@ -0,0 +1,204 @@
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from pollution_assessment import storage
+
+
+# *****************************************************************************
+# Global variable objects
+# *****************************************************************************
+
+column_families = {
+    'comid': r'comid|outlet_comid|to_comid',
+    'nord': r'nord|nordstop',
+    'huc': r'huc|huc\d{2}|to_huc\d{2}',
+    'label': (
+        r'.*_name|cluster|phase|fa_name|fa_name_phase|Source|gwlfe_endpoint'
+        r'|run_group|run_type|funding_sources'
+    ),
+    'scenario': r'(tn|tp|tss)_(load|conc|loadrate)(_\w+)?',
+    'wikisrat': r'TotalN|TotalP|Sediment',
+    'measure': r'catchment_hectares|watershed_hectares|maflowv(_\w+)?',
+    'network': (
+        r'from_comids|from_huc\d{2}s(_original)?|inlet_comids|outlet_comids'
+    ),
+}
+"""dict: Regular expressions for the names of each family of columns in the
+PA2 results and geography GeoDataFrames, such as `reach_concs_gdf`,
+`catch_loads_gdf`, `huc12_outlet_loads_gdf`, and the wikiSRAT results.
+
+Scenario columns are every pollutant x quantity x suffix, from `calc.py`,
+such as 'tp_load_rem3_net'.
+"""
+
+
+family_dtypes = {
+    'comid': 'int32',
+    'nord': 'int32',
+    'huc': 'category',
+    'label': 'category',
+    'scenario': 'float64',
+    'wikisrat': 'float64',
+    'measure': 'float64',
+    'network': None,
+}
+"""dict: Dtype of each column family. COMIDs and `nord` values fit in int32,
+and IDs and names are categorical. Network columns (arrays of IDs) are left
+as they are.
+"""
+
+
+# *****************************************************************************
+# Functions
+# *****************************************************************************
+
+def column_family(name: str) -> str | None:
+    """Name of the column family for a column name, or None."""
+    for family, pattern in column_families.items():
+        if isinstance(name, str) and re.fullmatch(pattern, name):
+            return family
+    return None
+
+
+def _target_dtype(
+    values: pd.Series | pd.Index,
+    family: str | None,
+    float32: bool,
+):
+    """Dtype to store a column or index as, or None to leave it as is."""
+    if family is None or family_dtypes[family] is None:
+        return None
+    dtype = family_dtypes[family]
+    if dtype == 'category':
+        return None if isinstance(values.dtype, pd.CategoricalDtype) else 'category'
+    if dtype == 'int32':
+        if not pd.api.types.is_numeric_dtype(values.dtype):
+            return None
+        valid = values.dropna()
+        info = np.iinfo(np.int32)
+        if len(valid) and (valid.min() < info.min or valid.max() > info.max):
+            return None
+        nullable = (
+            isinstance(values.dtype, pd.api.extensions.ExtensionDtype)
+            or len(valid) < len(values)
+        )
+        return 'Int32' if nullable else np.int32
+    if family == 'scenario' and float32:
+        return np.float32
+    return None
+
+
+def downcast(
+    df: pd.DataFrame | gpd.GeoDataFrame,
+    float32: bool = False,
+) -> pd.DataFrame | gpd.GeoDataFrame:
+    """Converts columns (and the index) to the dtypes of their families.
+
+    Args:
+        df: A PA2 results or geography DataFrame or GeoDataFrame
+        float32: Store derived scenario columns (e.g. 'tp_load_rem3') as
+            float32, which halves their memory. Defaults to False.
+
+    Returns:
+        A copy of the dataframe with compact dtypes.
+    """
+    dtypes = {}
+    for column in df.columns:
+        dtype = _target_dtype(df[column], column_family(column), float32)
+        if dtype is not None and df[column].dtype != dtype:
+            dtypes[column] = dtype
+    df = df.astype(dtypes)
+
+    index_dtype = _target_dtype(df.index, column_family(df.index.name), float32)
+    if index_dtype is not None and df.index.dtype != index_dtype:
+        df.index = df.index.astype(index_dtype)
+    return df
+
+
+def validate(
+    df: pd.DataFrame | gpd.GeoDataFrame,
+    float32: bool = False,
+) -> pd.DataFrame:
+    """Lists columns whose dtype doesn't match their family in the schema.
+
+    Args:
+        df: A PA2 results or geography DataFrame or GeoDataFrame
+        float32: Expect float32 scenario columns. Defaults to False.
+
+    Returns:
+        A DataFrame indexed by column name, with the column family, the
+        current dtype and the expected dtype. Empty if all columns match.
+    """
+    rows = {}
+    for name, values in [(df.index.name, df.index), *df.items()]:
+        family = column_family(name)
+        dtype = _target_dtype(values, family, float32)
+        if dtype is not None and values.dtype != dtype:
+            rows[name] = [family, str(values.dtype), str(pd.api.types.pandas_dtype(dtype))]
+        elif family in ('scenario', 'wikisrat', 'measure') and not (
+            pd.api.types.is_float_dtype(values.dtype)
+        ):
+            rows[name] = [family, str(values.dtype), 'float']
+    return pd.DataFrame.from_dict(
+        rows, orient='index', columns=['family', 'dtype', 'expected'],
+    )
+
+
+def memory_report(df: pd.DataFrame | gpd.GeoDataFrame) -> pd.DataFrame:
+    """Memory used by each column family, including the index.
+
+    Returns:
+        A DataFrame indexed by family ('other' for unmatched columns), with
+        the number of columns and megabytes, and a 'total' row.
+    """
+    usage = df.memory_usage(deep=True)
+    families = [
+        column_family(df.index.name if name == 'Index' else name) or 'other'
+        for name in usage.index
+    ]
+    report = pd.DataFrame({
+        'family': families,
+        'columns': 1,
+        'mb': usage.to_numpy() / 1e6,
+    }).groupby('family', sort=False).sum()
+    report.loc['total'] = report.sum()
+    return report
+
+
+def read_parquet(
+    path: str | Path,
+    float32: bool = False,
+    **kwargs,
+) -> pd.DataFrame | gpd.GeoDataFrame:
+    """Opens a data output Parquet file with `storage.read_parquet()`, and
+    downcasts it to the schema.
+
+    Args:
+        path: Path of the Parquet file
+        float32: Load scenario columns as float32. Defaults to False.
+        **kwargs: Passed to `storage.read_parquet()`, such as `columns`
+    """
+    return downcast(storage.read_parquet(path, **kwargs), float32)
+
+
+def to_parquet(
+    df: pd.DataFrame | gpd.GeoDataFrame,
+    path: str | Path,
+    float32: bool = False,
+    **kwargs,
+) -> None:
+    """Downcasts a dataframe to the schema and saves it with
+    `storage.to_parquet()`.
+
+    Args:
+        df: DataFrame or GeoDataFrame to save
+        path: Path of the Parquet file
+        float32: Save scenario columns as float32. Defaults to False.
+        **kwargs: Passed to `storage.to_parquet()`, such as
+            `compression='brotli'`
+    """
+    storage.to_parquet(downcast(df, float32), path, **kwargs)
@@ -0,0 +1,219 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# *****************************************************************************
+# Global variable objects
+# *****************************************************************************
+
+network_columns = {
+    'from_comids': pa.int64(),
+    'from_huc12s': pa.string(),
+    'from_huc10s': pa.string(),
+    'from_huc08s': pa.string(),
+    'inlet_comids': pa.int64(),
+    'outlet_comids': pa.int64(),
+}
+"""dict: Arrow value types of the list columns that store the reach and HUC
+networks, for columns with arrays of upstream or outlet IDs.
+"""
+
+
+_pandas_read_kwargs = {
+    'engine', 'dtype_backend', 'use_nullable_dtypes', 'storage_options',
+    'to_pandas_kwargs', 'bbox',
+}
+"""set: Keyword arguments of `pd.read_parquet()` and `gpd.read_parquet()`
+that `pq.read_table()` doesn't take.
+"""
+
+
+# *****************************************************************************
+# Functions
+# *****************************************************************************
+
+def _is_listlike(value) -> bool:
+    """True for the array/list/tuple values used in network columns."""
+    return isinstance(value, (np.ndarray, list, tuple))
+
+
+def _as_array(value) -> np.ndarray | None:
+    """A 1D array for a network column cell, or None if it's empty.
+
+    Cells assigned with `df.at[]` can hold a 0D array or a scalar instead of
+    a 1D array, which is what breaks writing the column to Parquet.
+    """
+    if _is_listlike(value):
+        return np.asarray(value).ravel()
+    if pd.isna(value):
+        return None
+    return np.array([value])
+
+
+def _is_list_type(arrow_type: pa.DataType) -> bool:
+    return pa.types.is_list(arrow_type) or pa.types.is_large_list(arrow_type)
+
+
+def is_list_column(series: pd.Series) -> bool:
+    """True for an Arrow list column, or an object column of arrays."""
+    if isinstance(series.dtype, pd.ArrowDtype):
+        return _is_list_type(series.dtype.pyarrow_dtype)
+    if series.dtype != object:
+        return False
+    values = series.dropna()
+    return len(values) > 0 and _is_listlike(values.iloc[0])
+
+
+def to_list_column(
+    series: pd.Series,
+    value_type: pa.DataType | None = None,
+) -> pd.Series:
+    """Converts a column of arrays (e.g. `from_huc12s`) to an Arrow list
+    column, with nulls where a row has no array.
+
+    Args:
+        series: Column with arrays, lists or tuples, and None or NaN
+        value_type: Arrow type of the array values. Defaults to the type in
+            `network_columns`, or is inferred from the values.
+
+    Returns:
+        A Series with a `pd.ArrowDtype` list dtype, and the same index.
+    """
+    if value_type is None:
+        value_type = network_columns.get(series.name)
+    if isinstance(series.dtype, pd.ArrowDtype):
+        if value_type is None or series.dtype.pyarrow_dtype == pa.list_(value_type):
+            return series
+        array = series.array.__arrow_array__().cast(pa.list_(value_type))
+    else:
+        array = [_as_array(value) for value in series.to_numpy()]
+        array = pa.array(
+            array, type=None if value_type is None else pa.list_(value_type),
+        )
+    return pd.Series(
+        pd.arrays.ArrowExtensionArray(array), index=series.index, name=series.name,
+    )
+
+
+def list_offsets(series: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    """Offsets and flat values of a column of arrays, such as `from_comids`.
+
+    The values for row i are `values[offsets[i]:offsets[i + 1]]`, and rows
+    without arrays are empty. Arrow list columns are read from their buffers
+    without converting each row to a Python object, while object columns are
+    converted with `to_list_column()` first.
+
+    Args:
+        series: An Arrow list column, or an object column of arrays
+
+    Returns:
+        Two NumPy arrays: offsets with length n + 1, and the flat values.
+    """
+    series = to_list_column(series)
+    array = series.array.__arrow_array__().combine_chunks()
+    lengths = array.value_lengths().fill_null(0).to_numpy(zero_copy_only=False)
+    values = array.flatten().to_numpy(zero_copy_only=False)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets, values
+
+
+def to_parquet(
+    df: pd.DataFrame | gpd.GeoDataFrame,
+    path: str | Path,
+    list_columns: list[str] | None = None,
+    **kwargs,
+) -> None:
+    """Saves a DataFrame or GeoDataFrame to (Geo)Parquet, with network
+    columns stored as Arrow lists of a consistent type, so that edited rows
+    (e.g. with `huc12_reassign_from_huc12s()`) don't break the write.
+
+    Args:
+        df: DataFrame or GeoDataFrame to save
+        path: Path of the Parquet file
+        list_columns: Names of columns to store as lists. Defaults to every
+            column of arrays.
+        **kwargs: Passed to `to_parquet()`, such as `compression='brotli'`
+    """
+    if list_columns is None:
+        list_columns = [column for column in df.columns if is_list_column(df[column])]
+    df = df.copy()
+    for column in list_columns:
+        # Stored as object columns of 1D arrays with one value type, as
+        # pandas can't read its metadata for Arrow list dtypes back
+        array = to_list_column(df[column]).array.__arrow_array__()
+        df[column] = pd.Series(
+            array.to_numpy(zero_copy_only=False), index=df.index, dtype=object,
+        )
+    df.to_parquet(path, **kwargs)
+
+
+def read_parquet(
+    path: str | Path,
+    columns: list[str] | None = None,
+    **kwargs,
+) -> pd.DataFrame | gpd.GeoDataFrame:
+    """Opens a (Geo)Parquet file, keeping list columns as Arrow lists.
+
+    List columns are loaded without converting each row to a NumPy array,
+    and can be passed to `list_offsets()` or to `calc.inlet_pairs()`.
+    Files with GeoParquet metadata are opened as GeoDataFrames.
+
+    Args:
+        path: Path of the Parquet file
+        columns: Columns to read. Defaults to all.
+        **kwargs: Passed to `gpd.read_parquet()` or `pd.read_parquet()`,
+            and those that pyarrow takes (e.g. `filters`) to the read of the
+            list columns, so both read the same rows
+
+    Returns:
+        A GeoDataFrame or DataFrame, with list columns as `pd.ArrowDtype`.
+    """
+    schema = pq.read_schema(path)
+    metadata = schema.metadata or {}
+    if columns is None:
+        columns = [
+            name for name in schema.names
+            if name not in _index_columns(metadata)
+        ]
+    list_columns = [
+        name for name in columns if _is_list_type(schema.field(name).type)
+    ]
+    other_columns = [name for name in columns if name not in list_columns]
+
+    if b'geo' in metadata:
+        df = gpd.read_parquet(path, columns=other_columns, **kwargs)
+    else:
+        df = pd.read_parquet(path, columns=other_columns, **kwargs)
+
+    if list_columns:
+        table_kwargs = {
+            key: value for key, value in kwargs.items()
+            if key not in _pandas_read_kwargs
+        }
+        table = pq.read_table(path, columns=list_columns, **table_kwargs)
+        if table.num_rows != len(df):
+            raise ValueError(
+                f'Read {len(df)} rows of {path} but {table.num_rows} rows of '
+                f'its list columns; filter rows with `filters`'
+            )
+        for name in list_columns:
+            df[name] = pd.arrays.ArrowExtensionArray(table.column(name))
+    return df[columns]
+
+
+def _index_columns(metadata: dict) -> list[str]:
+    """Names of columns that pandas saved as the index."""
+    if b'pandas' not in metadata:
+        return []
+    pandas_metadata = json.loads(metadata[b'pandas'])
+    return [
+        name for name in pandas_metadata.get('index_columns', [])
+        if isinstance(name, str)
+    ]
@@ -0,0 +1,228 @@
+import sys
+import json
+import time
+import argparse
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+
+from pollution_assessment.manifest import RunUnit
+
+
+# *****************************************************************************
+# Global variable objects
+# *****************************************************************************
+
+metrics = [
+    'wall_seconds',
+    'payload_bytes',
+    'response_bytes',
+    'retries',
+    'framing_seconds',
+    'rows',
+]
+"""list: The metrics recorded for every unit of work by the batch runners.
+Stages can add others, such as 'srat_seconds' or 'write_seconds'.
+"""
+
+percentiles = [0.5, 0.9, 0.99]
+"""list: Percentiles of each metric in `summarize()`."""
+
+
+# *****************************************************************************
+# Classes
+# *****************************************************************************
+
+class Telemetry:
+    """Appends the metrics of each unit of work of a batch run to a JSON lines
+    file, one JSON object per line.
+
+    Every line has the time it was recorded, the stage (e.g. 'srat' or
+    'gwlfe'), the fields of the unit's `RunUnit`, and its metrics.
+
+    Usage:
+        telemetry = Telemetry(save_path + 'telemetry.jsonl')
+        with telemetry.measure(unit, 'srat') as unit_metrics:
+            unit_metrics['payload_bytes'] = len(body)
+            with timer(unit_metrics, 'framing_seconds'):
+                ...
+
+    Args:
+        path: Path of the JSON lines file, which is appended to
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def record(
+        self,
+        unit: RunUnit | None = None,
+        stage: str = '',
+        **unit_metrics,
+    ) -> dict:
+        """Appends one line, and returns it as a dict."""
+        row = {
+            'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+            'stage': stage,
+            **({} if unit is None else unit._asdict()),
+            **unit_metrics,
+        }
+        with open(self.path, 'a') as fp:
+            fp.write(json.dumps(row, default=str) + '\n')
+        return row
+
+    @contextmanager
+    def measure(self, unit: RunUnit | None = None, stage: str = '', **unit_metrics):
+        """Records a unit of work, with its 'wall_seconds' and 'status' and
+        the metrics added to the yielded dict, even if it raises.
+        """
+        unit_metrics = dict(unit_metrics)
+        start = time.perf_counter()
+        try:
+            yield unit_metrics
+        except BaseException as e:
+            unit_metrics['status'] = 'failed'
+            unit_metrics['error'] = repr(e)
+            raise
+        finally:
+            unit_metrics.setdefault('status', 'complete')
+            unit_metrics['wall_seconds'] = time.perf_counter() - start
+            self.record(unit, stage, **unit_metrics)
+
+
+# *****************************************************************************
+# Functions
+# *****************************************************************************
+
+@contextmanager
+def timer(unit_metrics: dict, name: str):
+    """Adds the seconds taken by a block to a metric, such as
+    'framing_seconds'.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        unit_metrics[name] = (
+            unit_metrics.get(name, 0.0) + time.perf_counter() - start
+        )
+
+
+def read_telemetry(path: str | Path) -> pd.DataFrame:
+    """Reads a telemetry file into a DataFrame with a row per line.
+
+    Values aren't type-inferred, so HUCs keep their leading zeros.
+    """
+    with open(path) as fp:
+        rows = [json.loads(line) for line in fp if line.strip()]
+    df = pd.DataFrame(rows)
+    if 'time' in df.columns:
+        df['time'] = pd.to_datetime(df['time'])
+    return df
+
+
+def metric_columns(df: pd.DataFrame) -> list[str]:
+    """The numeric metric columns of a telemetry DataFrame, the metrics in
+    `metrics` first.
+    """
+    numeric = [
+        column for column in df.columns
+        if pd.api.types.is_numeric_dtype(df[column])
+        and not pd.api.types.is_bool_dtype(df[column])
+    ]
+    return (
+        [column for column in metrics if column in numeric]
+        + [column for column in numeric if column not in metrics]
+    )
+
+
+def summarize(
+    df: pd.DataFrame,
+    by: str | list[str] = 'stage',
+) -> pd.DataFrame:
+    """Summarizes the metrics of each stage.
+
+    Args:
+        df: Telemetry from `read_telemetry()`
+        by: Columns to group by. Defaults to 'stage'.
+
+    Returns:
+        A DataFrame indexed by the `by` columns and metric, with the 'count',
+        'mean', `percentiles` (e.g. 'p50'), 'max' and 'total' of each metric.
+    """
+    columns = metric_columns(df)
+    long = df.melt(id_vars=by, value_vars=columns, var_name='metric').dropna(
+        subset=['value']
+    )
+    grouped = long.groupby(
+        [*([by] if isinstance(by, str) else by), 'metric'], sort=False,
+    )['value']
+    summary = grouped.agg(['count', 'mean'])
+    for q in percentiles:
+        summary[f'p{q * 100:g}'] = grouped.quantile(q)
+    summary['max'] = grouped.max()
+    summary['total'] = grouped.sum()
+    return summary
+
+
+def slowest(
+    df: pd.DataFrame,
+    n: int = 10,
+    metric: str = 'wall_seconds',
+) -> pd.DataFrame:
+    """The `n` units with the largest value of a metric, with their keys
+    and metrics.
+    """
+    keys = [
+        column for column in ['stage', *RunUnit._fields, 'status']
+        if column in df.columns and column != 'input_hash'
+    ]
+    return df.nlargest(n, metric)[keys + metric_columns(df)]
+
+
+def main(argv: list[str] | None = None):
+    """Prints the summary and slowest units of a telemetry file.
+
+    Usage:
+        python -m pollution_assessment.telemetry telemetry.jsonl [--top 10]
+            [--metric wall_seconds] [--stage srat]
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m pollution_assessment.telemetry',
+        description='Summarize the telemetry of a batch run.',
+    )
+    parser.add_argument('path', help='JSON lines telemetry file')
+    parser.add_argument(
+        '--top', type=int, default=10, help='number of slowest units to list',
+    )
+    parser.add_argument(
+        '--metric', default='wall_seconds', help='metric to rank units by',
+    )
+    parser.add_argument('--stage', help='only summarize this stage')
+    args = parser.parse_args(argv)
+
+    df = read_telemetry(args.path)
+    if args.stage is not None:
+        df = df.loc[df['stage'] == args.stage]
+    if len(df) == 0:
+        print(f'No telemetry in {args.path}')
+        return
+
+    with pd.option_context(
+        'display.width', 200, 'display.max_columns', None,
+        'display.float_format', '{:.4g}'.format,
+    ):
+        print(f'{len(df)} units from {args.path}\n')
+        if 'status' in df.columns:
+            print(df.groupby(['stage', 'status']).size().to_string(), '\n')
+        print(summarize(df).to_string(), '\n')
+        if args.metric in df.columns:
+            print(f'Slowest {args.top} units by {args.metric}:')
+            print(slowest(df, args.top, args.metric).to_string(index=False))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,6 +4,7 @@ import matplotlib
 import hvplot.pandas
 import numpy as np
 import concurrent.futures
+from functools import cache
 import geoviews as gv
 import holoviews as hv
 from pandas import Series
@@ -18,9 +19,12 @@ from typing import (
     Optional,
 )
 
-# set up geoviews
-gv.extension('bokeh')
-gv.renderer('bokeh').webgl = True
+
+@cache
+def _load_extension() -> None:
+    """Sets up geoviews on the first plot, rather than on import."""
+    gv.extension('bokeh')
+    gv.renderer('bokeh').webgl = True
 
 
 class DynamicLineInput(TypedDict):
@@ -259,6 +263,8 @@ class DynamicPlotter:
         Returns:
             gv.Overlay: Holoviews overlay of dynamic plots.
         """
+        _load_extension()
+
         # get crs info
         crs_dict: CRS_Info = get_crs_info(gdf)
 
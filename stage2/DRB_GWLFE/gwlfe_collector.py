@@ -0,0 +1,112 @@
+"""
+Collects the GWLF-E results of HUC12s into Arrow tables, one per result type,
+instead of building a small DataFrame for each part of each HUC's results and
+concatenating them.
+
+Each result type ("gwlfe_monthly_q", "raw_load_summaries", ...) has a list of
+values per column. Records are appended to the lists as they're read from the
+GWLF-E results, with the columns every row of a call shares (e.g. 'huc') and
+the collector's constant columns, and `GwlfeResultCollector.tables()` makes
+one typed `pa.Table` per result type from the lists.
+
+The tables have the columns, in the order, of the DataFrames that
+`run_gwlfe_srat_drb_v3.py` used to build.
+"""
+from typing import Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+
+SUMMARY_KEYS = ["AreaTotal", "MeanFlow", "MeanFlowPerSecond"]
+
+
+class GwlfeResultCollector:
+    """Column lists of GWLF-E results by result type.
+
+    Args:
+        constants: Columns with the same value in every row of every table,
+            such as the HUC that was run. Defaults to none.
+    """
+
+    def __init__(self, constants: Optional[Dict] = None):
+        self.constants = {} if constants is None else dict(constants)
+        self._columns: Dict[str, Dict[str, list]] = {}
+        self._rows: Dict[str, int] = {}
+
+    def append(self, result_key: str, records: List[Dict], columns: Optional[Dict] = None):
+        """Appends records to a result type, each with `columns` and the
+        constant columns, which replace record values with the same name.
+
+        Columns a record doesn't have are null in its row.
+        """
+        buffers = self._columns.setdefault(result_key, {})
+        rows = self._rows.get(result_key, 0)
+        shared = {**({} if columns is None else columns), **self.constants}
+        for record in records:
+            row = {**record, **shared}
+            for name, value in row.items():
+                buffer = buffers.get(name)
+                if buffer is None:
+                    buffer = buffers[name] = [None] * rows
+                buffer.append(value)
+            rows += 1
+            if len(row) < len(buffers):
+                for buffer in buffers.values():
+                    if len(buffer) < rows:
+                        buffer.append(None)
+        self._rows[result_key] = rows
+
+    def add_raw(self, gwlfe_raw_result: Dict, huc_id: str, huc_level: int):
+        """Appends the "Raw" GWLF-E results of a HUC12: monthly values,
+        metadata, flow summary, load summaries and loads by source.
+        """
+        columns = {"gwlfe_endpoint": "gwlfe", "huc": huc_id, "huc_level": huc_level}
+        self.append(
+            "gwlfe_monthly_q",
+            [
+                {**month_values, "month": month + 1}
+                for month, month_values in enumerate(gwlfe_raw_result["monthly"])
+            ],
+            columns,
+        )
+        self.append("gwlfe_metadata", [gwlfe_raw_result["meta"]], columns)
+        self.append(
+            "gwlfe_summ_q",
+            [{key: gwlfe_raw_result[key] for key in SUMMARY_KEYS}],
+            columns,
+        )
+        self.append("raw_load_summaries", gwlfe_raw_result["SummaryLoads"], columns)
+        self.append("raw_source_summaries", gwlfe_raw_result["Loads"], columns)
+
+    def add_attenuated(self, gwlfe_sb_result: Dict, huc_id: str, huc_level: int):
+        """Appends the attenuated sub-basin GWLF-E results of a HUC12: its
+        load summary and loads by source.
+        """
+        columns = {"gwlfe_endpoint": "subbasin", "huc": huc_id, "huc_level": huc_level}
+        self.append(
+            "attenuated_load_summaries", [gwlfe_sb_result["SummaryLoads"]], columns
+        )
+        self.append("attenuated_source_summaries", gwlfe_sb_result["Loads"], columns)
+
+    def __len__(self) -> int:
+        """Rows appended, of every result type."""
+        return sum(self._rows.values())
+
+    def tables(self) -> Dict[str, pa.Table]:
+        """A table per result type with rows, in the order first appended."""
+        return {
+            result_key: pa.table(buffers)
+            for result_key, buffers in self._columns.items()
+            if self._rows[result_key] > 0
+        }
+
+    def frames(self) -> Dict[str, pd.DataFrame]:
+        """The tables of `tables()` as DataFrames."""
+        return {
+            result_key: table.to_pandas() for result_key, table in self.tables().items()
+        }
+
+    def clear(self):
+        """Empties every table, keeping the constant columns."""
+        self._columns = {}
+        self._rows = {}
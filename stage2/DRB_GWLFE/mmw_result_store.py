@@ -0,0 +1,219 @@
+"""
+A content-addressed store of ModelMW job results, so a job is only run again
+when its request changes, whatever it's labelled.
+
+Each result is keyed by `MmwResultStore.key()`, a SHA-256 hash of the
+endpoint, the payload with its dict keys sorted, and the layer overrides. A
+GWLF-E payload names its Mapshed job by UUID, which is different every time
+Mapshed runs, so callers key GWLF-E jobs by the key of their Mapshed job
+instead, and by the weather station set and layer of their weather, so a
+result can be found before getting the weather. SRAT results are keyed by the
+key of the GWLF-E result they were run on, so a GWLF-E job that's run again is
+never paired with an older SRAT result (see `run_gwlfe_srat_drb_v3.py`).
+
+The job dicts are saved as gzipped JSON files named by their key:
+
+    <root>/objects/3f/3fa2...e1.json.gz
+
+and a SQLite index maps each key to its endpoint, job UUID and size, and each
+(endpoint, label) to the key it last pointed to. `MmwResultStore.gc()`
+deletes results no label points to any more, such as the results of a
+payload that changed.
+"""
+import os
+import gzip
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import pandas as pd
+
+from pollution_assessment.manifest import input_hash
+
+PathLike = Union[str, Path]
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+class MmwResultStore:
+    """ModelMW job dicts by a hash of their request.
+
+    Args:
+        root: Directory of the store, which is created if it doesn't exist
+        compression_level: gzip level of the saved results. Defaults to 6.
+    """
+
+    def __init__(self, root: PathLike, compression_level: int = 6):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.compression_level = compression_level
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            self.root / "index.sqlite", check_same_thread=False
+        )
+        with self._connection:
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    endpoint TEXT NOT NULL,
+                    job_uuid TEXT,
+                    bytes INTEGER NOT NULL,
+                    created TEXT,
+                    last_used TEXT
+                )
+                """
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS results_job_uuid ON results (job_uuid)"
+            )
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS labels (
+                    endpoint TEXT NOT NULL,
+                    label TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    PRIMARY KEY (endpoint, label)
+                )
+                """
+            )
+
+    def close(self):
+        self._connection.close()
+
+    @staticmethod
+    def key(endpoint: str, payload: Dict, layer_overrides: Optional[Dict] = None) -> str:
+        """The key of a job: a hash of its endpoint, payload and layer
+        overrides that doesn't depend on the order of dict keys.
+        """
+        return input_hash(endpoint, payload, layer_overrides)
+
+    def _blob_path(self, key: str) -> Path:
+        return self.root / "objects" / key[:2] / "{}.json.gz".format(key)
+
+    def _point_label(self, endpoint: str, label: str, key: str):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO labels (endpoint, label, key) VALUES (?, ?, ?)",
+            (endpoint, label, key),
+        )
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM results WHERE key = ?", (key,)
+            ).fetchone()
+        return row is not None
+
+    def get(self, key: str, label: Optional[str] = None) -> Optional[Dict]:
+        """The job dict saved with a key, or None if there isn't one.
+
+        Args:
+            key: Key from `key()`
+            label: Label to point at the key, so its result is kept by
+                `gc()`. Defaults to None.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT endpoint FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            blob_path = self._blob_path(key)
+            if row is None or not blob_path.is_file():
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self._connection:
+                self._connection.execute(
+                    "UPDATE results SET last_used = ? WHERE key = ?", (_now(), key)
+                )
+                if label is not None:
+                    self._point_label(row[0], label, key)
+        with gzip.open(blob_path, "rt") as fp:
+            return json.load(fp)
+
+    def put(self, key: str, job_dict: Dict, label: Optional[str] = None):
+        """Saves a job dict with a key, replacing any saved with the same key.
+
+        Args:
+            key: Key from `key()`
+            job_dict: Job dict, as from `mmw_run.run_mmw_job()`
+            label: Label to point at the key. Defaults to the job's
+                'job_label'.
+        """
+        endpoint = job_dict.get("request_endpoint", "")
+        label = job_dict.get("job_label") if label is None else label
+        job_uuid = job_dict.get("result_response", {}).get("job_uuid")
+        blob_path = self._blob_path(key)
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = blob_path.with_name(blob_path.name + ".tmp")
+        with gzip.open(tmp_path, "wt", compresslevel=self.compression_level) as fp:
+            json.dump(job_dict, fp, separators=(",", ":"))
+        os.replace(tmp_path, blob_path)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO results (key, endpoint, job_uuid, bytes, "
+                "created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, endpoint, job_uuid, blob_path.stat().st_size, _now(), _now()),
+            )
+            if label is not None:
+                self._point_label(endpoint, label, key)
+
+    def find_job(self, job_uuid: str) -> Optional[str]:
+        """The key of the saved result of a ModelMW job UUID, or None."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT key FROM results WHERE job_uuid = ?", (job_uuid,)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def gc(self, dry_run: bool = False) -> List[str]:
+        """Deletes the results no label points to, and files in the store
+        that aren't in the index (e.g. from a crash).
+
+        Args:
+            dry_run: Only list what would be deleted. Defaults to False.
+
+        Returns:
+            The keys of the results deleted.
+        """
+        with self._lock:
+            keys = [
+                row[0]
+                for row in self._connection.execute(
+                    "SELECT key FROM results WHERE key NOT IN "
+                    "(SELECT key FROM labels)"
+                )
+            ]
+            indexed = {
+                row[0] for row in self._connection.execute("SELECT key FROM results")
+            }
+            if dry_run:
+                return keys
+            with self._connection:
+                self._connection.executemany(
+                    "DELETE FROM results WHERE key = ?", [(key,) for key in keys]
+                )
+            for key in keys:
+                self._blob_path(key).unlink(missing_ok=True)
+            for path in (self.root / "objects").glob("*/*"):
+                if path.name.split(".")[0] not in indexed or path.name.endswith(".tmp"):
+                    path.unlink()
+        return keys
+
+    def summary(self) -> pd.DataFrame:
+        """The saved results, one row per key, with the labels pointing to
+        each.
+        """
+        with self._lock:
+            return pd.read_sql_query(
+                "SELECT results.*, group_concat(labels.label, ', ') AS labels "
+                "FROM results LEFT JOIN labels ON results.key = labels.key "
+                "GROUP BY results.key",
+                self._connection,
+            )
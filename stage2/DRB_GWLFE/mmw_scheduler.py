@@ -0,0 +1,393 @@
+"""
+Runs many ModelMW (Model My Watershed) jobs at once, instead of starting one
+job and polling it until it finishes before starting the next.
+
+`MmwJobScheduler.run_job()` starts a job and waits for its result, like
+`mmw_run.run_mmw_job()`, but many calls can wait at once: at most
+`max_in_flight` jobs are started and not yet finished, and a single loop polls
+every started job, waiting longer between rounds (up to `max_poll_interval`)
+while none of them finish. Waiting jobs are started by priority, so a HUC's
+GWLF-E job can be started as soon as its Mapshed job finishes, ahead of the
+Mapshed jobs of HUCs that haven't started yet.
+
+`MmwJob.job_dict()` has the keys of the dicts `mmw_run.run_mmw_job()`
+returns, so finished jobs can be saved with `mmw_run.dump_job_json()` and read
+back with `mmw_run.read_dumped_result()`.
+
+To try it without the real API, start `mmw_stub_server.py` and point the
+scheduler at its URL.
+"""
+import json
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+from dataclasses import dataclass, field, fields
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+import aiohttp
+import pandas as pd
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class MmwJobError(Exception):
+    """A ModelMW job that couldn't be started, failed, or timed out."""
+
+
+@dataclass
+class MmwJob:
+    """One ModelMW job: its request, status, result and timing."""
+
+    label: str
+    endpoint: str
+    payload: Dict = field(repr=False)
+    priority: int = 0
+    job_uuid: Optional[str] = None
+    status: str = "queued"
+    start_response: Optional[Dict] = field(default=None, repr=False)
+    result_response: Optional[Dict] = field(default=None, repr=False)
+    error: Optional[str] = None
+    start_attempts: int = 0
+    polls: int = 0
+    queued_seconds: float = 0.0
+    run_seconds: float = 0.0
+
+    def job_dict(self, request_host: str = "") -> Dict:
+        """The job as a dict in the shape `mmw_run.run_mmw_job()` returns."""
+        job_dict = {
+            "payload": self.payload,
+            "job_label": self.label,
+            "request_host": request_host,
+            "request_endpoint": self.endpoint,
+            "start_job_status": "complete" if self.job_uuid is not None else "failed",
+            "start_job_response": self.start_response,
+            "job_result_status": self.status,
+        }
+        if self.result_response is not None:
+            job_dict["result_response"] = self.result_response
+        return job_dict
+
+
+class PrioritySlots:
+    """A semaphore that lets waiters in by priority, lowest first, and in the
+    order they came for the same priority.
+    """
+
+    def __init__(self, slots: int):
+        self._free = slots
+        self._waiters = []
+        self._order = itertools.count()
+
+    async def acquire(self, priority: int = 0):
+        if self._free > 0 and len(self._waiters) == 0:
+            self._free -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # given the slot just as the waiter was cancelled
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while len(self._waiters) > 0:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._free += 1
+
+
+class MmwJobScheduler:
+    """Starts and polls many ModelMW jobs concurrently.
+
+    Use as an async context manager, so its poll loop is stopped and its
+    connections are closed:
+
+        async with MmwJobScheduler(mmw_api_url, api_key) as scheduler:
+            mapshed_job = await scheduler.run_job(endpoint, label, payload)
+
+    Args:
+        api_url: ModelMW API URL, with a trailing slash, such as
+            "https://staging.modelmywatershed.org/api/"
+        api_key: ModelMW API key
+        max_in_flight: Most jobs started and not yet finished. Defaults to 8.
+        poll_interval: Seconds between polling rounds while jobs are
+            finishing. Defaults to 2.
+        max_poll_interval: Longest time between polling rounds, in seconds.
+            Defaults to 30.
+        poll_backoff: Each polling round where no job finishes multiplies the
+            time until the next round by this. Defaults to 1.5.
+        job_timeout: Seconds after a job is started until it's given up on.
+            Defaults to 3600.
+        max_retries: Retries of a request that fails to start a job.
+            Defaults to 5.
+        backoff_factor: Retry n waits a random time up to
+            `backoff_factor * 2 ** n` seconds. Defaults to 1.
+        max_backoff: Longest wait between retries, in seconds. Defaults to 60.
+        request_timeout: Seconds until a single request times out. Defaults
+            to 60.
+    """
+
+    def __init__(
+        self,
+        api_url: str,
+        api_key: str,
+        max_in_flight: int = 8,
+        poll_interval: float = 2.0,
+        max_poll_interval: float = 30.0,
+        poll_backoff: float = 1.5,
+        job_timeout: float = 3600.0,
+        max_retries: int = 5,
+        backoff_factor: float = 1.0,
+        max_backoff: float = 60.0,
+        request_timeout: float = 60.0,
+    ):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.max_in_flight = max_in_flight
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.poll_backoff = poll_backoff
+        self.job_timeout = job_timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.request_timeout = request_timeout
+        self.host = urlsplit(api_url).netloc
+        self.jobs: List[MmwJob] = []
+        self.polling_rounds = 0
+        # started jobs by UUID, with the future of their result and deadline
+        self._started: Dict[str, Tuple[MmwJob, asyncio.Future, float]] = {}
+        self._slots = None
+        self._wakeup = None
+        self._poller = None
+        self._session = None
+
+    async def __aenter__(self):
+        self._slots = PrioritySlots(self.max_in_flight)
+        self._wakeup = asyncio.Event()
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_in_flight),
+            headers={
+                "Authorization": "Token {}".format(self.api_key),
+                "Content-Type": "application/json",
+                "X-Requested-With": "XMLHttpRequest",
+            },
+            timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+        )
+        self._poller = asyncio.create_task(self._poll_loop())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._poller.cancel()
+        try:
+            await self._poller
+        except asyncio.CancelledError:
+            pass
+        await self._session.close()
+        self._session = None
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Seconds to wait before a retry, with "full jitter"."""
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff_factor * 2**attempt)
+        )
+
+    async def run_job(
+        self, endpoint: str, label: str, payload: Dict, priority: int = 0
+    ) -> MmwJob:
+        """Starts a job once fewer than `max_in_flight` jobs are running, and
+        waits until it finishes.
+
+        Args:
+            endpoint: ModelMW endpoint, such as `mmw_run.subbasin_run_endpoint`
+            label: Label of the job, as for `mmw_run.run_mmw_job()`
+            payload: Request body of the job
+            priority: Jobs waiting to start are started lowest priority first.
+                Defaults to 0.
+
+        Returns:
+            The finished job, with its 'result_response'.
+
+        Raises:
+            MmwJobError: If the job couldn't be started, failed or timed out.
+        """
+        job = MmwJob(label, endpoint, payload, priority)
+        self.jobs.append(job)
+        queued = time.perf_counter()
+        await self._slots.acquire(priority)
+        started = time.perf_counter()
+        job.queued_seconds = started - queued
+        try:
+            await self._start(job)
+            job.status = "started"
+            result = asyncio.get_running_loop().create_future()
+            self._started[job.job_uuid] = (
+                job,
+                result,
+                time.monotonic() + self.job_timeout,
+            )
+            self._wakeup.set()
+            return await result
+        except Exception as e:
+            if job.status in ["queued", "started"]:
+                job.status = "failed"
+            if job.error is None:
+                job.error = repr(e)
+            raise
+        finally:
+            job.run_seconds = time.perf_counter() - started
+            self._started.pop(job.job_uuid, None)
+            self._slots.release()
+
+    async def _start(self, job: MmwJob):
+        """Posts the job's payload, retrying failures, and sets its UUID."""
+        url = urljoin(self.api_url, job.endpoint)
+        body = json.dumps(job.payload)
+        while True:
+            job.start_attempts += 1
+            retry_after = None
+            try:
+                async with self._session.post(url, data=body) as response:
+                    content = await response.read()
+                    if response.status in [200, 201, 202]:
+                        job.start_response = json.loads(content)
+                        job.job_uuid = job.start_response.get(
+                            "job_uuid", job.start_response.get("job")
+                        )
+                        if job.job_uuid is None:
+                            raise MmwJobError(
+                                "ModelMW didn't return a job for {}".format(job.label)
+                            )
+                        return
+                    job.error = "Starting ModelMW job {} failed: {} {}".format(
+                        job.label,
+                        response.status,
+                        content[:200].decode(errors="replace"),
+                    )
+                    if response.status not in RETRY_STATUSES:
+                        raise MmwJobError(job.error)
+                    retry_after = response.headers.get("Retry-After")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                job.error = "Starting ModelMW job {} failed: {!r}".format(job.label, e)
+
+            if job.start_attempts > self.max_retries:
+                raise MmwJobError(
+                    "{} (after {} attempts)".format(job.error, job.start_attempts)
+                )
+            delay = self._backoff(job.start_attempts - 1, retry_after)
+            logging.info(
+                "Retrying ModelMW job {} in {:.1f} s: {}".format(
+                    job.label, delay, job.error
+                )
+            )
+            await asyncio.sleep(delay)
+
+    async def _poll(self, job: MmwJob) -> Dict:
+        url = urljoin(self.api_url, "jobs/{}/".format(job.job_uuid))
+        async with self._session.get(url) as response:
+            content = await response.read()
+            if response.status != 200:
+                raise MmwJobError(
+                    "Polling ModelMW job {} failed: {}".format(job.label, response.status)
+                )
+            return json.loads(content)
+
+    async def _poll_started(self) -> int:
+        """Polls every started job once, and sets the result of the finished
+        ones.
+
+        Returns:
+            The number of jobs that finished.
+        """
+        started = list(self._started.items())
+        responses = await asyncio.gather(
+            *[self._poll(job) for _, (job, _, _) in started], return_exceptions=True
+        )
+        finished = 0
+        for (job_uuid, (job, result, deadline)), response in zip(started, responses):
+            job.polls += 1
+            if result.done():
+                continue
+            if isinstance(response, Exception):
+                # failed polls are tried again next round, until the deadline
+                logging.info("{!r}".format(response))
+                status = None
+            else:
+                status = response.get("status")
+            if status == "complete":
+                job.status = "complete"
+                job.error = None
+                job.result_response = response
+                result.set_result(job)
+            elif status == "failed":
+                job.status = "failed"
+                job.result_response = response
+                job.error = "ModelMW job {} failed: {}".format(
+                    job.label, response.get("error", "")
+                )
+                result.set_exception(MmwJobError(job.error))
+            elif time.monotonic() > deadline:
+                job.status = "timed out"
+                job.error = "ModelMW job {} timed out after {} s".format(
+                    job.label, self.job_timeout
+                )
+                result.set_exception(MmwJobError(job.error))
+            else:
+                continue
+            finished += 1
+            self._started.pop(job_uuid, None)
+        return finished
+
+    async def _poll_loop(self):
+        """Polls the started jobs in rounds, backing off while none finish."""
+        interval = self.poll_interval
+        try:
+            while True:
+                if len(self._started) == 0:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    interval = self.poll_interval
+                await asyncio.sleep(interval)
+                self.polling_rounds += 1
+                if await self._poll_started() > 0:
+                    interval = self.poll_interval
+                else:
+                    interval = min(interval * self.poll_backoff, self.max_poll_interval)
+        except Exception as e:
+            # don't leave jobs waiting on a loop that's stopped
+            for job, result, _ in self._started.values():
+                if not result.done():
+                    result.set_exception(
+                        MmwJobError("Polling ModelMW jobs stopped: {!r}".format(e))
+                    )
+            raise
+
+    def jobs_frame(self) -> pd.DataFrame:
+        """The jobs run as a DataFrame, one row per job, without their
+        payloads and responses.
+        """
+        return pd.DataFrame(
+            [
+                {
+                    job_field.name: getattr(job, job_field.name)
+                    for job_field in fields(job)
+                    if job_field.name
+                    not in ["payload", "start_response", "result_response"]
+                }
+                for job in self.jobs
+            ]
+        )
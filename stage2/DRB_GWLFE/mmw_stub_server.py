@@ -0,0 +1,174 @@
+"""
+A local stand-in for the ModelMW jobs API, to try `mmw_scheduler.py` and the
+concurrent runs of `run_gwlfe_srat_drb_v3.py` without the real service.
+
+A POST to any endpoint under /api/ starts a job and answers with its UUID;
+polling /api/jobs/<uuid>/ answers "started" until the job's made-up run time
+has passed, then "complete" with a made-up result: weather stations for the
+sub-basin Mapshed endpoint, and GWLF-E results in the shape of the sub-basin
+run endpoint for anything else. The values are pseudo-random but the same for
+the same HUC. The server records the most jobs it had running at once, and can
+fail a share of the jobs, to check the scheduler's limits and errors.
+
+Usage:
+    python mmw_stub_server.py [port] [min_seconds] [max_seconds] [failure_rate]
+"""
+import sys
+import json
+import time
+import uuid
+import zlib
+import random
+
+from aiohttp import web
+
+SUBBASIN_PREPARE_ENDPOINT = "modeling/subbasin/prepare/"
+
+
+def stub_stations(huc: str) -> list:
+    """Made-up weather stations for a HUC."""
+    rng = random.Random(zlib.crc32(huc.encode()))
+    return [
+        {"station": "US{:06d}".format(rng.randint(0, 999)), "distance": rng.random()}
+        for _ in range(rng.randint(1, 3))
+    ]
+
+
+def stub_subbasin_result(huc: str) -> dict:
+    """Made-up GWLF-E sub-basin results for a HUC12."""
+    rng = random.Random(zlib.crc32(huc.encode()))
+    loads = [
+        {
+            "Source": source,
+            "TotalP": rng.random(),
+            "TotalN": rng.random(),
+            "Sediment": rng.random(),
+        }
+        for source in ["Hay/Pasture", "Cropland", "Wooded Areas", "Farm Animals"]
+    ]
+    summary_loads = {
+        "Source": "Entire area",
+        "TotalP": rng.random(),
+        "TotalN": rng.random(),
+        "Sediment": rng.random(),
+    }
+    raw = {
+        "monthly": [
+            {"AvPrecipitation": rng.random(), "AvStreamFlow": rng.random()}
+            for _ in range(12)
+        ],
+        "meta": {"NYrs": 20, "SedDelivRatio": rng.random()},
+        "AreaTotal": rng.random() * 1000,
+        "MeanFlow": rng.random() * 1e8,
+        "MeanFlowPerSecond": rng.random(),
+        "SummaryLoads": [summary_loads],
+        "Loads": loads,
+    }
+    catchments = {}
+    for i in range(rng.randint(2, 5)):
+        catchments[str(zlib.crc32(huc.encode()) % 100000 * 10 + i)] = {
+            "Loads": loads,
+            "LoadingRateConcentrations": {"TotalP": rng.random(), "TotalN": rng.random()},
+            "TotalLoadingRates": {"TotalP": rng.random(), "TotalN": rng.random()},
+        }
+    return {
+        "HUC12s": {
+            huc: {
+                "Raw": raw,
+                "SummaryLoads": summary_loads,
+                "Loads": loads,
+                "Catchments": catchments,
+            }
+        }
+    }
+
+
+def make_app(
+    min_seconds: float = 0.0,
+    max_seconds: float = 0.0,
+    failure_rate: float = 0.0,
+    seed: int = 0,
+):
+    """An aiohttp app answering ModelMW job requests.
+
+    Args:
+        min_seconds: Shortest run time of a job. Defaults to 0.
+        max_seconds: Longest run time of a job. Defaults to 0.
+        failure_rate: Share of jobs that fail. Defaults to 0.
+        seed: Seed of the run times and failures. Defaults to 0.
+    """
+    rng = random.Random(seed)
+    app = web.Application(client_max_size=0)
+    app["jobs"] = {}
+    app["polls"] = 0
+    app["max_running"] = 0
+
+    def running() -> int:
+        now = time.monotonic()
+        return sum(1 for job in app["jobs"].values() if job["done_at"] > now)
+
+    async def start_job(request: web.Request) -> web.Response:
+        endpoint = request.match_info["endpoint"]
+        payload = json.loads(await request.read())
+        if endpoint == SUBBASIN_PREPARE_ENDPOINT:
+            huc = payload["huc"]
+            result = {huc: {"WeatherStations": stub_stations(huc)}}
+        else:
+            # the HUC of a GWLF-E job is the HUC of its Mapshed job
+            huc = app["jobs"][payload["job_uuid"]]["huc"]
+            result = stub_subbasin_result(huc)
+        job_uuid = str(uuid.uuid4())
+        app["jobs"][job_uuid] = {
+            "huc": huc,
+            "endpoint": endpoint,
+            "done_at": time.monotonic() + rng.uniform(min_seconds, max_seconds),
+            "failed": rng.random() < failure_rate,
+            "result": result,
+        }
+        app["max_running"] = max(app["max_running"], running())
+        return web.json_response({"job": job_uuid, "job_uuid": job_uuid, "status": "started"})
+
+    async def poll_job(request: web.Request) -> web.Response:
+        app["polls"] += 1
+        job_uuid = request.match_info["job_uuid"]
+        job = app["jobs"].get(job_uuid)
+        if job is None:
+            return web.Response(status=404, text="no job {}".format(job_uuid))
+        if job["done_at"] > time.monotonic():
+            return web.json_response({"job_uuid": job_uuid, "status": "started"})
+        if job["failed"]:
+            return web.json_response(
+                {"job_uuid": job_uuid, "status": "failed", "error": "stub failure"}
+            )
+        return web.json_response(
+            {"job_uuid": job_uuid, "status": "complete", "result": job["result"]}
+        )
+
+    app.router.add_route("GET", "/api/jobs/{job_uuid}/", poll_job)
+    app.router.add_route("POST", "/api/{endpoint:.*}", start_job)
+    return app
+
+
+async def start_stub_server(port: int = 0, **app_kwargs):
+    """Starts the stub server on localhost.
+
+    Returns:
+        A tuple of the `web.AppRunner`, to stop it with `await
+        runner.cleanup()`, and the API URL.
+    """
+    runner = web.AppRunner(make_app(**app_kwargs))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, "http://127.0.0.1:{}/api/".format(port)
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8081
+    min_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    max_seconds = float(sys.argv[3]) if len(sys.argv) > 3 else min_seconds
+    failure_rate = float(sys.argv[4]) if len(sys.argv) > 4 else 0.0
+    web.run_app(
+        make_app(min_seconds, max_seconds, failure_rate), host="127.0.0.1", port=port
+    )
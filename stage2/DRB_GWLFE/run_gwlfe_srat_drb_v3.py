@@ -3,9 +3,11 @@ Created by Sara Geleskie Damiano
 """
 #%%
 import sys
+import asyncio
 import logging
+from pathlib import Path
 
-# import time
+import time
 import json
 import copy
 from typing import Dict
@@ -13,6 +15,8 @@ import pytz
 from datetime import datetime
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 import geopandas as gpd
 import requests
@@ -22,6 +26,13 @@ from shapely.geometry.multipolygon import MultiPolygon
 from modelmw_client import *
 from soupsieve import closest
 
+from pollution_assessment.manifest import RunManifest, RunUnit, input_hash
+from pollution_assessment.telemetry import Telemetry, timer
+from mmw_scheduler import MmwJobScheduler
+from weather_cache import WeatherCache
+from mmw_result_store import MmwResultStore
+from gwlfe_collector import GwlfeResultCollector
+
 #%%
 # Set up the API client
 from mmw_secrets import (
@@ -47,6 +58,19 @@ land_use_layer = "2019_2019"
 stream_layer = "nhdhr"
 # ^^ NOTE:  This is the default.  I did not specify a stream override.
 weather_layer = "NASA_NLDAS_2000_2019"
+# skip HUCs that completed in an earlier run with the same inputs
+resume = True
+# start the Mapshed and GWLF-E jobs of many HUCs at once before running the
+# HUCs one at a time; see `mmw_scheduler.py`
+concurrent_mmw_jobs = True
+mmw_api_url = "https://staging.modelmywatershed.org/api/"
+mmw_max_in_flight = 8
+# weather modifications by weather station set, shared by the HUCs with the
+# same closest stations
+weather_cache = WeatherCache(save_path + "weather_cache.sqlite")
+# Mapshed and GWLF-E results by a hash of their request, so a job is only run
+# again if its request changes
+result_store = MmwResultStore(save_path + "mmw_result_store")
 
 #%%
 # Read location data - shapes from national map
@@ -100,11 +124,78 @@ logging.info("Starting script at {}".format(this_run_start))
 
 #%%
 # helper functions
+def mapshed_result_key(endpoint, payload):
+    return result_store.key(endpoint, payload, payload["layer_overrides"])
+
+
+def gwlfe_result_key(mapshed_key, weather_stations, used_weather_layer, layer_overrides):
+    # the Mapshed job is named by the key of its result instead of its UUID,
+    # which is different every time it's run, and the weather by the station
+    # set and layer it's from, so a stored result is found without getting
+    # the weather
+    return result_store.key(
+        mmw_run.subbasin_run_endpoint,
+        {
+            "inputmod_hash": mmw_run.inputmod_hash,
+            "mapshed": mapshed_key,
+            "weather_stations": weather_stations,
+            "weather_layer": used_weather_layer,
+        },
+        layer_overrides,
+    )
+
+
+def dumped_gwlfe_key(
+    dumped_payload, weather_stations, used_weather_layer, layer_overrides
+):
+    # the stations are from the Mapshed result, so they're the same for a
+    # dump of the same Mapshed job; the weather layer is in the dump's label
+    mapshed_key = result_store.find_job(dumped_payload["job_uuid"])
+    if mapshed_key is None:
+        return None
+    return gwlfe_result_key(
+        mapshed_key, weather_stations, used_weather_layer, layer_overrides
+    )
+
+
+def srat_result_payload(gwlfe_key):
+    # SRAT is run on the GWLF-E result, so its result is keyed by the key of
+    # the GWLF-E result it was run on
+    return {"gwlfe": gwlfe_key}
+
+
+def srat_result_key(srat_payload):
+    return result_store.key("wikiSRAT", srat_payload)
+
+
+def read_stored_result(endpoint, label, key, dumped_key):
+    # the result of a job with the same request, from the result store, or
+    # from the dump of an earlier run with the same label if its payload gives
+    # the same key
+    job_dict = result_store.get(key, label)
+    if job_dict is not None:
+        return job_dict
+    job_dict, _ = mmw_run.read_dumped_result(endpoint, label)
+    if (
+        job_dict is None
+        or "result" not in job_dict.get("result_response", {})
+        or "payload" not in job_dict
+    ):
+        return None
+    if dumped_key(job_dict["payload"]) != key:
+        logging.info("  --Not using {} of another request".format(label))
+        return None
+    result_store.put(key, job_dict, label)
+    return job_dict
+
+
 def read_or_run_mapshed(endpoint, label, payload):
-    job_dict = None
-    job_dict, result = mmw_run.read_dumped_result(
+    mapshed_key = mapshed_result_key(endpoint, payload)
+    job_dict = read_stored_result(
         endpoint,
         label,
+        mapshed_key,
+        lambda dumped_payload: mapshed_result_key(endpoint, dumped_payload),
     )
     if job_dict is None:
         logging.info("  Running Mapshed ({})".format(endpoint))
@@ -113,43 +204,46 @@ def read_or_run_mapshed(endpoint, label, payload):
             job_label=label,
             payload=payload,
         )
+        if job_dict is not None and "result_response" in job_dict.keys():
+            result_store.put(mapshed_key, job_dict, label)
     if job_dict is not None and "result_response" in job_dict.keys():
-        # if it's a whole basin mapshed, find the weather station key
-        if (
-            endpoint == mmw_run.gwlfe_prepare_endpoint
-            and "WeatherStations" in job_dict["result_response"]["result"].keys()
-        ):
-            station_list = [
-                sta["station"]
-                for sta in job_dict["result_response"]["result"]["WeatherStations"]
-            ]
-            station_list.sort()
-            weather_stations = ",".join(map(str, station_list))
-        # if it's a sub-basin mapshed, find stations for each HUC
-        elif endpoint == mmw_run.subbasin_prepare_endpoint:
-            weather_stations = {}
-            for huc12, huc12_prep in job_dict["result_response"]["result"].items():
-                if "WeatherStations" in huc12_prep.keys():
-                    station_list = [
-                        sta["station"] for sta in huc12_prep["WeatherStations"]
-                    ]
-                    station_list.sort()
-                    weather_station_val = ",".join(map(str, station_list))
-                    weather_stations[huc12] = weather_station_val
-
-        else:
-            weather_stations = None
         return (
             job_dict["result_response"]["job_uuid"],
-            weather_stations,
+            get_weather_stations(endpoint, job_dict),
         )
 
     return None, None
 
 
-def run_gwlfe(endpoint, label, mapshed_job_id, modifications):
-    logging.info("  Running GWLF-E ({})".format(endpoint))
-    gwlfe_payload: Dict = {
+def get_weather_stations(endpoint, job_dict):
+    # if it's a whole basin mapshed, find the weather station key
+    if (
+        endpoint == mmw_run.gwlfe_prepare_endpoint
+        and "WeatherStations" in job_dict["result_response"]["result"].keys()
+    ):
+        station_list = [
+            sta["station"]
+            for sta in job_dict["result_response"]["result"]["WeatherStations"]
+        ]
+        station_list.sort()
+        weather_stations = ",".join(map(str, station_list))
+    # if it's a sub-basin mapshed, find stations for each HUC
+    elif endpoint == mmw_run.subbasin_prepare_endpoint:
+        weather_stations = {}
+        for huc12, huc12_prep in job_dict["result_response"]["result"].items():
+            if "WeatherStations" in huc12_prep.keys():
+                station_list = [sta["station"] for sta in huc12_prep["WeatherStations"]]
+                station_list.sort()
+                weather_station_val = ",".join(map(str, station_list))
+                weather_stations[huc12] = weather_station_val
+
+    else:
+        weather_stations = None
+    return weather_stations
+
+
+def make_gwlfe_payload(mapshed_job_id, modifications) -> Dict:
+    return {
         # NOTE:  The value of the inputmod_hash doesn't really matter here
         # Internally, the ModelMW site uses the inputmod_hash in scenerios to
         # determine whether it can use cached results or if it needs to
@@ -158,10 +252,14 @@ def run_gwlfe(endpoint, label, mapshed_job_id, modifications):
         "modifications": modifications,
         "job_uuid": mapshed_job_id,
     }
+
+
+def run_gwlfe(endpoint, label, mapshed_job_id, modifications):
+    logging.info("  Running GWLF-E ({})".format(endpoint))
     gwlfe_job_dict: ModelMyWatershedJob = mmw_run.run_mmw_job(
         request_endpoint=endpoint,
         job_label=label,
-        payload=gwlfe_payload,
+        payload=make_gwlfe_payload(mapshed_job_id, modifications),
     )
     if "result_response" in gwlfe_job_dict.keys():
         gwlfe_result_raw = gwlfe_job_dict["result_response"]
@@ -171,10 +269,19 @@ def run_gwlfe(endpoint, label, mapshed_job_id, modifications):
     return gwlfe_job_dict, None
 
 
-def get_weather_modifications(huc_row, mapshed_job_id, layer_overrides):
+def get_weather_modifications(
+    huc_row, mapshed_job_id, layer_overrides, weather_stations=None
+):
     gwlfe_mods = [{}]
     used_weather_layer = "USEPA_1960_1990"
 
+    # HUCs with the same closest weather stations get the same weather
+    if weather_stations:
+        cached_weather = weather_cache.get(weather_stations, weather_layer)
+        if cached_weather is not None:
+            logging.info("  --Using cached weather for {}".format(weather_stations))
+            return weather_layer, [cached_weather]
+
     # With a mapshed job and a HUC shape, we create a project so we can get the weather data for it
     logging.info("  Creating a new project")
     project_dict: Dict = mmw_run.create_project(
@@ -209,6 +316,10 @@ def get_weather_modifications(huc_row, mapshed_job_id, layer_overrides):
         logging.info("  --Got weather data")
         used_weather_layer = weather_layer
         gwlfe_mods = [weather_2019["output"]]
+        if weather_stations:
+            weather_cache.put(
+                weather_stations, weather_layer, weather_2019["output"], huc_row["huc"]
+            )
 
     # clean up by deleting project
     logging.info("  Deleting project {}".format(project_id))
@@ -217,57 +328,6 @@ def get_weather_modifications(huc_row, mapshed_job_id, layer_overrides):
     return used_weather_layer, gwlfe_mods
 
 
-def append_raw_gwlfe_results(
-    huc_result: Dict, gwlfe_raw_result: Dict, huc_id: str, huc_level: int
-):
-    gwlfe_monthly = pd.DataFrame(gwlfe_raw_result["monthly"])
-    gwlfe_monthly["month"] = gwlfe_monthly.index + 1
-    gwlfe_meta = pd.DataFrame(gwlfe_raw_result["meta"], index=[1])
-    gwlfe_summary = pd.DataFrame(
-        {
-            key: gwlfe_raw_result[key]
-            for key in ["AreaTotal", "MeanFlow", "MeanFlowPerSecond"]
-        },
-        index=[1],
-    )
-    gwlfe_whole_load_summary = pd.DataFrame(gwlfe_raw_result["SummaryLoads"])
-    gwlfe_whole_sources = pd.DataFrame(gwlfe_raw_result["Loads"])
-
-    for frame in [
-        gwlfe_monthly,
-        gwlfe_meta,
-        gwlfe_summary,
-        gwlfe_whole_load_summary,
-        gwlfe_whole_sources,
-    ]:
-        frame["gwlfe_endpoint"] = "gwlfe"
-        frame["huc"] = huc_id
-        frame["huc_level"] = huc_level
-    huc_result["gwlfe_monthly_q"] = gwlfe_monthly
-    huc_result["gwlfe_metadata"] = gwlfe_meta
-    huc_result["gwlfe_summ_q"] = gwlfe_summary
-    huc_result["raw_load_summaries"] = gwlfe_whole_load_summary
-    huc_result["raw_source_summaries"] = gwlfe_whole_sources
-
-
-def append_attenuated_gwlfe_results(
-    huc_result: Dict, gwlfe_sb_result: Dict, huc_id: str, huc_level: int
-):
-    attenuated_load_summary = pd.DataFrame(gwlfe_sb_result["SummaryLoads"], index=[1])
-    attenuated_source_summary = pd.DataFrame(gwlfe_sb_result["Loads"])
-
-    for frame in [
-        attenuated_load_summary,
-        attenuated_source_summary,
-    ]:
-        frame["gwlfe_endpoint"] = "subbasin"
-        frame["huc"] = huc_id
-        frame["huc_level"] = huc_level
-
-    huc_result["attenuated_load_summaries"] = attenuated_load_summary
-    huc_result["attenuated_source_summaries"] = attenuated_source_summary
-
-
 # taken from https://github.com/WikiWatershed/model-my-watershed/blob/f9591f390c4f54751bf34019f3cc126f45892ca6/src/mmw/mmw/settings/gwlfe_settings.py#L623-L639
 SRAT_KEYS = {
     "Hay/Pasture": "hp",
@@ -318,19 +378,22 @@ def format_for_srat(huc12_id, model_output):
 TASK_REQUEST_TIMEOUT = 60
 
 # from https://github.com/WikiWatershed/model-my-watershed/blob/31566fefbb91055c96a32a6279dac5598ba7fc10/src/mmw/apps/modeling/tasks.py#L375-L409
-def run_srat(gwlfe_watereshed_result):
+def run_srat(gwlfe_watereshed_result, metrics=None):
     try:
         data = [format_for_srat(id, w) for id, w in gwlfe_watereshed_result.items()]
     except Exception as e:
         raise Exception("Formatting sub-basin GWLF-E results failed: %s" % e)
 
     headers = {"x-api-key": wiki_srat_key}
+    body = json.dumps(data)
+    if metrics is not None:
+        metrics["payload_bytes"] = len(body)
 
     try:
         r = requests.post(
             wiki_srat_url,
             headers=headers,
-            data=json.dumps(data),
+            data=body,
             timeout=60,
         )
     except requests.Timeout:
@@ -338,6 +401,9 @@ def run_srat(gwlfe_watereshed_result):
     except ConnectionError:
         raise Exception("Failed to connect to SRAT Catchment API")
 
+    if metrics is not None:
+        metrics["response_bytes"] = len(r.content)
+        metrics["retries"] = 0
     if r.status_code != 200:
         raise Exception(
             "SRAT Catchment API request failed: %s %s" % (r.status_code, r.text)
@@ -390,36 +456,58 @@ def format_wikisrat_return(
 
 
 #%%
-# create empty lists to hold results
-cum_results = {
-    "gwlfe_monthly_q": [],
-    "gwlfe_metadata": [],
-    "gwlfe_summ_q": [],
-    "raw_load_summaries": [],
-    "raw_source_summaries": [],
-    "attenuated_load_summaries": [],
-    "attenuated_source_summaries": [],
-    "catchment_loading_rates": [],
-    "reach_concentrations": [],
-    "catchment_sources": [],
-    "wikisrat_huc_sources": [],
-    "wikisrat_catchment_loading_rates": [],
-    "wikisrat_reach_concentrations": [],
-    "wikisrat_catchment_sources": [],
-}
-
-#%%
-for idx, huc_row in hucs_to_run.iterrows():
-    logging.info("=====================")
-    logging.info(
-        "{} ({}) -- {} of {}".format(
-            huc_row["huc"], huc_row["name"], idx, len(hucs_to_run.index)
-        )
-    )
-    huc_result = dict.fromkeys(cum_results.keys(), None)
-
-    mapshed_job_label = "{}_{}".format(huc_row["huc"], land_use_layer)
-    mapshed_payload = {
+# the results of each HUC are saved to Parquet files as soon as it's run, and
+# recorded in the run manifest, so a failed run can be resumed
+result_keys = [
+    "gwlfe_monthly_q",
+    "gwlfe_metadata",
+    "gwlfe_summ_q",
+    "raw_load_summaries",
+    "raw_source_summaries",
+    "attenuated_load_summaries",
+    "attenuated_source_summaries",
+    "catchment_loading_rates",
+    "reach_concentrations",
+    "catchment_sources",
+    "wikisrat_huc_sources",
+    "wikisrat_catchment_loading_rates",
+    "wikisrat_reach_concentrations",
+    "wikisrat_catchment_sources",
+]
+huc_results_path = save_path + "huc_results/"
+run_manifest = RunManifest(save_path + "run_manifest.sqlite")
+# record the time, sizes and rows of each HUC; summarize them with
+#   python -m pollution_assessment.telemetry <save_path>telemetry.jsonl
+telemetry = Telemetry(save_path + "telemetry.jsonl")
+
+
+def save_huc_result(huc: str, huc_result: Dict) -> Dict:
+    # results are DataFrames, or Arrow tables from a `GwlfeResultCollector`
+    outputs = {}
+    for result_key, result_frame in huc_result.items():
+        if result_frame is not None:
+            path = Path(huc_results_path) / result_key / "{}.parquet".format(huc)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if isinstance(result_frame, pa.Table):
+                pq.write_table(result_frame, path)
+            else:
+                result_frame.to_parquet(path, index=False)
+            outputs[result_key] = str(path)
+    return outputs
+
+
+def read_huc_results(result_key: str) -> pd.DataFrame:
+    # the saved results of the completed HUCs, in run order, as one table
+    tables = []
+    for unit in huc_units.values():
+        outputs = run_manifest.outputs(unit)
+        if outputs is not None and result_key in outputs:
+            tables.append(pq.read_table(outputs[result_key]))
+    return pa.concat_tables(tables, promote_options="permissive").to_pandas()
+
+
+def make_mapshed_payload(huc_row) -> Dict:
+    return {
         "huc": huc_row["huc"],
         "layer_overrides": {
             "__LAND__": mmw_run.land_use_layers[land_use_layer],
@@ -427,49 +515,99 @@ for idx, huc_row in hucs_to_run.iterrows():
         },
     }
 
-    mapshed_sb_job_id, closest_stations = read_or_run_mapshed(
-        mmw_run.subbasin_prepare_endpoint, mapshed_job_label, mapshed_payload
+
+def make_run_unit(huc_row, mapshed_payload) -> RunUnit:
+    return RunUnit(
+        huc_row["huc"], land_use_layer, weather_layer, "", input_hash(mapshed_payload)
     )
 
-    gwlfe_sb_result = None
-    gwlfe_sb_job_dict, gwlfe_sb_result = mmw_run.read_dumped_result(
+
+def make_gwlfe_label(huc_row, used_weather_layer):
+    return "{}_{}_{}".format(huc_row["huc"], land_use_layer, used_weather_layer)
+
+
+def read_stored_gwlfe(
+    huc_row, mapshed_key, weather_stations, used_weather_layer, layer_overrides
+):
+    label = make_gwlfe_label(huc_row, used_weather_layer)
+    gwlfe_key = gwlfe_result_key(
+        mapshed_key, weather_stations, used_weather_layer, layer_overrides
+    )
+    job_dict = read_stored_result(
         mmw_run.subbasin_run_endpoint,
-        "{}_{}_{}".format(huc_row["huc"], land_use_layer, weather_layer),
-        json_dump_path
-        + "{}_{}_{}_{}.json".format(
-            huc_row["huc"],
-            land_use_layer,
-            "USEPA_1960_1990",
-            mmw_run._pprint_endpoint(mmw_run.subbasin_run_endpoint),
+        label,
+        gwlfe_key,
+        lambda dumped_payload: dumped_gwlfe_key(
+            dumped_payload, weather_stations, used_weather_layer, layer_overrides
         ),
-        "SummaryLoads",
     )
-    if gwlfe_sb_result is None and closest_stations is not None:
-        used_weather_layer, gwlfe_mods = get_weather_modifications(
-            huc_row, mapshed_sb_job_id, mapshed_payload["layer_overrides"]
-        )
-    elif gwlfe_sb_job_dict is not None and gwlfe_sb_job_dict["payload"][
-        "modifications"
-    ] == [{}]:
-        used_weather_layer = "USEPA_1960_1990"
-    else:
-        used_weather_layer = weather_layer
+    return label, gwlfe_key, job_dict
 
-    gwlfe_job_label: str = "{}_{}_{}".format(
-        huc_row["huc"], land_use_layer, used_weather_layer
-    )
 
-    if gwlfe_sb_result is None and mapshed_sb_job_id is not None:
-        gwlfe_sb_job_dict, gwlfe_sb_result = run_gwlfe(
-            mmw_run.subbasin_run_endpoint,
-            gwlfe_job_label,
-            mapshed_sb_job_id,
-            gwlfe_mods,
+def run_huc(huc_row, mapshed_payload, metrics: Dict) -> Dict:
+    huc_result = dict.fromkeys(result_keys, None)
+
+    mapshed_job_label = "{}_{}".format(huc_row["huc"], land_use_layer)
+    with timer(metrics, "mapshed_seconds"):
+        mapshed_sb_job_id, closest_stations = read_or_run_mapshed(
+            mmw_run.subbasin_prepare_endpoint, mapshed_job_label, mapshed_payload
         )
 
+    # the GWLF-E job is keyed by its weather stations and layer, so the
+    # weather is only needed if the job wasn't run before
+    gwlfe_sb_result = None
+    gwlfe_key = None
+    used_weather_layer = weather_layer
+    if mapshed_sb_job_id is not None:
+        mapshed_key = mapshed_result_key(
+            mmw_run.subbasin_prepare_endpoint, mapshed_payload
+        )
+        weather_stations = closest_stations.get(huc_row["huc"])
+        layer_overrides = mapshed_payload["layer_overrides"]
+        gwlfe_job_label, gwlfe_key, gwlfe_sb_job_dict = read_stored_gwlfe(
+            huc_row, mapshed_key, weather_stations, weather_layer, layer_overrides
+        )
+        if gwlfe_sb_job_dict is None:
+            with timer(metrics, "weather_seconds"):
+                used_weather_layer, gwlfe_mods = get_weather_modifications(
+                    huc_row, mapshed_sb_job_id, layer_overrides, weather_stations
+                )
+            if used_weather_layer != weather_layer:
+                gwlfe_job_label, gwlfe_key, gwlfe_sb_job_dict = read_stored_gwlfe(
+                    huc_row,
+                    mapshed_key,
+                    weather_stations,
+                    used_weather_layer,
+                    layer_overrides,
+                )
+        if gwlfe_sb_job_dict is not None:
+            gwlfe_sb_result = copy.deepcopy(gwlfe_sb_job_dict["result_response"])[
+                "result"
+            ]
+        else:
+            with timer(metrics, "gwlfe_seconds"):
+                gwlfe_sb_job_dict, gwlfe_sb_result = run_gwlfe(
+                    mmw_run.subbasin_run_endpoint,
+                    gwlfe_job_label,
+                    mapshed_sb_job_id,
+                    gwlfe_mods,
+                )
+            if gwlfe_sb_result is not None:
+                result_store.put(gwlfe_key, gwlfe_sb_job_dict, gwlfe_job_label)
+
+    gwlfe_job_label: str = make_gwlfe_label(huc_row, used_weather_layer)
     wikisrat_job_label = gwlfe_job_label
     wikisrat_result = None
-    _, wikisrat_result = mmw_run.read_dumped_result("wikiSRAT", gwlfe_job_label)
+    if gwlfe_sb_result is not None:
+        # only a SRAT result of the same GWLF-E result is used, so a GWLF-E
+        # job that's run again is followed by SRAT
+        srat_payload = srat_result_payload(gwlfe_key)
+        srat_key = srat_result_key(srat_payload)
+        wikisrat_job_dict = read_stored_result(
+            "wikiSRAT", wikisrat_job_label, srat_key, srat_result_key
+        )
+        if wikisrat_job_dict is not None:
+            wikisrat_result = wikisrat_job_dict["result_response"]["result"]
 
     if (
         gwlfe_sb_result is not None
@@ -477,9 +615,15 @@ for idx, huc_row in hucs_to_run.iterrows():
         and huc_row["huc_level"] == 12
     ):
         logging.info("  Running SRAT")
-        wikisrat_result = run_srat(
-            {huc_row["huc"]: copy.deepcopy(gwlfe_sb_result["HUC12s"][huc_row["huc"]]["Raw"])}
-        )
+        with timer(metrics, "srat_seconds"):
+            wikisrat_result = run_srat(
+                {
+                    huc_row["huc"]: copy.deepcopy(
+                        gwlfe_sb_result["HUC12s"][huc_row["huc"]]["Raw"]
+                    )
+                },
+                metrics,
+            )
 
         if wikisrat_result is not None:
             mock_job_dict = {
@@ -488,21 +632,33 @@ for idx, huc_row in hucs_to_run.iterrows():
                 "request_endpoint": "wikiSRAT",
                 "start_job_status": "complete",
                 "job_result_status": "complete",
+                "payload": srat_payload,
                 "result_response": {"result": wikisrat_result},
             }
             mmw_run.dump_job_json(mock_job_dict)
+            result_store.put(srat_key, mock_job_dict, wikisrat_job_label)
+
+    run_columns = {
+        "huc_run": huc_row["huc"],
+        "huc_run_level": huc_row["huc_level"],
+        "huc_run_name": huc_row["name"],
+        "huc_run_states": huc_row["states"],
+        "huc_run_areaacres": huc_row["areaacres"],
+        "land_use_source": land_use_layer,
+        "closest_weather_stations": None
+        if closest_stations is None
+        else closest_stations.get(huc_row["huc"]),
+        "stream_layer": stream_layer,
+        "weather_source": used_weather_layer,
+    }
+    gwlfe_collector = GwlfeResultCollector(run_columns)
 
     logging.info("  Framing data")
+    framing_start = time.perf_counter()
     if gwlfe_sb_result is not None:
         for huc12 in gwlfe_sb_result["HUC12s"].keys():
-            gwlfe_raw_result = gwlfe_sb_result["HUC12s"][huc12]["Raw"]
-            append_raw_gwlfe_results(huc_result, gwlfe_raw_result, huc12, 12)
-            append_attenuated_gwlfe_results(
-                huc_result,
-                gwlfe_sb_result["HUC12s"][huc12],
-                huc12,
-                12,
-            )
+            gwlfe_collector.add_raw(gwlfe_sb_result["HUC12s"][huc12]["Raw"], huc12, 12)
+            gwlfe_collector.add_attenuated(gwlfe_sb_result["HUC12s"][huc12], huc12, 12)
             catch_results = {
                 "catchment_loading_rates": [],
                 "reach_concentrations": [],
@@ -582,52 +738,196 @@ for idx, huc_row in hucs_to_run.iterrows():
 
     for result_key, result_frame in huc_result.items():
         if result_frame is not None:
-            result_frame["huc_run"] = huc_row["huc"]
-            result_frame["huc_run_level"] = huc_row["huc_level"]
-            result_frame["huc_run_name"] = huc_row["name"]
-            result_frame["huc_run_states"] = huc_row["states"]
-            result_frame["huc_run_areaacres"] = huc_row["areaacres"]
-            result_frame["land_use_source"] = land_use_layer
-            result_frame["closest_weather_stations"] = closest_stations[huc_row["huc"]]
-            result_frame["stream_layer"] = stream_layer
-            result_frame["weather_source"] = used_weather_layer
-            cum_results[result_key].append(result_frame.copy())
+            for column, value in run_columns.items():
+                result_frame[column] = value
+    # the GWLF-E tables already have the run columns
+    huc_result.update(gwlfe_collector.tables())
+    metrics["framing_seconds"] = time.perf_counter() - framing_start
+    return huc_result
 
 
 #%%
-# join various results
-gwlfe_monthly_q = pd.concat(cum_results["gwlfe_monthly_q"], ignore_index=True)
-gwlfe_metadata = pd.concat(cum_results["gwlfe_metadata"], ignore_index=True)
-gwlfe_summ_q = pd.concat(cum_results["gwlfe_summ_q"], ignore_index=True)
-raw_load_summaries = pd.concat(cum_results["raw_load_summaries"], ignore_index=True)
-raw_source_summaries = pd.concat(
-    cum_results["raw_source_summaries"], ignore_index=True
-)
+# Start the Mapshed and GWLF-E jobs of the HUCs left to run concurrently, each
+# HUC's GWLF-E job as soon as its Mapshed job finishes, and save them as
+# `mmw_run.run_mmw_job()` would; the loop below then reads the saved jobs.
+# HUCs whose jobs fail here are run one job at a time by the loop.
+async def run_huc_jobs(scheduler, huc_row):
+    mapshed_payload = make_mapshed_payload(huc_row)
+    unit = make_run_unit(huc_row, mapshed_payload)
+    mapshed_job_label = "{}_{}".format(huc_row["huc"], land_use_layer)
+    mapshed_key = mapshed_result_key(mmw_run.subbasin_prepare_endpoint, mapshed_payload)
+    mapshed_job_dict = read_stored_result(
+        mmw_run.subbasin_prepare_endpoint,
+        mapshed_job_label,
+        mapshed_key,
+        lambda dumped_payload: mapshed_result_key(
+            mmw_run.subbasin_prepare_endpoint, dumped_payload
+        ),
+    )
+    if mapshed_job_dict is None:
+        mapshed_job = await scheduler.run_job(
+            mmw_run.subbasin_prepare_endpoint,
+            mapshed_job_label,
+            mapshed_payload,
+            # GWLF-E jobs of HUCs with a finished Mapshed job go first
+            priority=1,
+        )
+        record_mmw_job(unit, mapshed_job)
+        mapshed_job_dict = mapshed_job.job_dict(scheduler.host)
+        mmw_run.dump_job_json(mapshed_job_dict)
+        result_store.put(mapshed_key, mapshed_job_dict, mapshed_job_label)
+
+    mapshed_job_id = mapshed_job_dict["result_response"]["job_uuid"]
+    weather_stations = get_weather_stations(
+        mmw_run.subbasin_prepare_endpoint, mapshed_job_dict
+    ).get(huc_row["huc"])
+    layer_overrides = mapshed_payload["layer_overrides"]
+    gwlfe_job_label, gwlfe_key, gwlfe_job_dict = read_stored_gwlfe(
+        huc_row, mapshed_key, weather_stations, weather_layer, layer_overrides
+    )
+    if gwlfe_job_dict is not None:
+        return
+    # the project and weather requests of `mmw_run` block, so they're run in
+    # threads while other HUCs' jobs are polled
+    used_weather_layer, gwlfe_mods = await asyncio.to_thread(
+        get_weather_modifications,
+        huc_row,
+        mapshed_job_id,
+        layer_overrides,
+        weather_stations,
+    )
+    if used_weather_layer != weather_layer:
+        gwlfe_job_label, gwlfe_key, gwlfe_job_dict = read_stored_gwlfe(
+            huc_row, mapshed_key, weather_stations, used_weather_layer, layer_overrides
+        )
+        if gwlfe_job_dict is not None:
+            return
+    gwlfe_job = await scheduler.run_job(
+        mmw_run.subbasin_run_endpoint,
+        gwlfe_job_label,
+        make_gwlfe_payload(mapshed_job_id, gwlfe_mods),
+        priority=0,
+    )
+    record_mmw_job(unit, gwlfe_job)
+    gwlfe_job_dict = gwlfe_job.job_dict(scheduler.host)
+    mmw_run.dump_job_json(gwlfe_job_dict)
+    result_store.put(gwlfe_key, gwlfe_job_dict, gwlfe_job_label)
+
+
+def record_mmw_job(unit, job):
+    telemetry.record(
+        unit,
+        "mmw_job",
+        endpoint=job.endpoint,
+        wall_seconds=job.run_seconds,
+        queued_seconds=job.queued_seconds,
+        retries=job.start_attempts - 1,
+        polls=job.polls,
+        status=job.status,
+    )
 
-attenuated_load_summaries = pd.concat(
-    cum_results["attenuated_load_summaries"], ignore_index=True
-)
-attenuated_source_summaries = pd.concat(
-    cum_results["attenuated_source_summaries"], ignore_index=True
-)
 
-catchment_loading_rates = pd.concat(
-    cum_results["catchment_loading_rates"], ignore_index=True
-)
-reach_concentrations = pd.concat(cum_results["reach_concentrations"], ignore_index=True)
-catchment_sources = pd.concat(cum_results["catchment_sources"], ignore_index=True)
+async def run_mmw_jobs(huc_rows):
+    async with MmwJobScheduler(
+        mmw_api_url, srgd_staging_api_key, max_in_flight=mmw_max_in_flight
+    ) as scheduler:
+        results = await asyncio.gather(
+            *[run_huc_jobs(scheduler, huc_row) for huc_row in huc_rows],
+            return_exceptions=True,
+        )
+    for huc_row, result in zip(huc_rows, results):
+        if isinstance(result, Exception):
+            logging.info(
+                "*** ModelMW jobs failed for {} ({}): {}".format(
+                    huc_row["huc"], huc_row["name"], result
+                )
+            )
+    return scheduler.jobs_frame()
+
+
+if concurrent_mmw_jobs:
+    huc_rows = [
+        huc_row
+        for _, huc_row in hucs_to_run.iterrows()
+        if not (
+            resume
+            and run_manifest.is_complete(
+                make_run_unit(huc_row, make_mapshed_payload(huc_row))
+            )
+        )
+    ]
+    logging.info("Running the ModelMW jobs of {} HUCs".format(len(huc_rows)))
+    # in a notebook, await run_mmw_jobs() instead
+    mmw_jobs = asyncio.run(run_mmw_jobs(huc_rows))
+    if len(mmw_jobs) > 0:
+        logging.info(
+            "ModelMW jobs by status:\n{}".format(mmw_jobs["status"].value_counts())
+        )
 
-wikisrat_huc_sources = pd.concat(cum_results["wikisrat_huc_sources"], ignore_index=True)
-wikisrat_catchment_loading_rates = pd.concat(
-    cum_results["wikisrat_catchment_loading_rates"], ignore_index=True
+#%%
+huc_units = {}
+for idx, huc_row in hucs_to_run.iterrows():
+    logging.info("=====================")
+    logging.info(
+        "{} ({}) -- {} of {}".format(
+            huc_row["huc"], huc_row["name"], idx, len(hucs_to_run.index)
+        )
+    )
+    mapshed_payload = make_mapshed_payload(huc_row)
+    unit = make_run_unit(huc_row, mapshed_payload)
+    huc_units[huc_row["huc"]] = unit
+    if resume and run_manifest.is_complete(unit):
+        logging.info("  Already ran {}".format(huc_row["huc"]))
+        continue
+
+    run_manifest.start(unit)
+    try:
+        with telemetry.measure(unit, "gwlfe") as huc_metrics:
+            huc_result = run_huc(huc_row, mapshed_payload, huc_metrics)
+            huc_metrics["rows"] = sum(
+                len(frame) for frame in huc_result.values() if frame is not None
+            )
+            with timer(huc_metrics, "write_seconds"):
+                outputs = save_huc_result(huc_row["huc"], huc_result)
+    except Exception as e:
+        logging.exception("*** Run failed for {}".format(huc_row["huc"]))
+        run_manifest.fail(unit, e)
+        continue
+    run_manifest.complete(unit, outputs)
+
+logging.info("HUCs by status:\n{}".format(run_manifest.summary()))
+logging.info(
+    "Weather cache: {} hits, {} misses".format(weather_cache.hits, weather_cache.misses)
 )
-wikisrat_reach_concentrations = pd.concat(
-    cum_results["wikisrat_reach_concentrations"], ignore_index=True
+logging.info(
+    "Result store: {} hits, {} misses".format(result_store.hits, result_store.misses)
 )
-wikisrat_catchment_sources = pd.concat(
-    cum_results["wikisrat_catchment_sources"], ignore_index=True
+# results of requests that changed aren't pointed to by any label
+logging.info(
+    "Deleted {} unused results from the result store".format(len(result_store.gc()))
 )
 
+
+#%%
+# join various results
+gwlfe_monthly_q = read_huc_results("gwlfe_monthly_q")
+gwlfe_metadata = read_huc_results("gwlfe_metadata")
+gwlfe_summ_q = read_huc_results("gwlfe_summ_q")
+raw_load_summaries = read_huc_results("raw_load_summaries")
+raw_source_summaries = read_huc_results("raw_source_summaries")
+
+attenuated_load_summaries = read_huc_results("attenuated_load_summaries")
+attenuated_source_summaries = read_huc_results("attenuated_source_summaries")
+
+catchment_loading_rates = read_huc_results("catchment_loading_rates")
+reach_concentrations = read_huc_results("reach_concentrations")
+catchment_sources = read_huc_results("catchment_sources")
+
+wikisrat_huc_sources = read_huc_results("wikisrat_huc_sources")
+wikisrat_catchment_loading_rates = read_huc_results("wikisrat_catchment_loading_rates")
+wikisrat_reach_concentrations = read_huc_results("wikisrat_reach_concentrations")
+wikisrat_catchment_sources = read_huc_results("wikisrat_catchment_sources")
+
 #%%
 # save csv's
 gwlfe_monthly_q.sort_values(by=["huc"] + ["month"]).reset_index(drop=True).to_csv(
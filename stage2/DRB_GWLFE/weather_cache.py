@@ -0,0 +1,108 @@
+"""
+A persistent cache of the GWLF-E weather modifications of each set of weather
+stations, so `run_gwlfe_srat_drb_v3.py` only creates a ModelMW project to
+download weather for station sets it hasn't seen.
+
+ModelMW builds the weather of a GWLF-E run from the weather stations closest
+to the area of interest, so every HUC with the same stations gets the same
+weather "output" modification. The cache keys each modification by the
+sorted, comma separated station IDs from the HUC's Mapshed job and the
+weather layer, and stores it as compressed JSON in a SQLite file.
+"""
+import json
+import zlib
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+import pandas as pd
+
+PathLike = Union[str, Path]
+
+
+class WeatherCache:
+    """Weather modifications by (weather stations, weather layer).
+
+    Safe to use from the threads `mmw_scheduler` runs the weather requests
+    in.
+
+    Args:
+        path: Path of the SQLite file, which is created if it doesn't exist
+    """
+
+    def __init__(self, path: PathLike):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS weather (
+                    weather_stations TEXT NOT NULL,
+                    weather_layer TEXT NOT NULL,
+                    output BLOB NOT NULL,
+                    huc TEXT,
+                    created TEXT,
+                    PRIMARY KEY (weather_stations, weather_layer)
+                )
+                """
+            )
+
+    def close(self):
+        self._connection.close()
+
+    def get(self, weather_stations: str, weather_layer: str) -> Optional[Dict]:
+        """The weather "output" modification for a station set and weather
+        layer, or None if it isn't cached.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT output FROM weather WHERE weather_stations = ? "
+                "AND weather_layer = ?",
+                (weather_stations, weather_layer),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(
+        self,
+        weather_stations: str,
+        weather_layer: str,
+        output: Dict,
+        huc: str = "",
+    ):
+        """Saves the weather "output" modification for a station set and
+        weather layer, with the HUC it was downloaded for.
+        """
+        blob = zlib.compress(json.dumps(output, separators=(",", ":")).encode())
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO weather (weather_stations, weather_layer, "
+                "output, huc, created) VALUES (?, ?, ?, ?, ?)",
+                (
+                    weather_stations,
+                    weather_layer,
+                    blob,
+                    huc,
+                    datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                ),
+            )
+
+    def summary(self) -> pd.DataFrame:
+        """The cached station sets, with the HUC, time and compressed size of
+        each, without the modifications.
+        """
+        with self._lock:
+            return pd.read_sql_query(
+                "SELECT weather_stations, weather_layer, huc, created, "
+                "length(output) AS output_bytes FROM weather",
+                self._connection,
+            )
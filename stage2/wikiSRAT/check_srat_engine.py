@@ -0,0 +1,79 @@
+"""
+Checks the routing and attenuation of `srat_engine.SratEngine` against the
+SRAT results saved in this repository.
+
+It builds the reach table from the NHDPlus reaches in
+`geography/reach_gdf.parquet` and the baseline results in
+`stage2/data_output`, routes the saved catchment loads of every run group
+through it, and compares the reach concentrations with SRAT's. The runs of a
+single HUC08 are used, grouped by HUC08, as SRAT ran them. It exits with an
+error if any run group differs by more than the tolerance.
+
+Usage:
+    python check_srat_engine.py [project_dir] [tolerance]
+"""
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+from srat_formatting import BASELINE_RUN_GROUP
+from srat_engine import (
+    SratEngine,
+    check_comparison,
+    reach_table_from_results,
+    validate_results,
+)
+
+
+def read_single_runs(path: Path) -> pd.DataFrame:
+    """Reads framed SRAT results, keeping the runs of a single HUC08, with
+    the HUC08 as 'super_huc'.
+    """
+    results = pd.read_parquet(path)
+    results = results.loc[results["run_type"] == "single"].copy()
+    results["super_huc"] = results["huc"].astype(str).str.slice(0, 8)
+    return results
+
+
+def main(project_dir: Path, tolerance: float) -> int:
+    data_dir = project_dir / "stage2" / "data_output"
+    reaches = pd.read_parquet(
+        project_dir / "geography" / "reach_gdf.parquet",
+        columns=["huc12", "maflowv", "nord", "nordstop"],
+    )
+    loads = read_single_runs(data_dir / "catch_loads_df.parquet")
+    concentrations = read_single_runs(data_dir / "reach_concs_df.parquet")
+
+    engine = SratEngine(
+        reach_table_from_results(
+            reaches,
+            loads.loc[loads["run_group"] == BASELINE_RUN_GROUP],
+            concentrations.loc[concentrations["run_group"] == BASELINE_RUN_GROUP],
+        )
+    )
+    failures = []
+    for run_group in loads["run_group"].unique():
+        comparison = validate_results(
+            engine,
+            loads.loc[loads["run_group"] == run_group],
+            concentrations.loc[concentrations["run_group"] == run_group],
+        )
+        print(
+            "SRAT engine vs WikiSRAT for {}:\n{}\n".format(
+                run_group, comparison.to_string()
+            )
+        )
+        try:
+            check_comparison(comparison, tolerance, run_group)
+        except ValueError as e:
+            failures.append(str(e))
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    return 1 if len(failures) > 0 else 0
+
+
+if __name__ == "__main__":
+    project_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(__file__).parents[2]
+    tolerance = float(sys.argv[2]) if len(sys.argv) > 2 else 1e-3
+    sys.exit(main(project_dir, tolerance))
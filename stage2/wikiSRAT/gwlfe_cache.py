@@ -0,0 +1,406 @@
+"""
+An indexed, columnar cache of the GWLF-E sub-basin results that the SRAT
+runner reads for each HUC12.
+
+`GwlfeRawCache.index()` reads each GWLF-E job dump once and saves the "Raw"
+results of its HUC12 as Parquet tables, keyed by HUC, land use layer and
+weather layer. Lists of records (e.g. "Loads", "monthly") become long tables
+with a 'position' column, dicts (e.g. "meta") become one row, and scalars
+(e.g. "MeanFlow") become columns of the 'scalars' table. Dumps that haven't
+changed since they were indexed aren't read again.
+
+`GwlfeRawCache.raw()` then builds the `huc8_dict` for a list of HUC12s from
+the tables, without parsing JSON or copying the dumps.
+
+Each row keeps the keys of its record in a '_keys' column, so records come
+back with the keys they had, nulls included, and the 'scalars' row of each
+HUC lists its list-valued keys in a '_lists' column, so empty lists (e.g.
+"Loads": []) come back too. Columns whose values have more than one type
+(e.g. ints and floats) are stored as JSON strings, listed in the table's
+'json_columns' metadata, so no value changes type. Results of dumps that were
+deleted are dropped from the cache when it's indexed.
+"""
+import os
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+PathLike = Union[str, Path]
+
+KEY_COLUMNS = ["huc", "land_use_layer", "weather_layer"]
+RECORD_KEYS_COLUMN = "_keys"
+LIST_KEYS_COLUMN = "_lists"
+JSON_COLUMNS_KEY = b"json_columns"
+
+
+def dump_file_name(
+    gwlfe_json_dump_path: str, huc: str, land_use_layer: str, weather_layer: str
+) -> str:
+    """Path of the GWLF-E sub-basin job dump for a HUC and layers."""
+    return gwlfe_json_dump_path + "{}_{}_{}_subbasin_run.json".format(
+        huc, land_use_layer, weather_layer
+    )
+
+
+def find_dump_file(
+    gwlfe_json_dump_path: str,
+    huc: str,
+    land_use_layer: str,
+    weather_layers: List[str],
+) -> Tuple[Optional[str], Optional[str]]:
+    """The GWLF-E dump for a HUC, as the SRAT runner picked it: the last of
+    `weather_layers` with a dump.
+
+    Returns:
+        A tuple of the path and weather layer of the dump, or of None and
+        None if there isn't one.
+    """
+    dump_file, dump_weather_layer = None, None
+    for weather_source in weather_layers:
+        file_name = dump_file_name(gwlfe_json_dump_path, huc, land_use_layer, weather_source)
+        if Path(file_name).is_file():
+            dump_file, dump_weather_layer = file_name, weather_source
+    return dump_file, dump_weather_layer
+
+
+def _flatten_raw(raw: Dict, key: Dict, tables: Dict[str, list]):
+    """Adds the records of one "Raw" result to the lists of `tables`, and
+    the names of its lists to the 'scalars' record.
+    """
+    scalars = dict(key)
+    list_keys = []
+    for name, value in raw.items():
+        if isinstance(value, list):
+            list_keys.append(name)
+            for position, record in enumerate(value):
+                tables.setdefault(name, []).append(
+                    {**key, "position": position, **record}
+                )
+        elif isinstance(value, dict):
+            tables.setdefault(name, []).append({**key, **value})
+        else:
+            scalars[name] = value
+    scalars[LIST_KEYS_COLUMN] = list_keys
+    tables.setdefault("scalars", []).append(scalars)
+
+
+def _json_columns(table: pa.Table) -> List[str]:
+    """Columns of a table stored as JSON strings."""
+    metadata = table.schema.metadata or {}
+    return json.loads(metadata.get(JSON_COLUMNS_KEY, b"[]"))
+
+
+def _set_json_columns(table: pa.Table, json_columns: List[str]) -> pa.Table:
+    metadata = dict(table.schema.metadata or {})
+    metadata[JSON_COLUMNS_KEY] = json.dumps(sorted(json_columns)).encode()
+    return table.replace_schema_metadata(metadata)
+
+
+def _with_json_columns(table: pa.Table, columns: List[str]) -> pa.Table:
+    """A table with some more columns stored as JSON strings."""
+    json_columns = _json_columns(table)
+    for column in columns:
+        if column in json_columns or column not in table.column_names:
+            continue
+        values = [
+            None if value is None else json.dumps(value)
+            for value in table[column].to_pylist()
+        ]
+        table = table.set_column(
+            table.column_names.index(column), column, pa.array(values, pa.string())
+        )
+        json_columns.append(column)
+    return _set_json_columns(table, json_columns)
+
+
+def _from_records(records: List[Dict], record_keys: bool = True) -> pa.Table:
+    """A table of records with a column for every key of any record, and
+    the keys of each record in `RECORD_KEYS_COLUMN`. Columns with values of
+    more than one type are stored as JSON strings.
+    """
+    columns = dict.fromkeys(key for record in records for key in record)
+    values = {column: [record.get(column) for record in records] for column in columns}
+    mixed = [
+        column
+        for column, column_values in values.items()
+        if column != LIST_KEYS_COLUMN
+        and len({type(value) for value in column_values if value is not None}) > 1
+    ]
+    arrays = {
+        column: [None if value is None else json.dumps(value) for value in column_values]
+        if column in mixed
+        else column_values
+        for column, column_values in values.items()
+    }
+    if LIST_KEYS_COLUMN in arrays:
+        arrays[LIST_KEYS_COLUMN] = pa.array(
+            arrays[LIST_KEYS_COLUMN], pa.list_(pa.string())
+        )
+    if record_keys:
+        arrays[RECORD_KEYS_COLUMN] = pa.array(
+            [[key for key in record if key != LIST_KEYS_COLUMN] for record in records],
+            pa.list_(pa.string()),
+        )
+    table = pa.table(arrays)
+    return _set_json_columns(table, mixed) if mixed else table
+
+
+def _concat_tables(tables: List[pa.Table]) -> pa.Table:
+    """Concatenates tables, storing a column as JSON strings in all of them
+    if it's stored that way in any, or has different types in them.
+    """
+    fields = {}
+    for table in tables:
+        for field in table.schema:
+            if not pa.types.is_null(field.type):
+                fields.setdefault(field.name, set()).add(field.type)
+    to_json = set(column for table in tables for column in _json_columns(table))
+    to_json |= {column for column, types in fields.items() if len(types) > 1}
+    to_json -= {RECORD_KEYS_COLUMN, LIST_KEYS_COLUMN}
+    tables = [_with_json_columns(table, sorted(to_json)) for table in tables]
+    return pa.concat_tables(tables, promote_options="permissive")
+
+
+def _records(table: pa.Table) -> List[Dict]:
+    """Rows of a table as dicts with the keys each record had, without the
+    key columns.
+    """
+    json_columns = set(_json_columns(table))
+    rows = table.to_pylist()
+    records = []
+    for row in rows:
+        record = {}
+        for name in row[RECORD_KEYS_COLUMN]:
+            if name in KEY_COLUMNS or name == "position":
+                continue
+            value = row[name]
+            if name in json_columns and value is not None:
+                value = json.loads(value)
+            record[name] = value
+        records.append(record)
+    return records
+
+
+class GwlfeRawCache:
+    """Parquet tables of the GWLF-E "Raw" results of each HUC12.
+
+    Args:
+        path: Directory of the cache
+    """
+
+    def __init__(self, path: PathLike):
+        self.path = Path(path)
+        self._tables: Dict[str, pa.Table] = {}
+
+    def _table_path(self, name: str) -> Path:
+        return self.path / "{}.parquet".format(name.replace("/", "_"))
+
+    def clear(self):
+        """Deletes every table of the cache."""
+        for path in self.path.glob("*.parquet"):
+            path.unlink()
+        (self.path / "tables.json").unlink(missing_ok=True)
+        self._tables = {}
+
+    def _read_table(self, name: str) -> pa.Table:
+        if name not in self._tables:
+            self._tables[name] = pq.read_table(self._table_path(name))
+        return self._tables[name]
+
+    def table_names(self) -> List[str]:
+        """Names of the tables, one per part of the "Raw" results."""
+        path = self.path / "tables.json"
+        if not path.is_file():
+            return []
+        with open(path) as fp:
+            return json.load(fp)
+
+    def keys(self) -> pd.DataFrame:
+        """The index of cached results: a row per HUC and layers, with the
+        weather layer of the dump used ('used_weather_layer') and the path,
+        size and modification time of the dump.
+        """
+        if not self._table_path("index").is_file():
+            return pd.DataFrame(
+                columns=KEY_COLUMNS
+                + ["used_weather_layer", "dump_file", "dump_size", "dump_mtime_ns"]
+            )
+        return self._read_table("index").to_pandas()
+
+    def table(self, name: str, hucs: Optional[List[str]] = None) -> pd.DataFrame:
+        """One part of the "Raw" results for every cached HUC, such as
+        "Loads" or "monthly", optionally for only some HUCs.
+        """
+        table = self._read_table(name)
+        if hucs is not None:
+            table = table.filter(pc.is_in(table["huc"], pa.array(hucs, pa.string())))
+        return table.to_pandas()
+
+    def index(
+        self,
+        gwlfe_json_dump_path: str,
+        hucs: List[str],
+        land_use_layer: str,
+        weather_layer: str,
+        fallback_weather_layers: Tuple[str, ...] = ("USEPA_1960_1990",),
+    ) -> pd.DataFrame:
+        """Reads the GWLF-E dumps of HUCs into the cache, skipping dumps that
+        are already cached and haven't changed, and drops the results of
+        dumps that no longer exist.
+
+        Args:
+            gwlfe_json_dump_path: Directory (with trailing separator) of the
+                GWLF-E job dumps
+            hucs: HUC12s to index
+            land_use_layer: Land use layer of the runs, such as "2019_2019"
+            weather_layer: Weather layer of the runs, such as
+                "NASA_NLDAS_2000_2019"
+            fallback_weather_layers: Weather layers of dumps to use instead
+                of `weather_layer`, as the SRAT runner did. Defaults to
+                ("USEPA_1960_1990",).
+
+        Returns:
+            The updated index from `keys()`.
+        """
+        index = self.keys()
+        cached = index.set_index(KEY_COLUMNS) if len(index) else None
+        deleted_keys = {
+            tuple(row[column] for column in KEY_COLUMNS)
+            for _, row in index.iterrows()
+            if not Path(row["dump_file"]).is_file()
+        }
+        new_rows, tables = [], {}
+        for huc in dict.fromkeys(hucs):
+            dump_file, dump_weather_layer = find_dump_file(
+                gwlfe_json_dump_path,
+                huc,
+                land_use_layer,
+                [weather_layer, *fallback_weather_layers],
+            )
+            if dump_file is None:
+                continue
+            stat = Path(dump_file).stat()
+            key = (huc, land_use_layer, weather_layer)
+            if cached is not None and key in cached.index:
+                row = cached.loc[key]
+                if (
+                    row["dump_file"] == dump_file
+                    and row["dump_size"] == stat.st_size
+                    and row["dump_mtime_ns"] == stat.st_mtime_ns
+                ):
+                    continue
+
+            with open(dump_file) as fp:
+                req_dump = json.load(fp)
+            huc12s = req_dump["result_response"]["result"]["HUC12s"]
+            if huc not in huc12s:
+                continue
+            _flatten_raw(huc12s[huc]["Raw"], dict(zip(KEY_COLUMNS, key)), tables)
+            new_rows.append(
+                {
+                    **dict(zip(KEY_COLUMNS, key)),
+                    "used_weather_layer": dump_weather_layer,
+                    "dump_file": dump_file,
+                    "dump_size": stat.st_size,
+                    "dump_mtime_ns": stat.st_mtime_ns,
+                }
+            )
+
+        if len(new_rows) == 0 and len(deleted_keys) == 0:
+            return index
+        self._save(new_rows, tables, deleted_keys)
+        return self.keys()
+
+    def _save(
+        self,
+        new_index: List[Dict],
+        tables: Dict[str, list],
+        deleted_keys: Optional[set] = None,
+    ):
+        """Replaces the rows of re-indexed keys in every table, and drops
+        the rows of deleted keys.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        table_names = sorted(set(self.table_names()) | set(tables))
+        new_keys = {tuple(row[column] for column in KEY_COLUMNS) for row in new_index}
+        dropped_keys = new_keys | (deleted_keys or set())
+
+        for name in table_names + ["index"]:
+            if name == "index":
+                new = _from_records(new_index, record_keys=False)
+            else:
+                new = _from_records(tables.get(name, []))
+            path = self._table_path(name)
+            if path.is_file():
+                old = pq.read_table(path)
+                keep = [
+                    key not in dropped_keys
+                    for key in zip(*(old[column].to_pylist() for column in KEY_COLUMNS))
+                ]
+                old = old.filter(pa.array(keep, pa.bool_()))
+                new = _concat_tables([old, new]) if new.num_rows else old
+            tmp_path = path.with_name(path.name + ".tmp")
+            pq.write_table(new, tmp_path, compression="zstd")
+            os.replace(tmp_path, path)
+            self._tables.pop(name, None)
+
+        with open(self.path / "tables.json", "w") as fp:
+            json.dump(table_names, fp)
+
+    def raw(
+        self, hucs: List[str], land_use_layer: str, weather_layer: str
+    ) -> Dict[str, Dict]:
+        """The "Raw" GWLF-E results of HUCs, like
+        `req_dump["result_response"]["result"]["HUC12s"][huc]["Raw"]`.
+
+        Args:
+            hucs: HUC12s, in the order wanted
+            land_use_layer: Land use layer of the runs
+            weather_layer: Weather layer the runs were indexed with
+
+        Returns:
+            A dict of "Raw" results by HUC, in the order of `hucs`, without
+            the HUCs that aren't cached.
+        """
+        result = {}
+        # 'scalars' first, for the list keys of every HUC
+        table_names = sorted(self.table_names(), key=lambda name: name != "scalars")
+        for name in table_names:
+            table = self._read_table(name)
+            table = table.filter(
+                pc.and_(
+                    pc.is_in(table["huc"], pa.array(hucs, pa.string())),
+                    pc.and_(
+                        pc.equal(table["land_use_layer"], land_use_layer),
+                        pc.equal(table["weather_layer"], weather_layer),
+                    ),
+                )
+            )
+            is_list = "position" in table.column_names
+            if is_list:
+                table = table.take(
+                    pc.sort_indices(
+                        table, sort_keys=[("huc", "ascending"), ("position", "ascending")]
+                    )
+                )
+            record_lists = {}
+            if name == "scalars" and LIST_KEYS_COLUMN in table.column_names:
+                record_lists = dict(
+                    zip(table["huc"].to_pylist(), table[LIST_KEYS_COLUMN].to_pylist())
+                )
+            for huc, record in zip(table["huc"].to_pylist(), _records(table)):
+                huc_raw = result.setdefault(huc, {})
+                if name == "scalars":
+                    huc_raw.update(record)
+                    for list_key in record_lists.get(huc) or []:
+                        huc_raw[list_key] = []
+                elif is_list:
+                    huc_raw.setdefault(name, []).append(record)
+                else:
+                    huc_raw[name] = record
+        return {huc: result[huc] for huc in hucs if huc in result}
@@ -2,23 +2,17 @@
 Created by Sara Geleskie Damiano
 """
 # %%
-from pathlib import Path
 import sys
 import logging
 
 # import time
 import json
-import copy
-from typing import Dict
 import pytz
 from datetime import datetime
 
 import pandas as pd
 
 import geopandas as gpd
-from requests import Session
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 
 # %%
 # Set up the API client
@@ -34,12 +28,6 @@ from mmw_secrets import (
     local_srat_path,
 )
 
-sys.path.append(local_srat_path)
-# import psycopg2
-from StringParser import StringParser
-from DatabaseAdapter import DatabaseAdapter
-from DatabaseFormatter import DatabaseFormatter
-
 land_use_layer = "2019_2019"
 # ^^ NOTE:  This is the default, but I also specified it in the code below
 stream_layer = "nhdhr"
@@ -144,425 +132,361 @@ logging.info("Starting script at {}".format(this_run_start))
 
 # %%
 # helper functions
-
-# taken from https://github.com/WikiWatershed/model-my-watershed/blob/f9591f390c4f54751bf34019f3cc126f45892ca6/src/mmw/mmw/settings/gwlfe_settings.py#L623-L639
-SRAT_KEYS = {
-    "Hay/Pasture": "hp",
-    "Cropland": "crop",
-    "Wooded Areas": "wooded",
-    "Open Land": "open",
-    "Barren Areas": "barren",
-    "Low-Density Mixed": "ldm",
-    "Medium-Density Mixed": "mdm",
-    "High-Density Mixed": "hdm",
-    "Low-Density Open Space": "tiledrain",
-    "Farm Animals": "farman",
-    "Stream Bank Erosion": "streambank",
-    "Subsurface Flow": "subsurface",
-    "Wetlands": "wetland",
-    "Point Sources": "pointsource",
-    "Septic Systems": "septics",
-    "Total Local Load": "total",
-    "Reach Concentration": "conc",
-    "Point Source Derived Concentration": "conc_ptsource",
-}
-
-
-# taken from https://github.com/WikiWatershed/model-my-watershed/blob/31566fefbb91055c96a32a6279dac5598ba7fc10/src/mmw/apps/modeling/tasks.py#L72-L96
-def format_for_srat(
-    huc12_id, model_output, with_attenuation, with_concentration, restoration_sources
-):
-    formatted = {
-        "huc12": huc12_id,
-        # Tile Drain may be calculated by future versions of
-        # Mapshed. The SRAT API requires a placeholder
-        "tpload_tiledrain": 0,
-        "tnload_tiledrain": 0,
-        "tssload_tiledrain": 0,
-    }
-
-    if restoration_sources != []:
-        formatted["restoration_sources"] = restoration_sources
-        # NOTE: sending a with_attenuation argument without a restoration source causes a failure
-        # formatted["with_attenuation"] = with_attenuation
-        # NOTE: sending a with_concentration argument without a restoration source causes a failure
-        formatted["with_concentration"] = with_concentration
-
-    for load in model_output["Loads"]:
-        source_key = SRAT_KEYS.get(load["Source"], None)
-
-        if source_key is None:
-            continue
-
-        formatted["tpload_" + source_key] = load["TotalP"]
-        formatted["tnload_" + source_key] = load["TotalN"]
-
-        if source_key not in ["farman", "subsurface", "septics", "pointsource"]:
-            formatted["tssload_" + source_key] = load["Sediment"]
-
-    return formatted
+from srat_formatting import BASELINE_RUN_GROUP
+from srat_pool import SratJob, run_jobs
+from srat_client import run_remote_jobs
+from srat_output import SratResultWriter, read_results
+from srat_engine import (
+    SratEngine,
+    check_comparison,
+    read_reduction_table,
+    reach_table_from_results,
+    validate_dump,
+)
+from srat_reuse import (
+    read_bmp_sources,
+    sources_by_super_huc,
+    effective_sources,
+    plan_run_groups,
+)
+from gwlfe_cache import GwlfeRawCache
+from pollution_assessment.manifest import RunManifest, RunUnit, input_hash
+from pollution_assessment.telemetry import Telemetry, timer
+from pollution_assessment import storage
+
+# number of processes to run SRAT on; None for one per core
+srat_max_workers = None
+# run on the WikiSRAT API instead of the local database, with at most this
+# many requests in flight at once
+use_remote_srat = False
+srat_max_in_flight = 4
+# also save the results as CSV's, after saving them to Parquet
+export_csv = True
+# skip jobs that completed in an earlier run with the same inputs
+resume = True
+# copy the results of run groups that add no BMPs in a super-HUC from the
+# baseline (or another run group), instead of running SRAT for them
+reuse_srat_results = True
+# run SRAT in this project with `SratEngine`, from saved reach and BMP
+# reduction tables, instead of on the SRAT database
+use_srat_engine = False
+srat_reaches_path = restoration_save_path + "srat_reaches.parquet"
+srat_reductions_path = restoration_save_path + "srat_reductions.parquet"
+# before running on the engine, compare it with the WikiSRAT results dumped
+# by an earlier run of this super-HUC on the SRAT database, for the baseline,
+# a restoration and a protection run group; the run stops if a dump is missing
+# or they differ by more than the tolerance
+srat_engine_check_huc = "02040101"
+srat_engine_check_run_groups = ["All Restoration", "Direct WPF Protection"]
+srat_engine_tolerance = 1e-3
+# after a run on the SRAT database, save the reach and reduction tables the
+# engine runs from, with the reaches in this NHDPlus reach file
+export_srat_engine_tables = True
+nhdplus_reaches_path = "../../geography/reach_gdf.parquet"
 
 
 # GET THE DATABASE CONFIG INFORMATION USING A CONFIG FILE.
 # THE FILE IS IN THE GITIGNORE SO WILL REQUIRE BEING SENT VIA EMAIL.
-
-config_file = json.load(open(local_srat_path + "db_config.json"))
-PG_CONFIG = config_file["PG_CONFIG"]
-
-_host = (PG_CONFIG["host"],)
-_database = (PG_CONFIG["database"],)
-_user = (PG_CONFIG["user"],)
-_password = (PG_CONFIG["password"],)
-_port = PG_CONFIG["port"]
+# Only needed to run SRAT on the database, so the engine runs offline.
+PG_CONFIG = None
 _flag = "base"
+if not use_srat_engine:
+    with open(local_srat_path + "db_config.json") as fp:
+        config_file = json.load(fp)
+    PG_CONFIG = config_file["PG_CONFIG"]
 
 
-# CREATE A COUPLE HELPER FUNCTIONS TO RUN THE MICROSERVICE
-def respond(err, res=None):
-    return {
-        "statusCode": "400" if err else "200",
-        "body": err.args[0] if err else json.dumps(res),
-        "headers": {
-            "Content-Type": "application/json",
-            "Access-Control-Allow-Origin": "*",
-        },
-    }
-
-
-def lambda_handler(event, context):
-    try:
-        data = StringParser.parse(event["body"])
-        db = DatabaseAdapter(
-            _database[0], _user[0], _host[0], _port, _password[0], _flag
+# %%
+# the in-process SRAT engine, if it's used
+srat_engine = None
+if use_srat_engine:
+    srat_engine = SratEngine.from_files(
+        srat_reaches_path, srat_reductions_path, with_attenuation=used_attenuation
+    )
+    for run_group in [BASELINE_RUN_GROUP] + srat_engine_check_run_groups:
+        comparison = validate_dump(
+            srat_engine,
+            restoration_json_dump_path,
+            srat_engine_check_huc,
+            run_group,
+        )
+        logging.info(
+            "SRAT engine vs WikiSRAT for {} {}:\n{}".format(
+                srat_engine_check_huc, run_group, comparison.to_string()
+            )
+        )
+        check_comparison(
+            comparison,
+            srat_engine_tolerance,
+            "{} {}".format(srat_engine_check_huc, run_group),
         )
-        input_array = DatabaseAdapter.python_to_array(data)
 
-        return respond(None, db.run_model(input_array))
-    except AttributeError as e:
-        return respond(e)
+# %%
+# write the results of each job to a Parquet dataset as soon as it's framed,
+# partitioned by result type and run group
+srat_writer = SratResultWriter(restoration_save_path + "srat_results")
+# remote jobs finish in any order, so the run groups are recorded up front
+srat_writer.add_run_groups(list(funding_source_groups))
+# record each job, to resume the run if it fails part way
+run_manifest = RunManifest(restoration_save_path + "run_manifest.sqlite")
+# record the time, sizes and rows of each job; summarize them with
+#   python -m pollution_assessment.telemetry <restoration_save_path>telemetry.jsonl
+telemetry = Telemetry(restoration_save_path + "telemetry.jsonl")
+
+# %%
+# read the GWLF-E results out of the job dumps once, into a columnar cache;
+# dumps already in the cache are only read again if they've changed
+logging.info("Indexing GWLF-E results")
+gwlfe_cache = GwlfeRawCache(restoration_save_path + "gwlfe_raw_cache")
+gwlfe_cache.index(
+    gwlfe_json_dump_path, list(hucs_to_run["huc"]), land_use_layer, weather_layer
+)
 
 
-TASK_REQUEST_TIMEOUT = 600
+# %%
+# load the GWLF-E results of each super-HUC
+# huc8_id='02040205'
+# huc8=hucs_to_run.groupby(by=["super_huc"]).get_group(huc8_id)
+huc8_dicts = {}
+gwlfe_hashes = {}
+for huc8_id, huc8 in hucs_to_run.groupby(by="super_huc"):
+    logging.info(huc8_id)
+    logging.info("  Loading GWLF-E Results")
+    huc8_rows = huc8.sort_values(by=["tohuc", "huc"])
+    huc8_dict = gwlfe_cache.raw(list(huc8_rows["huc"]), land_use_layer, weather_layer)
+    for _, huc_row in huc8_rows.loc[~huc8_rows["huc"].isin(huc8_dict)].iterrows():
+        logging.warning(
+            "No GWLF-E data from {} ({})".format(huc_row["huc"], huc_row["name"])
+        )
+    huc8_dicts[huc8_id] = huc8_dict
+    gwlfe_hashes[huc8_id] = input_hash(huc8_dict)
+
+
+def srat_unit(huc8_id, run_group, *inputs):
+    return RunUnit(
+        huc8_id,
+        land_use_layer,
+        weather_layer,
+        run_group,
+        input_hash(
+            gwlfe_hashes[huc8_id],
+            funding_source_groups[run_group],
+            used_attenuation,
+            with_concentration,
+            *inputs,
+        ),
+    )
 
 
-# create a TimeoutHTTPAdapter to enforce a default timeout on the session
-# from https://findwork.dev/blog/advanced-usage-python-requests-timeouts-retries-hooks/
-class TimeoutHTTPAdapter(HTTPAdapter):
-    def __init__(self, *args, **kwargs):
-        self.timeout = TASK_REQUEST_TIMEOUT
-        if "timeout" in kwargs:
-            self.timeout = kwargs["timeout"]
-            del kwargs["timeout"]
-        super().__init__(*args, **kwargs)
+def srat_job(huc8_id, run_group):
+    return SratJob(
+        huc8_id=huc8_id,
+        run_group=run_group,
+        funding_source_group=funding_source_groups[run_group],
+        gwlfe_watershed_result=huc8_dicts[huc8_id],
+        with_attenuation=used_attenuation,
+        with_concentration=with_concentration,
+        # keep the WikiSRAT dumps the engine is checked against
+        json_dump_path=None if use_srat_engine else restoration_json_dump_path,
+    )
 
-    def send(self, request, **kwargs):
-        timeout = kwargs.get("timeout")
-        if timeout is None:
-            kwargs["timeout"] = self.timeout
-        return super().send(request, **kwargs)
 
+def record_srat_metrics(key, job_metrics, status="complete", **extra):
+    # the wall time of a job is its time in a worker (or on the API) and
+    # writing its results, as jobs overlap
+    wall_seconds = sum(
+        job_metrics.get(name, 0.0)
+        for name in ["srat_seconds", "framing_seconds", "write_seconds"]
+    )
+    telemetry.record(
+        srat_units[key],
+        "srat",
+        wall_seconds=wall_seconds,
+        status=status,
+        **job_metrics,
+        **extra,
+    )
 
-retry_strategy = Retry(
-    total=5,
-    backoff_factor=0.5,
-    status_forcelist=[413, 429, 500, 502, 503, 504],
-    allowed_methods=["HEAD", "GET", "PUT", "POST", "DELETE", "OPTIONS", "TRACE"],
-    raise_on_status=True,
-)
-adapter = TimeoutHTTPAdapter(max_retries=retry_strategy)
-# create a request session
-srat_session = Session()
-srat_session.verify = True
-# mount the session for all requests, attaching the timeout/retry adapter
-srat_session.mount("https://", adapter)
-srat_session.mount("http://", adapter)
-srat_session.headers.update({"x-api-key": wiki_srat_key})
-
-
-# from https://github.com/WikiWatershed/model-my-watershed/blob/31566fefbb91055c96a32a6279dac5598ba7fc10/src/mmw/apps/modeling/tasks.py#L375-L409
-def run_srat(
-    gwlfe_watershed_result,
-    with_attenuation,
-    with_concentration,
-    restoration_sources,
-    srat_input_dump_file=None,
-    local_lambda=False,
-):
-    try:
-        data = [
-            format_for_srat(
-                id, w, with_attenuation, with_concentration, restoration_sources
-            )
-            for id, w in gwlfe_watershed_result.items()
-        ]
-        if srat_input_dump_file is not None:
-            with open(
-                srat_input_dump_file,
-                "w",
-            ) as fp:
-                json.dump(data, fp, indent=2)
-
-    except Exception as e:
-        raise Exception("Formatting sub-basin GWLF-E results failed: %s" % e)
-
-    # if we're running locally
-    if local_lambda:
-        event = {"body": json.dumps(data)}
-        lamda_response = lambda_handler(event, None)
-        response_body = dict(lamda_response)["body"]
-        srat_catchment_result = json.loads(response_body)
 
+def run_srat_jobs(srat_jobs):
+    """Runs SRAT for super-HUCs and run groups over a process pool (or on the
+    WikiSRAT API), writing the framed results of each job as it's yielded:
+    in job order from the pool, and as they complete from the API.
+    """
+    for job in srat_jobs:
+        run_manifest.start(srat_units[job.key])
+    if use_remote_srat:
+        srat_results = run_remote_jobs(
+            srat_jobs,
+            url=wiki_srat_url,
+            api_key=wiki_srat_key,
+            return_exceptions=True,
+            max_in_flight=srat_max_in_flight,
+        )
     else:
-        headers = {"x-api-key": wiki_srat_key}
-
-        try:
-            r = srat_session.post(
-                wiki_srat_url,
-                # headers=headers,
-                data=json.dumps(data),
-                timeout=600,
-            )
-            logging.info(
-                "Size of SRAT input: {}".format(
-                    (len(r.request.body) + len(r.request.headers)) / 1e6
-                )
-            )
-            logging.info("Size of SRAT response: {}".format(len(r.content) / 1e6))
-        except requests.Timeout:
-            logging.info(
-                "Size of SRAT input: {}".format(
-                    (len(r.request.body) + len(r.request.headers)) / 1e6
-                )
-            )
-            raise Exception("Request to SRAT Catchment API timed out")
-        except MaxRetryError:
-            logging.info(
-                "Size of SRAT input: {}".format(
-                    (len(r.request.body) + len(r.request.headers)) / 1e6
+        srat_results = run_jobs(
+            srat_jobs,
+            local_srat_path=local_srat_path,
+            pg_config=PG_CONFIG,
+            flag=_flag,
+            max_workers=srat_max_workers,
+            return_exceptions=True,
+            engine=srat_engine,
+        )
+    for job, job_results, job_metrics in srat_results:
+        if isinstance(job_results, Exception):
+            logging.error(
+                "  SRAT failed for {} {}: {}".format(
+                    job.huc8_id, job.run_group, job_results
                 )
             )
-            raise Exception("Request to SRAT Catchment API timed out")
-        except ConnectionError:
-            raise Exception("Failed to connect to SRAT Catchment API")
-
-        if r.status_code != 200:
-            raise Exception(
-                "SRAT Catchment API request failed: %s %s" % (r.status_code, r.text)
+            run_manifest.fail(srat_units[job.key], job_results)
+            record_srat_metrics(
+                job.key, job_metrics, status="failed", error=repr(job_results)
             )
-
-        try:
-            srat_catchment_result = r.json()
-        except ValueError:
-            raise Exception("SRAT Catchment API did not return JSON")
-
-    return srat_catchment_result
-
-
-def format_wikisrat_return(
-    in_dict: Dict, id_key: str = "comid", huc: str = ""
-) -> pd.DataFrame:
-    source_dict = copy.deepcopy(in_dict)
-    id_value = source_dict.pop(id_key)
-    loads = pd.DataFrame.from_dict(
-        source_dict, orient="index", columns=["Value"]
-    ).reset_index()
-    # temporary change until Lin updates database
-    loads.loc[loads["index"] == "tpconc_Crop", "index"] = "maflowv"
-    loads.loc[loads["index"] == "tpconc_hp", "index"] = "tn_conc_ptsource"
-    loads.loc[loads["index"] == "tnconc_hp", "index"] = "tp_conc_ptsource"
-    loads.loc[loads["index"] == "tssconc_hp", "index"] = "tss_conc_ptsource"
-    # break into sub-groups
-    maflowv = loads.loc[loads["index"] == "maflowv"].copy()
-    conc_ptsource = loads.loc[loads["index"].str.contains("conc_ptsource")].copy()
-    reach_conc = loads.loc[loads["index"].str.contains("loadrate_conc")].copy()
-    total_local_load = loads.loc[loads["index"].str.contains("loadrate_total")].copy()
-    local_loads_by_source = loads.loc[
-        ~(loads["index"] == "maflowv")
-        & ~(
-            loads["index"].str.contains("conc_ptsource")
-            & ~(loads["index"].str.contains("loadrate_conc"))
-            & ~(loads["index"].str.contains("loadrate_total"))
-        )
-    ].copy()
-
-    return_dict = {"maflowv": maflowv.drop(columns="index")}
-    for key, frame in zip(
-        ["conc_ptsource", "reach_conc", "total_local_load", "local_loads_by_source"],
-        [conc_ptsource, reach_conc, total_local_load, local_loads_by_source],
-    ):
-        frame[["Nutrient", "Source"]] = frame["index"].str.split("_", expand=True, n=1)
-        frame["Nutrient"] = frame["Nutrient"].replace(
+            continue
+        logging.info("  Framed {} for {}".format(job.huc8_id, job.run_group))
+        with timer(job_metrics, "write_seconds"):
+            paths = srat_writer.write(job.huc8_id, job.run_group, job_results)
+        record_srat_metrics(job.key, job_metrics)
+        run_manifest.complete(
+            srat_units[job.key],
             {
-                "tpload": "TotalP",
-                "tnload": "TotalN",
-                "tssload": "Sediment",
-                "tploadrate": "TotalP",
-                "tnloadrate": "TotalN",
-                "tssloadrate": "Sediment",
-                "tp": "TotalP",
-                "tn": "TotalN",
-                "tss": "Sediment",
-            }
+                "dataset": str(srat_writer.root),
+                "partitions": [str(path.parent) for path in paths],
+                "super_huc": job.huc8_id,
+            },
         )
-        frame["Source"] = frame["Source"].replace(SRAT_KEYS.values(), SRAT_KEYS.keys())
-
-        frame_w = frame.pivot(columns="Nutrient", index="Source", values="Value")
-        return_dict[key] = frame_w.reset_index()
-
-    for key, frame in return_dict.items():
-        if id_key == "huc12":
-            return_dict[key]["huc"] = id_value
-        if id_key == "comid":
-            return_dict[key]["comid"] = id_value
-            if huc != "":
-                return_dict[key]["huc"] = huc
-        return_dict[key]["gwlfe_endpoint"] = "wikisrat"
-        return_dict[key]["huc_level"] = 12
-
-    return copy.deepcopy(return_dict)
 
 
 # %%
-# create empty lists to hold results
-cum_results = {
-    "catchment_total_local_load": [],
-    "reach_concentrations": [],
-    "reach_average_flow": [],
-    "reach_pt_source_conc": [],
-    # NOTE:  Individual land use sources are NOT valid when applying restorations, only the totals
-    "catchment_sources_local_load": [],
-}
+# run the baseline first; it's also the result of any run group without BMPs
+# in a super-HUC
+logging.info("Running SRAT for the baseline")
+srat_units = {}
+baseline_jobs = []
+for huc8_id in huc8_dicts:
+    unit = srat_unit(huc8_id, BASELINE_RUN_GROUP)
+    srat_units[(huc8_id, BASELINE_RUN_GROUP)] = unit
+    if resume and run_manifest.is_complete(unit):
+        logging.info("  Already ran {} for {}".format(BASELINE_RUN_GROUP, huc8_id))
+        continue
+    baseline_jobs.append(srat_job(huc8_id, BASELINE_RUN_GROUP))
+run_srat_jobs(baseline_jobs)
 
+# %%
+# find the restoration sources with BMPs in the catchments of each super-HUC
+present_sources = {}
+if reuse_srat_results:
+    present_sources = sources_by_super_huc(
+        srat_engine.reductions[["comid", "source"]].drop_duplicates()
+        if use_srat_engine
+        else read_bmp_sources(PG_CONFIG),
+        read_results(
+            srat_writer.root,
+            "reach_concentrations",
+            [BASELINE_RUN_GROUP],
+            columns=["comid", "super_huc"],
+        ),
+    )
 
 # %%
-# huc8_id='02040205'
-# huc8=hucs_to_run.groupby(by=["super_huc"]).get_group(huc8_id)
-# run_group=list(funding_source_groups.keys())[1]
-# funding_source_group=list(funding_source_groups.values())[1]
-for huc8_id, huc8 in hucs_to_run.groupby(by="super_huc"):
-    logging.info(huc8_id)
-    logging.info("  Loading GWLF-E Results")
-    huc8_dict = {}
-    for _, huc_row in huc8.sort_values(by=["tohuc", "huc"]).iterrows():
-        gwlfe_result_file_name = (
-            gwlfe_json_dump_path
-            + "{}_{}_{{}}_subbasin_run.json".format(
-                huc_row["huc"], land_use_layer, weather_layer
-            )
-        )
-        gwlfe_result_file = None
-        for weather_source in [weather_layer, "USEPA_1960_1990"]:
-            if Path(gwlfe_result_file_name.format(weather_source)).is_file():
-                gwlfe_result_file = gwlfe_result_file_name.format(weather_source)
-
-        gwlfe_sb_result = None
-        if gwlfe_result_file is not None:
-            f = open(gwlfe_result_file)
-            req_dump = json.load(f)
-            f.close()
-            result_raw = req_dump["result_response"]
-            gwlfe_sb_result = copy.deepcopy(result_raw)["result"]
-        if gwlfe_sb_result is not None:
-            huc8_dict[huc_row["huc"]] = copy.deepcopy(
-                gwlfe_sb_result["HUC12s"][huc_row["huc"]]["Raw"]
-            )
+# queue a SRAT job for each other run group, unless a run group with the same
+# sources present in the super-HUC gives the same results
+srat_jobs = []
+srat_copies = []
+for huc8_id in huc8_dicts:
+    present = present_sources.get(huc8_id)
+    if present is None:
+        plan = {run_group: run_group for run_group in funding_source_groups}
+    else:
+        plan = plan_run_groups(funding_source_groups, present)
+    for run_group, funding_source_group in funding_source_groups.items():
+        if run_group == BASELINE_RUN_GROUP:
+            continue
+        inputs = [] if present is None else [effective_sources(funding_source_group, present)]
+        unit = srat_unit(huc8_id, run_group, *inputs)
+        srat_units[(huc8_id, run_group)] = unit
+        if resume and run_manifest.is_complete(unit):
+            logging.info("  Already ran {} for {}".format(run_group, huc8_id))
+            continue
+        if plan[run_group] == run_group:
+            srat_jobs.append(srat_job(huc8_id, run_group))
         else:
-            logging.warning(
-                "No GWLF-E data from {} ({})".format(huc_row["huc"], huc_row["name"])
-            )
+            srat_copies.append((huc8_id, plan[run_group], run_group))
+logging.info(
+    "Running {} SRAT jobs, and copying the results of {} more".format(
+        len(srat_jobs), len(srat_copies)
+    )
+)
+run_srat_jobs(srat_jobs)
 
-    # break
-    logging.info("  Running SRAT")
-    for run_group, funding_source_group in funding_source_groups.items():
-        logging.info("    Running for {}".format(run_group))
-        # gwlfe_watershed_result=huc8_dict
-        # with_attenuation=used_attenuation
-        # with_concentration=with_concentration
-        # restoration_sources=funding_source_group
-        # srat_input_dump_file=restoration_json_dump_path + "HUC8_{}_{}_input".format(huc8_id, run_group.lower().replace(" ", "_")) + ".json"
-        # local_lambda=True
-        wikisrat_result = run_srat(
-            gwlfe_watershed_result=huc8_dict,
-            with_attenuation=used_attenuation,
-            with_concentration=with_concentration,
-            restoration_sources=funding_source_group,
-            srat_input_dump_file=restoration_json_dump_path
-            + "HUC8_{}_{}_input".format(huc8_id, run_group.lower().replace(" ", "_"))
-            + ".json",
-            local_lambda=True,
+# %%
+# copy the results of the run groups that add no BMPs to another run group
+for huc8_id, from_run_group, run_group in srat_copies:
+    unit = srat_units[(huc8_id, run_group)]
+    run_manifest.start(unit)
+    if not run_manifest.is_complete(srat_units[(huc8_id, from_run_group)]):
+        run_manifest.fail(
+            unit, "{} didn't complete for {}".format(from_run_group, huc8_id)
+        )
+        continue
+    logging.info(
+        "  Copying {} for {} from {}".format(run_group, huc8_id, from_run_group)
+    )
+    with telemetry.measure(unit, "srat_copy", copied_from=from_run_group):
+        paths = srat_writer.copy(
+            huc8_id, from_run_group, run_group, funding_source_groups[run_group]
         )
+    run_manifest.complete(
+        unit,
+        {
+            "dataset": str(srat_writer.root),
+            "partitions": [str(path.parent) for path in paths],
+            "super_huc": huc8_id,
+            "copied_from": from_run_group,
+        },
+    )
 
-        if wikisrat_result is not None:
-            with open(
-                restoration_json_dump_path
-                + "HUC8_{}_{}".format(huc8_id, run_group.lower().replace(" ", "_"))
-                + ".json",
-                "w",
-            ) as fp:
-                json.dump(wikisrat_result, fp, indent=2)
-
-        if wikisrat_result is not None:
-            logging.info("      Framing data")
-            for huc12, huc12_wikisrat in wikisrat_result["huc12s"].items():
-                huc12_result = {key: None for key in cum_results.keys()}
-                h12_cpy = copy.deepcopy(huc12_wikisrat)
-                h12_catches = h12_cpy.pop("catchments")
-
-                catch_results = {key: [] for key in cum_results.keys()}
-                for catchment, catch_sources in h12_catches.items():
-                    catch_loads = format_wikisrat_return(catch_sources, huc=huc12)
-                    catch_results["catchment_total_local_load"].append(
-                        catch_loads["total_local_load"].copy()
-                    )
-                    catch_results["reach_concentrations"].append(
-                        catch_loads["reach_conc"].copy()
-                    )
-                    catch_results["reach_average_flow"].append(
-                        catch_loads["maflowv"].copy()
-                    )
-                    catch_results["reach_pt_source_conc"].append(
-                        catch_loads["conc_ptsource"].copy()
-                    )
-                    if run_group == "No restoration or protection":
-                        # NOTE:  Individual land use sources are NOT valid when applying restorations, only the totals
-                        catch_results["catchment_sources_local_load"].append(
-                            catch_loads["local_loads_by_source"].copy()
-                        )
-
-                for catch_res_key, catch_list in catch_results.items():
-                    if len(catch_list) > 0:
-                        all_catch_frame = pd.concat(catch_list, ignore_index=True)
-                        all_catch_frame["gwlfe_endpoint"] = "wikiSRAT"
-                        all_catch_frame["huc"] = huc12
-                        all_catch_frame["run_group"] = run_group
-                        all_catch_frame["run_type"] = (
-                            "combined" if "x" in huc8_id else "single"
-                        )
-                        all_catch_frame["funding_sources"] = ", ".join(
-                            funding_source_group
-                        )
-                        huc12_result[catch_res_key] = all_catch_frame.copy()
-
-                for result_key, result_frame in huc12_result.items():
-                    if result_frame is not None:
-                        cum_results[result_key].append(result_frame.copy())
-    #     break
-    # break
+logging.info("SRAT jobs by status:\n{}".format(run_manifest.summary()))
+if len(run_manifest.to_frame("failed")) > 0:
+    logging.warning("Some SRAT jobs failed; run again with resume = True to retry them")
 
 # %%
-# join various results and save csv's
-for all_res_key, all_list in cum_results.items():
-    if len(all_list) > 0:
-        all_catch_frame = pd.concat(all_list, ignore_index=True)
-        all_catch_frame["with_attenuation"] = used_attenuation
-        # all_catch_frame["with_concentration"] = with_concentration
-        all_catch_frame = (
-            all_catch_frame.sort_values(by=["huc", "comid"])
-            .reset_index(drop=True)
-            .copy()
-        )
-        all_catch_frame.to_csv(restoration_csv_path + all_res_key + csv_extension)
+# merge the files of each partition, sorted by HUC and COMID, and save csv's
+srat_writer.compact()
+if export_csv:
+    srat_writer.to_csv(
+        restoration_csv_path, csv_extension, with_attenuation=used_attenuation
+    )
 
+# %%
+# save the tables the engine runs from, from the SRAT database and the
+# baseline results of this run
+if export_srat_engine_tables and not use_srat_engine:
+    logging.info("Saving the SRAT engine tables")
+    read_reduction_table(PG_CONFIG).to_parquet(srat_reductions_path)
+    baseline = {
+        result_type: read_results(srat_writer.root, result_type, [BASELINE_RUN_GROUP])
+        for result_type in [
+            "catchment_total_local_load",
+            "reach_concentrations",
+            "catchment_sources_local_load",
+            "reach_average_flow",
+        ]
+    }
+    storage.to_parquet(
+        reach_table_from_results(
+            pd.read_parquet(
+                nhdplus_reaches_path, columns=["huc12", "maflowv", "nord", "nordstop"]
+            ),
+            baseline["catchment_total_local_load"],
+            baseline["reach_concentrations"],
+            baseline["catchment_sources_local_load"],
+            baseline["reach_average_flow"],
+        ),
+        srat_reaches_path,
+    )
 
 # %%
 logging.info("DONE!")
@@ -0,0 +1,432 @@
+"""
+An asyncio client for the remote WikiSRAT API, which posts the requests for
+many (super-HUC, run group) jobs at once instead of one after another.
+
+`stream_jobs()` formats each job's request only when a slot is free to post
+it, and yields the results as they complete through a bounded queue, so the
+caller can write and drop each result while the others are still running.
+
+The client keeps a bounded number of requests in flight over one pooled
+connection per slot, spaces requests to each host by a minimum interval,
+retries failed requests with jittered exponential backoff (honoring
+Retry-After), streams the JSON request bodies as they're encoded, and records
+the latency of every call in `AsyncSratClient.calls`.
+
+To try it without the real API, start `srat_stub_server.py` and point the
+client at its URL.
+"""
+import json
+import time
+import random
+import asyncio
+import logging
+from dataclasses import dataclass, asdict
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import aiohttp
+import pandas as pd
+
+from pollution_assessment.telemetry import timer
+from srat_formatting import (
+    count_rows,
+    format_srat_input,
+    frame_wikisrat_result,
+    run_group_file_stem,
+)
+
+RETRY_STATUSES = (413, 429, 500, 502, 503, 504)
+
+
+class SratRequestError(Exception):
+    """A request to the WikiSRAT API that failed after all its retries."""
+
+
+@dataclass
+class SratCall:
+    """Timing and size of one call to the WikiSRAT API, including retries."""
+
+    key: Any
+    host: str
+    status: Optional[int] = None
+    attempts: int = 0
+    request_bytes: int = 0
+    response_bytes: int = 0
+    queued_seconds: float = 0.0
+    latency_seconds: float = 0.0
+    error: Optional[str] = None
+
+
+class HostRateLimiter:
+    """Spaces requests to each host at least `min_interval` seconds apart."""
+
+    def __init__(self, min_interval: float = 0.0):
+        self.min_interval = min_interval
+        self._next_start = {}
+        self._lock = asyncio.Lock()
+
+    async def wait(self, host: str):
+        if self.min_interval <= 0:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start.get(host, now))
+            self._next_start[host] = start + self.min_interval
+        await asyncio.sleep(start - now)
+
+
+async def _json_chunks(
+    data, counter: List[int], chunk_size: int = 1 << 16
+) -> AsyncIterator[bytes]:
+    """Encodes JSON in chunks, so the whole body is never one string."""
+    buffer = []
+    buffered = 0
+    for piece in json.JSONEncoder().iterencode(data):
+        buffer.append(piece)
+        buffered += len(piece)
+        if buffered >= chunk_size:
+            chunk = "".join(buffer).encode()
+            counter[0] += len(chunk)
+            yield chunk
+            buffer, buffered = [], 0
+            # let other requests run while a large body is encoded
+            await asyncio.sleep(0)
+    if buffer:
+        chunk = "".join(buffer).encode()
+        counter[0] += len(chunk)
+        yield chunk
+
+
+class AsyncSratClient:
+    """Posts requests to the WikiSRAT API concurrently.
+
+    Use as an async context manager, so its connections are closed:
+
+        async with AsyncSratClient(wiki_srat_url, wiki_srat_key) as client:
+            results = await client.post_all(requests_by_key)
+
+    Args:
+        url: WikiSRAT API URL
+        api_key: Key sent in the "x-api-key" header
+        max_in_flight: Most requests sent at once, and the size of the
+            connection pool. Defaults to 4.
+        requests_per_second: Most requests started per second to each host,
+            or None for no limit. Defaults to None.
+        max_retries: Retries after the first attempt. Defaults to 5.
+        backoff_factor: Retry n waits a random time up to
+            `backoff_factor * 2 ** n` seconds. Defaults to 0.5.
+        max_backoff: Longest wait between retries, in seconds. Defaults to 60.
+        timeout: Seconds until a request times out. Defaults to 600.
+        stream: Send request bodies with chunked encoding as they're encoded,
+            instead of building each body in memory first. Defaults to True.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        api_key: str,
+        max_in_flight: int = 4,
+        requests_per_second: Optional[float] = None,
+        max_retries: int = 5,
+        backoff_factor: float = 0.5,
+        max_backoff: float = 60.0,
+        timeout: float = 600.0,
+        stream: bool = True,
+    ):
+        self.url = url
+        self.api_key = api_key
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.stream = stream
+        self.host = urlsplit(url).netloc
+        self.calls: List[SratCall] = []
+        self.calls_by_key: Dict[Any, SratCall] = {}
+        self._rate_limiter = HostRateLimiter(
+            0.0 if not requests_per_second else 1.0 / requests_per_second
+        )
+        self._semaphore = None
+        self._session = None
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=self.max_in_flight, limit_per_host=self.max_in_flight
+            ),
+            headers={"x-api-key": self.api_key, "Content-Type": "application/json"},
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+        self._session = None
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Seconds to wait before a retry, with "full jitter"."""
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff_factor * 2**attempt)
+        )
+
+    async def post(self, data, key=None) -> Dict:
+        """Posts one request body, retrying failures, and returns its JSON.
+
+        Raises:
+            SratRequestError: If the request still fails after retrying.
+        """
+        call = SratCall(key=key, host=self.host)
+        self.calls.append(call)
+        self.calls_by_key[key] = call
+        queued = time.perf_counter()
+        async with self._semaphore:
+            call.queued_seconds = time.perf_counter() - queued
+            started = time.perf_counter()
+            try:
+                return await self._post_with_retries(data, call)
+            finally:
+                call.latency_seconds = time.perf_counter() - started
+
+    async def _post_with_retries(self, data, call: SratCall) -> Dict:
+        body = None if self.stream else json.dumps(data).encode()
+        while True:
+            call.attempts += 1
+            retry_after = None
+            await self._rate_limiter.wait(self.host)
+            try:
+                counter = [0]
+                async with self._session.post(
+                    self.url,
+                    data=_json_chunks(data, counter) if self.stream else body,
+                ) as response:
+                    call.status = response.status
+                    content = await response.read()
+                    call.request_bytes = counter[0] if self.stream else len(body)
+                    call.response_bytes = len(content)
+                    if response.status == 200:
+                        call.error = None
+                        try:
+                            return json.loads(content)
+                        except ValueError:
+                            raise SratRequestError(
+                                "SRAT Catchment API did not return JSON"
+                            )
+                    call.error = "SRAT Catchment API request failed: %s %s" % (
+                        response.status,
+                        content[:200].decode(errors="replace"),
+                    )
+                    if response.status not in RETRY_STATUSES:
+                        raise SratRequestError(call.error)
+                    retry_after = response.headers.get("Retry-After")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                call.error = "Request to SRAT Catchment API failed: %r" % e
+
+            if call.attempts > self.max_retries:
+                raise SratRequestError(
+                    "{} (after {} attempts)".format(call.error, call.attempts)
+                )
+            delay = self._backoff(call.attempts - 1, retry_after)
+            logging.info(
+                "Retrying SRAT request {} in {:.1f} s: {}".format(
+                    call.key, delay, call.error
+                )
+            )
+            await asyncio.sleep(delay)
+
+    async def post_all(
+        self, requests: Dict[Any, Any], return_exceptions: bool = False
+    ) -> Dict[Any, Dict]:
+        """Posts many request bodies concurrently.
+
+        Args:
+            requests: Request bodies by key, such as (super-HUC, run group)
+            return_exceptions: Return the exception of a failed request in
+                place of its result, instead of raising it. Defaults to False.
+
+        Returns:
+            The results by key, in the order of `requests`.
+        """
+        results = await asyncio.gather(
+            *[self.post(data, key=key) for key, data in requests.items()],
+            return_exceptions=return_exceptions,
+        )
+        return dict(zip(requests.keys(), results))
+
+    def calls_frame(self) -> pd.DataFrame:
+        """The recorded calls as a DataFrame, one row per call."""
+        return pd.DataFrame([asdict(call) for call in self.calls])
+
+
+def _format_job(job) -> list:
+    """Formats the request body of a job, dumping it when the job has a
+    `json_dump_path`.
+    """
+    file_stem = None
+    if job.json_dump_path is not None:
+        file_stem = job.json_dump_path + run_group_file_stem(*job.key)
+    return format_srat_input(
+        job.gwlfe_watershed_result,
+        job.with_attenuation,
+        job.with_concentration,
+        job.funding_source_group,
+        srat_input_dump_file=None if file_stem is None else file_stem + "_input.json",
+    )
+
+
+async def stream_jobs(
+    jobs: Iterable,
+    url: str,
+    api_key: str,
+    return_exceptions: bool = False,
+    queue_size: Optional[int] = None,
+    **client_kwargs,
+) -> AsyncIterator[Tuple[Any, Any, Optional[SratCall]]]:
+    """Posts `srat_pool.SratJob` jobs to the WikiSRAT API concurrently, and
+    yields their results as they complete.
+
+    Each job's request body is formatted when a slot is free to post it, so
+    at most `max_in_flight` bodies are in memory. Finished results wait in a
+    queue of `queue_size` for the caller; while it's full, no more requests
+    are posted.
+
+    Args:
+        jobs: The jobs to run
+        url: WikiSRAT API URL
+        api_key: Key sent in the "x-api-key" header
+        return_exceptions: Yield the exception of a failed job in place of
+            its result, instead of raising it. Defaults to False.
+        queue_size: Most finished results waiting for the caller. Defaults
+            to `max_in_flight`.
+        **client_kwargs: Passed to `AsyncSratClient`, such as
+            `max_in_flight` or `requests_per_second`
+
+    Yields:
+        (job, WikiSRAT result or exception, `SratCall`) tuples, in the order
+        the jobs complete. The call is None if the job failed before it was
+        posted.
+    """
+    async with AsyncSratClient(url, api_key, **client_kwargs) as client:
+        queue = asyncio.Queue(
+            maxsize=client.max_in_flight if queue_size is None else queue_size
+        )
+        pending = iter(jobs)
+        finished = object()
+
+        async def post_pending():
+            # the workers share the iterator, so each job is taken once
+            for job in pending:
+                try:
+                    result = await client.post(_format_job(job), key=job.key)
+                except Exception as e:
+                    result = e
+                await queue.put((job, result, client.calls_by_key.pop(job.key, None)))
+            await queue.put(finished)
+
+        workers = [
+            asyncio.create_task(post_pending()) for _ in range(client.max_in_flight)
+        ]
+        try:
+            running = len(workers)
+            while running > 0:
+                item = await queue.get()
+                if item is finished:
+                    running -= 1
+                    continue
+                if isinstance(item[1], Exception) and not return_exceptions:
+                    raise item[1]
+                yield item
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+
+def _frame_job(job, wikisrat_result, call: Optional[SratCall], return_exceptions: bool):
+    """Dumps and frames the result of a job, with the metrics of its call."""
+    metrics = {}
+    if call is not None:
+        metrics = {
+            "payload_bytes": call.request_bytes,
+            "response_bytes": call.response_bytes,
+            "retries": max(call.attempts - 1, 0),
+            "srat_seconds": call.latency_seconds,
+            "queued_seconds": call.queued_seconds,
+        }
+    if isinstance(wikisrat_result, Exception):
+        return job, wikisrat_result, metrics
+    try:
+        if job.json_dump_path is not None:
+            with open(
+                job.json_dump_path + run_group_file_stem(*job.key) + ".json", "w"
+            ) as fp:
+                json.dump(wikisrat_result, fp, indent=2)
+        with timer(metrics, "framing_seconds"):
+            job_results = frame_wikisrat_result(
+                wikisrat_result, job.huc8_id, job.run_group, job.funding_source_group
+            )
+        metrics["rows"] = count_rows(job_results)
+    except Exception as e:
+        if not return_exceptions:
+            raise
+        job_results = e
+    return job, job_results, metrics
+
+
+def run_remote_jobs(
+    jobs: Iterable,
+    url: str,
+    api_key: str,
+    return_exceptions: bool = False,
+    queue_size: Optional[int] = None,
+    **client_kwargs,
+) -> Iterator[Tuple[Any, Dict[str, list], Dict]]:
+    """Runs `srat_pool.SratJob` jobs on the remote WikiSRAT API.
+
+    Posts the jobs concurrently with `stream_jobs()`, and dumps and frames
+    each result as it completes, like `srat_pool.run_jobs()` but in the
+    order the jobs complete. The event loop runs between the results taken
+    from the iterator, so requests in flight wait while the caller works on
+    a result. This starts its own event loop, so in a notebook, iterate over
+    `stream_jobs()` with `async for` instead.
+
+    Args:
+        jobs: The jobs to run
+        url: WikiSRAT API URL
+        api_key: Key sent in the "x-api-key" header
+        return_exceptions: Yield the exception of a failed job in place of
+            its results, as `srat_pool.run_jobs()` does. Defaults to False.
+        queue_size: Passed to `stream_jobs()`
+        **client_kwargs: Passed to `AsyncSratClient`, such as
+            `max_in_flight` or `requests_per_second`
+
+    Yields:
+        (job, framed results, metrics) tuples, in the order the jobs
+        complete. The metrics are the 'payload_bytes', 'response_bytes',
+        'retries', 'srat_seconds' and 'queued_seconds' of the job's call, and
+        the 'framing_seconds' and 'rows' of its results.
+    """
+    loop = asyncio.new_event_loop()
+    results = stream_jobs(
+        jobs, url, api_key, return_exceptions, queue_size, **client_kwargs
+    )
+    try:
+        while True:
+            try:
+                job, wikisrat_result, call = loop.run_until_complete(
+                    results.__anext__()
+                )
+            except StopAsyncIteration:
+                break
+            yield _frame_job(job, wikisrat_result, call, return_exceptions)
+            del wikisrat_result
+    finally:
+        loop.run_until_complete(results.aclose())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
@@ -0,0 +1,722 @@
+"""
+An in-process stand-in for the SRAT model, to run SRAT scenarios without the
+SRAT `DatabaseAdapter` and Postgres database.
+
+`SratEngine.run()` takes the request body from
+`srat_formatting.format_srat_input()` and returns a result in the shape of a
+WikiSRAT response, so it can be framed with
+`srat_formatting.frame_wikisrat_result()`. For every HUC12 in the request it:
+
+1. allocates the GWLF-E load of each source to the NHDPlus catchments of the
+   HUC12, by the share of the source in each catchment;
+2. subtracts the load reductions of the restoration BMPs, and adds the
+   avoided loads of the protected lands, of the request's
+   `restoration_sources` to the total local load of each catchment; and
+3. routes the total and point source loads down the reaches of the request
+   with `pollution_assessment.calc.accumulate_loads()`, attenuating them in
+   each reach, and divides them by the mean annual flow for the reach
+   concentrations.
+
+Only the reaches of the HUC12s in a request are routed, like SRAT does, so
+super-HUCs should be sent whole.
+
+The reach table has a row per catchment, with:
+
+    comid: NHDPlus COMID
+    huc12: HUC12 of the catchment
+    from_comids: COMIDs of the reaches flowing into the catchment's reach,
+        or instead
+    nord, nordstop: NHDPlus nested-set order of the reach, and the largest
+        order upstream of it
+    maflowv: Mean annual flow of the reach (cfs)
+    share_<source>: Share of the HUC12 load of a source (a value of
+        `srat_formatting.SRAT_KEYS`, e.g. "share_crop") in the catchment.
+        `SratEngine.run()` raises a ValueError for a HUC12 with a load of a
+        source that has no shares in its catchments.
+    tp_attenuation, tn_attenuation, tss_attenuation: Optional fraction of the
+        load lost in the reach. Missing columns or values are no attenuation.
+
+`reach_table_from_results()` builds it from the NHDPlus reaches and the
+baseline results of a run on the SRAT database.
+
+The reduction table has the 'comid', 'source', 'tp_reduced_kg',
+'tn_reduced_kg' and 'tss_reduced_kg' of the restoration BMPs, and
+'tp_avoided_kg', 'tn_avoided_kg' and 'tss_avoided_kg' of the protected lands,
+in each catchment, as in the SRAT database tables read by
+`read_reduction_table()`. A row has either reduced or avoided loads; the
+others are 0. Avoided loads are the loads the protected lands would add if
+they were developed, so SRAT adds them to the catchment load: protection run
+groups have higher loads than the baseline, and restoration run groups lower.
+
+`compare_results()` and `validate_dumps()` compare the engine with saved SRAT
+results, such as the JSON dumps of `srat_pool.run_job()`, and
+`validate_dump()` with the dump of one super-HUC and run group.
+`validate_results()` routes the catchment loads of saved SRAT results through
+the engine's reaches and compares the reach concentrations, and
+`check_comparison()` raises an error if any of these are off.
+"""
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from pollution_assessment import calc, storage
+from srat_formatting import (
+    NUTRIENT_NAMES,
+    RENAMED_KEYS,
+    SRAT_KEYS,
+    flatten_wikisrat_result,
+    run_group_file_stem,
+)
+
+PathLike = Union[str, Path]
+
+NUTRIENTS = ["tp", "tn", "tss"]
+# the columns of each nutrient in framed SRAT results
+NUTRIENT_COLUMNS = [NUTRIENT_NAMES[n] for n in NUTRIENTS]
+
+# the sources of GWLF-E loads in a request, from `format_for_srat()`
+LOAD_SOURCES = [
+    source
+    for source in SRAT_KEYS.values()
+    if source not in ["total", "conc", "conc_ptsource"]
+]
+
+# kg/yr / (cfs * CFS_TO_LITERS_PER_YEAR) * 1e6 = mg/L
+CFS_TO_LITERS_PER_YEAR = 0.028316846592 * 1000 * 365.25 * 86400
+
+REDUCED_COLUMNS = ["{}_reduced_kg".format(n) for n in NUTRIENTS]
+AVOIDED_COLUMNS = ["{}_avoided_kg".format(n) for n in NUTRIENTS]
+
+REDUCTION_QUERY = """
+select comid_rest as comid, source,
+    tp_reduced_kg, tn_reduced_kg, tss_reduced_kg,
+    0 as tp_avoided_kg, 0 as tn_avoided_kg, 0 as tss_avoided_kg
+from datapolassess.fd_api_restoration_lbsreduced_comid
+union all
+select comid_prot as comid, source,
+    0 as tp_reduced_kg, 0 as tn_reduced_kg, 0 as tss_reduced_kg,
+    tp_avoided_kg, tn_avoided_kg, tss_avoided_kg
+from datapolassess.fd_api_protection_lbsavoided_comid
+"""
+
+
+def read_reduction_table(pg_config: Dict) -> pd.DataFrame:
+    """Reads the BMP load reductions and protected land avoided loads of
+    each catchment and source from the SRAT database, to save for offline
+    runs.
+
+    Args:
+        pg_config: The 'PG_CONFIG' of the local SRAT `db_config.json`
+    """
+    import psycopg2
+
+    connection = psycopg2.connect(
+        host=pg_config["host"],
+        database=pg_config["database"],
+        user=pg_config["user"],
+        password=pg_config["password"],
+        port=pg_config["port"],
+    )
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(REDUCTION_QUERY)
+            rows = cursor.fetchall()
+    finally:
+        connection.close()
+    reductions = pd.DataFrame(
+        rows, columns=["comid", "source"] + REDUCED_COLUMNS + AVOIDED_COLUMNS
+    )
+    return reductions.astype(
+        {column: float for column in REDUCED_COLUMNS + AVOIDED_COLUMNS}
+    )
+
+
+def _network_matrix(reaches: pd.DataFrame):
+    """Adjacency matrix of reaches with 'from_comids', or 'nord' and
+    'nordstop'.
+    """
+    if "from_comids" in reaches.columns:
+        return calc.inlet_matrix(reaches, "from_comids")
+    return calc.nested_set_matrix(reaches)
+
+
+def _source_values(
+    frame: pd.DataFrame, source: str, comids: Optional[pd.Index] = None
+) -> pd.DataFrame:
+    """Nutrient values of one 'Source' of framed SRAT results by COMID (the
+    last row of a COMID), reindexed to some COMIDs.
+    """
+    values = (
+        frame.loc[frame["Source"] == source]
+        .drop_duplicates("comid", keep="last")
+        .set_index("comid")[NUTRIENT_COLUMNS]
+        .astype(np.float64)
+    )
+    if comids is None:
+        return values
+    return values.reindex(comids)
+
+
+def reach_table_from_results(
+    reaches: pd.DataFrame,
+    total_local_load: pd.DataFrame,
+    reach_concentrations: pd.DataFrame,
+    sources_local_load: Optional[pd.DataFrame] = None,
+    reach_average_flow: Optional[pd.DataFrame] = None,
+    group_column: str = "super_huc",
+) -> pd.DataFrame:
+    """Builds the reach table of `SratEngine` from the NHDPlus reaches and
+    the framed baseline results of a run on the SRAT database, e.g. from
+    `srat_output.read_results()`.
+
+    The share of a source in a catchment is its load in the catchment over
+    its load in the HUC12, averaged over the nutrients. The attenuation of a
+    reach is the part of its local load and the loads of its inlets that
+    doesn't leave the reach, clipped to [0, 1], with the reaches of each
+    group of results (e.g. super-HUC) connected as SRAT routed them. Reaches
+    without a SRAT concentration have no 'maflowv', so the engine gives them
+    none.
+
+    Args:
+        reaches: NHDPlus reaches indexed by COMID, with 'huc12', 'maflowv',
+            and 'from_comids' or 'nord' and 'nordstop', such as
+            `geography/reach_gdf.parquet`
+        total_local_load: The 'catchment_total_local_load' results
+        reach_concentrations: The 'reach_concentrations' results
+        sources_local_load: The 'catchment_sources_local_load' results, for
+            the shares of each source. Defaults to None, for no shares.
+        reach_average_flow: The 'reach_average_flow' results, for the flows
+            SRAT used instead of the 'maflowv' of `reaches`. Defaults to None.
+        group_column: Column of the results with the group each was run in.
+            Defaults to "super_huc".
+
+    Returns:
+        The reach table, with the reaches in the results.
+    """
+    network_columns = (
+        ["from_comids"] if "from_comids" in reaches.columns else ["nord", "nordstop"]
+    )
+    loads = total_local_load.loc[total_local_load["Source"] == "Total Local Load"]
+    table = reaches.loc[
+        ~reaches.index.duplicated() & reaches.index.isin(loads["comid"]),
+        ["huc12", "maflowv"] + network_columns,
+    ].copy()
+    table.index.name = "comid"
+    if reach_average_flow is not None:
+        flows = reach_average_flow.drop_duplicates("comid", keep="last").set_index(
+            "comid"
+        )["Value"]
+        table["maflowv"] = flows.reindex(table.index).astype(np.float64)
+
+    if sources_local_load is not None:
+        source_keys = {
+            name: key for name, key in SRAT_KEYS.items() if key in LOAD_SOURCES
+        }
+        sources = sources_local_load.loc[
+            sources_local_load["Source"].isin(source_keys)
+        ].drop_duplicates(["comid", "Source"], keep="last")
+        sources = sources.assign(Source=sources["Source"].astype(str))
+        values = sources[NUTRIENT_COLUMNS].astype(np.float64)
+        huc_sums = values.groupby([sources["huc"], sources["Source"]]).transform("sum")
+        shares = (
+            sources.assign(share=(values / huc_sums.where(huc_sums > 0)).mean(axis=1))
+            .pivot(index="comid", columns="Source", values="share")
+            .rename(columns=lambda name: "share_" + source_keys[name])
+        )
+        table = table.join(shares)
+
+    # SRAT has no concentrations for some reaches with flow, so they're left
+    # without flow, to give none either
+    routed = reach_concentrations.loc[
+        (reach_concentrations["Source"] == "Reach Concentration")
+        & reach_concentrations[NUTRIENT_COLUMNS].notna().any(axis=1),
+        "comid",
+    ]
+    table.loc[~table.index.isin(routed), "maflowv"] = np.nan
+
+    attenuation = []
+    concentrations = dict(tuple(reach_concentrations.groupby(group_column)))
+    for group, group_loads in loads.groupby(group_column, sort=False):
+        group_reaches = table.loc[table.index.isin(group_loads["comid"])]
+        if group not in concentrations or len(group_reaches) == 0:
+            continue
+        local = _source_values(group_loads, "Total Local Load", group_reaches.index)
+        outflow = (
+            _source_values(
+                concentrations[group], "Reach Concentration", group_reaches.index
+            ).to_numpy()
+            * group_reaches[["maflowv"]].to_numpy(dtype=np.float64)
+            * CFS_TO_LITERS_PER_YEAR
+            / 1e6
+        )
+        inflow = _network_matrix(group_reaches) @ np.nan_to_num(outflow)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            lost = 1 - outflow / (local.fillna(0).to_numpy() + inflow)
+        attenuation.append(
+            pd.DataFrame(
+                np.clip(lost, 0, 1),
+                index=group_reaches.index,
+                columns=["{}_attenuation".format(n) for n in NUTRIENTS],
+            )
+        )
+    if len(attenuation) > 0:
+        attenuation = pd.concat(attenuation)
+        table = table.join(attenuation.loc[~attenuation.index.duplicated(keep="last")])
+    return table.reset_index()
+
+
+class SratEngine:
+    """Runs SRAT requests with NumPy, from a reach table and a table of BMP
+    reductions (see the module docstring for their columns).
+
+    Args:
+        reaches: The reach table
+        reductions: The reduction table. Defaults to None, for no BMPs.
+        with_attenuation: Attenuate loads in each reach. Defaults to True.
+    """
+
+    def __init__(
+        self,
+        reaches: pd.DataFrame,
+        reductions: Optional[pd.DataFrame] = None,
+        with_attenuation: bool = True,
+    ):
+        reaches = reaches.sort_values(["huc12", "comid"], kind="stable")
+        self.reaches = reaches.set_index("comid")
+        self.with_attenuation = with_attenuation
+
+        if "from_comids" not in self.reaches.columns and not {
+            "nord",
+            "nordstop",
+        }.issubset(self.reaches.columns):
+            raise ValueError(
+                "The reach table needs 'from_comids', or 'nord' and 'nordstop'"
+            )
+
+        # share of the load of each source in each catchment; the shares of
+        # sources without a column are NaN, so `run()` stops on their loads
+        # instead of guessing where they go
+        self.shares = np.column_stack(
+            [
+                self.reaches["share_" + source].fillna(0).to_numpy(dtype=np.float64)
+                if "share_" + source in self.reaches.columns
+                else np.full(len(self.reaches), np.nan)
+                for source in LOAD_SOURCES
+            ]
+        )
+
+        attenuation_columns = ["{}_attenuation".format(n) for n in NUTRIENTS]
+        self.attenuation = (
+            self.reaches.reindex(columns=attenuation_columns)
+            .fillna(0)
+            .to_numpy(dtype=np.float64)
+        )
+
+        if reductions is None:
+            reductions = pd.DataFrame(
+                columns=["comid", "source"] + REDUCED_COLUMNS + AVOIDED_COLUMNS
+            )
+        missing = [
+            column
+            for column in REDUCED_COLUMNS + AVOIDED_COLUMNS
+            if column not in reductions.columns
+        ]
+        if len(missing) > 0:
+            # tables saved before the avoided loads were kept apart have the
+            # avoided loads of protected lands as reductions
+            raise ValueError(
+                "The reduction table has no {} columns; read it again with "
+                "read_reduction_table()".format(", ".join(missing))
+            )
+        self.reductions = reductions
+
+    @classmethod
+    def from_files(
+        cls,
+        reaches_path: PathLike,
+        reductions_path: Optional[PathLike] = None,
+        with_attenuation: bool = True,
+    ) -> "SratEngine":
+        """Creates an engine from Parquet files of the reach and reduction
+        tables, reading 'from_comids' with `storage.read_parquet()`.
+        """
+        reaches = storage.read_parquet(reaches_path)
+        if "comid" not in reaches.columns:
+            reaches = reaches.reset_index()
+        reductions = None if reductions_path is None else pd.read_parquet(reductions_path)
+        return cls(reaches, reductions, with_attenuation)
+
+    def _load_change(self, comids: pd.Index, restoration_sources: List[str]) -> np.ndarray:
+        """Change in the load of each catchment from some restoration
+        sources: the avoided loads less the reduced loads.
+        """
+        if len(restoration_sources) == 0 or len(self.reductions) == 0:
+            return np.zeros((len(comids), len(NUTRIENTS)))
+        reductions = self.reductions.loc[
+            self.reductions["source"].isin(restoration_sources)
+        ]
+        sums = (
+            reductions.groupby("comid")[REDUCED_COLUMNS + AVOIDED_COLUMNS]
+            .sum()
+            .reindex(comids, fill_value=0)
+            .fillna(0)
+        )
+        return sums[AVOIDED_COLUMNS].to_numpy(dtype=np.float64) - sums[
+            REDUCED_COLUMNS
+        ].to_numpy(dtype=np.float64)
+
+    def _check_shares(
+        self,
+        request_hucs: pd.Index,
+        huc_codes: np.ndarray,
+        huc_loads: np.ndarray,
+        shares: np.ndarray,
+    ):
+        """Raises a ValueError if a HUC12 of a request has a load of a source
+        without shares in any of its catchments, as the load would be lost.
+        """
+        share_sums = np.zeros((len(request_hucs), len(LOAD_SOURCES)))
+        np.add.at(share_sums, huc_codes, shares)
+        missing = (huc_loads != 0).any(axis=1) & ~(share_sums > 0)
+        if not missing.any():
+            return
+        hucs, sources = np.nonzero(missing)
+        raise ValueError(
+            "The reach table has no catchment shares for {} HUC12 loads, such as "
+            "{}; export it again with reach_table_from_results()".format(
+                len(hucs),
+                ", ".join(
+                    "{} of {}".format(LOAD_SOURCES[source], request_hucs[huc])
+                    for huc, source in list(zip(hucs, sources))[:5]
+                ),
+            )
+        )
+
+    def route(self, comids: pd.Index, loads: np.ndarray) -> np.ndarray:
+        """Routes the local loads of some catchments down their reaches,
+        attenuating them in each reach, and divides them by the mean annual
+        flow for the reach concentrations.
+
+        Only the reaches of `comids` are connected, so they should be whole
+        networks, such as the reaches of a super-HUC.
+
+        Args:
+            comids: COMIDs of the catchments
+            loads: Local loads (kg/yr) of each catchment, with a column per
+                nutrient of `NUTRIENTS`, repeated for each kind of load (e.g.
+                the total and point source loads)
+
+        Returns:
+            The concentrations (mg/L) in the shape of `loads`, NaN for reaches
+            without flow.
+
+        Raises:
+            ValueError: If a COMID isn't in the reach table
+        """
+        positions = self.reaches.index.get_indexer(comids)
+        if (positions < 0).any():
+            raise ValueError(
+                "{} COMIDs aren't in the reach table".format((positions < 0).sum())
+            )
+        reaches = self.reaches.iloc[positions]
+        routed_vars = ["load_{}".format(i) for i in range(loads.shape[1])]
+        network = pd.DataFrame(loads, index=reaches.index, columns=routed_vars)
+        attenuation = None
+        if self.with_attenuation:
+            attenuation = pd.DataFrame(
+                np.tile(self.attenuation[positions], loads.shape[1] // len(NUTRIENTS)),
+                index=reaches.index,
+                columns=routed_vars,
+            )
+        cumulative = calc.accumulate_loads(
+            network, None, routed_vars, attenuation, _network_matrix(reaches)
+        ).to_numpy()
+        liters = reaches["maflowv"].to_numpy(dtype=np.float64) * CFS_TO_LITERS_PER_YEAR
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(
+                liters[:, np.newaxis] > 0, cumulative * 1e6 / liters[:, np.newaxis], np.nan
+            )
+
+    def run(self, data: List[Dict]) -> Dict:
+        """Runs a SRAT request.
+
+        Args:
+            data: The request body, from `format_srat_input()`
+
+        Returns:
+            A result like a WikiSRAT response, with the catchments of each
+            HUC12 in the request.
+
+        Raises:
+            ValueError: If a HUC12 has a load of a source without shares in
+                its catchments
+        """
+        request_hucs = pd.Index([row["huc12"] for row in data])
+        positions = np.flatnonzero(self.reaches["huc12"].isin(request_hucs).to_numpy())
+        reaches = self.reaches.iloc[positions]
+        shares = self.shares[positions]
+        huc_codes = request_hucs.get_indexer(reaches["huc12"])
+
+        # loads of each HUC12 by nutrient and source (huc x nutrient x source)
+        huc_loads = np.array(
+            [
+                [
+                    [row.get("{}load_{}".format(n, source), 0) or 0 for source in LOAD_SOURCES]
+                    for n in NUTRIENTS
+                ]
+                for row in data
+            ],
+            dtype=np.float64,
+        ).reshape(len(data), len(NUTRIENTS), len(LOAD_SOURCES))
+        self._check_shares(request_hucs, huc_codes, huc_loads, shares)
+        local = huc_loads[huc_codes] * shares[:, np.newaxis, :]
+        total = local.sum(axis=2)
+        point_source = local[:, :, LOAD_SOURCES.index("pointsource")]
+
+        restoration_sources = sorted(
+            {source for row in data for source in row.get("restoration_sources", [])}
+        )
+        total = np.clip(
+            total + self._load_change(reaches.index, restoration_sources), 0, None
+        )
+        concentration = self.route(reaches.index, np.hstack([total, point_source]))
+
+        keys = (
+            [
+                "{}load_{}".format(n, source)
+                for n in NUTRIENTS
+                for source in LOAD_SOURCES
+            ]
+            + ["{}loadrate_total".format(n) for n in NUTRIENTS]
+            + ["{}loadrate_conc".format(n) for n in NUTRIENTS]
+            + ["{}_conc_ptsource".format(n) for n in NUTRIENTS]
+            + ["maflowv"]
+        )
+        values = np.hstack(
+            [
+                local.reshape(len(reaches), -1),
+                total,
+                concentration[:, : len(NUTRIENTS)],
+                concentration[:, len(NUTRIENTS) :],
+                reaches[["maflowv"]].to_numpy(dtype=np.float64),
+            ]
+        )
+        # only the loads of the sources in the request, as SRAT returns them
+        requested = set(key for row in data for key in row)
+        kept = [
+            i
+            for i, key in enumerate(keys)
+            if "load_" not in key or key in requested
+        ]
+        keys = [keys[i] for i in kept]
+        values = values[:, kept]
+
+        result = {"huc12s": {huc12: {"catchments": {}} for huc12 in request_hucs}}
+        for comid, huc12, row in zip(
+            reaches.index.tolist(), reaches["huc12"].tolist(), values.tolist()
+        ):
+            catchment = {"comid": comid}
+            catchment.update(
+                (key, None if np.isnan(value) else value) for key, value in zip(keys, row)
+            )
+            result["huc12s"][huc12]["catchments"][str(comid)] = catchment
+        return result
+
+
+def compare_results(
+    engine_result: Dict, srat_result: Dict, id_key: str = "comid"
+) -> pd.DataFrame:
+    """Compares an engine result with a SRAT result for the same request.
+
+    The keys of the SRAT result are renamed with
+    `srat_formatting.RENAMED_KEYS`, as they are when framing it.
+
+    Returns:
+        A DataFrame with a row per result key, with the number of values in
+        both results ('n'), in only one ('only_engine', 'only_srat'), and the
+        largest absolute and relative differences.
+    """
+    long_tables = []
+    for name, result in [("engine", engine_result), ("srat", srat_result)]:
+        catchments, long, vocabulary = flatten_wikisrat_result(result, id_key)
+        keys = vocabulary["key"].replace(RENAMED_KEYS).to_numpy()[long["key"]]
+        long_tables.append(
+            pd.DataFrame(
+                {
+                    "comid": catchments["comid"].to_numpy()[long["catchment"]],
+                    "key": keys,
+                    name: pd.to_numeric(long["Value"], errors="coerce").to_numpy(),
+                }
+            ).loc[lambda df: df["key"] != id_key]
+        )
+    return _summarize_differences(long_tables[0], long_tables[1])
+
+
+def _summarize_differences(engine: pd.DataFrame, srat: pd.DataFrame) -> pd.DataFrame:
+    """Compares long tables of engine and SRAT values, with 'comid', 'key'
+    and an 'engine' or 'srat' column, by key.
+    """
+    both = engine.merge(srat, on=["comid", "key"], how="outer")
+    both["abs_diff"] = (both["engine"] - both["srat"]).abs()
+    both["rel_diff"] = both["abs_diff"] / both["srat"].abs().where(both["srat"] != 0)
+    return both.groupby("key").agg(
+        n=("abs_diff", "count"),
+        only_engine=("srat", lambda s: s.isna().sum()),
+        only_srat=("engine", lambda s: s.isna().sum()),
+        max_abs_diff=("abs_diff", "max"),
+        max_rel_diff=("rel_diff", "max"),
+        median_rel_diff=("rel_diff", "median"),
+    )
+
+
+def _compare_dump(engine: SratEngine, input_file: Path, result_file: Path) -> pd.DataFrame:
+    """Runs the engine on a saved SRAT request and compares it with the saved
+    result, with a 'dump' column with the stem of the result file.
+    """
+    with open(input_file) as fp:
+        data = json.load(fp)
+    with open(result_file) as fp:
+        srat_result = json.load(fp)
+    comparison = compare_results(engine.run(data), srat_result).reset_index()
+    comparison.insert(0, "dump", result_file.stem)
+    return comparison
+
+
+def validate_dump(
+    engine: SratEngine, json_dump_path: PathLike, huc8_id: str, run_group: str
+) -> pd.DataFrame:
+    """Runs the engine on the saved SRAT request of a super-HUC and run group
+    in a directory of JSON dumps from `srat_pool.run_job()`, and compares it
+    with the saved WikiSRAT result.
+
+    Run it for a protection run group as well as a restoration run group, as
+    they change the loads in opposite directions.
+
+    Returns:
+        The table of `compare_results()`, with a 'dump' column.
+
+    Raises:
+        FileNotFoundError: If the request or the result isn't in the dumps
+    """
+    file_stem = Path(json_dump_path) / run_group_file_stem(huc8_id, run_group)
+    input_file = file_stem.with_name(file_stem.name + "_input.json")
+    result_file = file_stem.with_name(file_stem.name + ".json")
+    for path in [input_file, result_file]:
+        if not path.is_file():
+            raise FileNotFoundError("No SRAT dump {}".format(path))
+    return _compare_dump(engine, input_file, result_file)
+
+
+def validate_dumps(engine: SratEngine, json_dump_path: PathLike) -> pd.DataFrame:
+    """Runs the engine on every saved SRAT request in a directory of JSON
+    dumps from `srat_pool.run_job()` (`<stem>_input.json` with the result in
+    `<stem>.json`), and compares the results.
+
+    Returns:
+        The tables of `compare_results()` of every dump, with a 'dump'
+        column with the stem of the files.
+    """
+    comparisons = []
+    for input_file in sorted(Path(json_dump_path).glob("*_input.json")):
+        result_file = input_file.with_name(
+            input_file.name[: -len("_input.json")] + ".json"
+        )
+        if not result_file.is_file():
+            continue
+        comparisons.append(_compare_dump(engine, input_file, result_file))
+    if len(comparisons) == 0:
+        return pd.DataFrame()
+    return pd.concat(comparisons, ignore_index=True)
+
+
+def _long_values(comids: pd.Index, values: np.ndarray, key: str, name: str) -> pd.DataFrame:
+    """Long table of nutrient values by COMID, with keys like `key` formatted
+    with each of `NUTRIENTS`, without missing values.
+    """
+    return pd.DataFrame(
+        {
+            "comid": np.repeat(comids.to_numpy(), len(NUTRIENTS)),
+            "key": np.tile([key.format(n) for n in NUTRIENTS], len(comids)),
+            name: values.ravel(),
+        }
+    ).dropna(subset=[name])
+
+
+def validate_results(
+    engine: SratEngine,
+    total_local_load: pd.DataFrame,
+    reach_concentrations: pd.DataFrame,
+    group_column: str = "super_huc",
+) -> pd.DataFrame:
+    """Routes the catchment loads of saved SRAT results through the reaches
+    of the engine, in each group of results (e.g. super-HUC), and compares
+    the reach concentrations with SRAT's.
+
+    It checks the routing and attenuation of the reach table on the framed
+    results of any run group, e.g. from `srat_output.read_results()`, without
+    the JSON dumps. Point source concentrations are compared when the loads
+    have 'Point Sources' rows and the concentrations 'Point Source Derived
+    Concentration' rows.
+
+    Returns:
+        The table of `compare_results()`, by the keys of the concentrations
+        (e.g. "tploadrate_conc" and "tp_conc_ptsource").
+    """
+    kinds = [
+        ("Total Local Load", "Reach Concentration", "{}loadrate_conc"),
+        ("Point Sources", "Point Source Derived Concentration", "{}_conc_ptsource"),
+    ]
+    engine_tables, srat_tables = [], []
+    concentrations = dict(tuple(reach_concentrations.groupby(group_column)))
+    for group, group_loads in total_local_load.groupby(group_column, sort=False):
+        group_concentrations = concentrations.get(group)
+        if group_concentrations is None:
+            continue
+        comids = pd.Index(group_loads["comid"].unique())
+        comids = comids[comids.isin(engine.reaches.index)]
+        for load_source, concentration_source, key in kinds:
+            srat = _source_values(group_concentrations, concentration_source)
+            if len(srat) == 0 or not (group_loads["Source"] == load_source).any():
+                continue
+            loads = _source_values(group_loads, load_source, comids).fillna(0)
+            engine_tables.append(
+                _long_values(comids, engine.route(comids, loads.to_numpy()), key, "engine")
+            )
+            srat_tables.append(_long_values(srat.index, srat.to_numpy(), key, "srat"))
+    if len(engine_tables) == 0:
+        return _summarize_differences(
+            pd.DataFrame(columns=["comid", "key", "engine"]),
+            pd.DataFrame(columns=["comid", "key", "srat"]),
+        )
+    return _summarize_differences(
+        pd.concat(engine_tables, ignore_index=True),
+        pd.concat(srat_tables, ignore_index=True),
+    )
+
+
+def check_comparison(comparison: pd.DataFrame, tolerance: float, label: str):
+    """Raises a ValueError if a comparison of the engine with SRAT has values
+    in only one of the results, or relative differences over a tolerance.
+
+    Args:
+        comparison: A table of `compare_results()`, `validate_dump()` or
+            `validate_results()`
+        tolerance: The largest relative difference allowed
+        label: What was compared, for the error message
+    """
+    if "key" not in comparison.columns:
+        comparison = comparison.reset_index()
+    off = comparison.loc[
+        (comparison["max_rel_diff"] > tolerance)
+        | (comparison["only_engine"] > 0)
+        | (comparison["only_srat"] > 0)
+    ]
+    if len(off) > 0:
+        raise ValueError(
+            "The SRAT engine differs from WikiSRAT for {} in {}".format(
+                label, ", ".join(off["key"].unique())
+            )
+        )
@@ -0,0 +1,307 @@
+"""
+Functions to format GWLF-E results for WikiSRAT, and to frame the WikiSRAT
+results, shared by `run_srat_with_bmps.py` and its worker processes.
+
+Nothing here reads secrets or connects to a database, so it's safe to import
+from a process pool.
+"""
+import json
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+# taken from https://github.com/WikiWatershed/model-my-watershed/blob/f9591f390c4f54751bf34019f3cc126f45892ca6/src/mmw/mmw/settings/gwlfe_settings.py#L623-L639
+SRAT_KEYS = {
+    "Hay/Pasture": "hp",
+    "Cropland": "crop",
+    "Wooded Areas": "wooded",
+    "Open Land": "open",
+    "Barren Areas": "barren",
+    "Low-Density Mixed": "ldm",
+    "Medium-Density Mixed": "mdm",
+    "High-Density Mixed": "hdm",
+    "Low-Density Open Space": "tiledrain",
+    "Farm Animals": "farman",
+    "Stream Bank Erosion": "streambank",
+    "Subsurface Flow": "subsurface",
+    "Wetlands": "wetland",
+    "Point Sources": "pointsource",
+    "Septic Systems": "septics",
+    "Total Local Load": "total",
+    "Reach Concentration": "conc",
+    "Point Source Derived Concentration": "conc_ptsource",
+}
+
+RESULT_KEYS = [
+    "catchment_total_local_load",
+    "reach_concentrations",
+    "reach_average_flow",
+    "reach_pt_source_conc",
+    # NOTE:  Individual land use sources are NOT valid when applying restorations, only the totals
+    "catchment_sources_local_load",
+]
+
+BASELINE_RUN_GROUP = "No restoration or protection"
+
+
+# taken from https://github.com/WikiWatershed/model-my-watershed/blob/31566fefbb91055c96a32a6279dac5598ba7fc10/src/mmw/apps/modeling/tasks.py#L72-L96
+def format_for_srat(
+    huc12_id, model_output, with_attenuation, with_concentration, restoration_sources
+):
+    formatted = {
+        "huc12": huc12_id,
+        # Tile Drain may be calculated by future versions of
+        # Mapshed. The SRAT API requires a placeholder
+        "tpload_tiledrain": 0,
+        "tnload_tiledrain": 0,
+        "tssload_tiledrain": 0,
+    }
+
+    if restoration_sources != []:
+        formatted["restoration_sources"] = restoration_sources
+        # NOTE: sending a with_attenuation argument without a restoration source causes a failure
+        # formatted["with_attenuation"] = with_attenuation
+        # NOTE: sending a with_concentration argument without a restoration source causes a failure
+        formatted["with_concentration"] = with_concentration
+
+    for load in model_output["Loads"]:
+        source_key = SRAT_KEYS.get(load["Source"], None)
+
+        if source_key is None:
+            continue
+
+        formatted["tpload_" + source_key] = load["TotalP"]
+        formatted["tnload_" + source_key] = load["TotalN"]
+
+        if source_key not in ["farman", "subsurface", "septics", "pointsource"]:
+            formatted["tssload_" + source_key] = load["Sediment"]
+
+    return formatted
+
+
+def format_srat_input(
+    gwlfe_watershed_result,
+    with_attenuation,
+    with_concentration,
+    restoration_sources,
+    srat_input_dump_file=None,
+):
+    """Formats the GWLF-E results of every HUC12 as the SRAT request body,
+    optionally dumping it to a JSON file.
+    """
+    try:
+        data = [
+            format_for_srat(
+                id, w, with_attenuation, with_concentration, restoration_sources
+            )
+            for id, w in gwlfe_watershed_result.items()
+        ]
+        if srat_input_dump_file is not None:
+            with open(
+                srat_input_dump_file,
+                "w",
+            ) as fp:
+                json.dump(data, fp, indent=2)
+
+    except Exception as e:
+        raise Exception("Formatting sub-basin GWLF-E results failed: %s" % e)
+
+    return data
+
+
+def run_group_file_stem(huc8_id: str, run_group: str) -> str:
+    """Stem of the JSON dump file names for a super-HUC and run group."""
+    return "HUC8_{}_{}".format(huc8_id, run_group.lower().replace(" ", "_"))
+
+
+# temporary change until Lin updates database
+RENAMED_KEYS = {
+    "tpconc_Crop": "maflowv",
+    "tpconc_hp": "tn_conc_ptsource",
+    "tnconc_hp": "tp_conc_ptsource",
+    "tssconc_hp": "tss_conc_ptsource",
+}
+
+NUTRIENT_NAMES = {
+    "tpload": "TotalP",
+    "tnload": "TotalN",
+    "tssload": "Sediment",
+    "tploadrate": "TotalP",
+    "tnloadrate": "TotalN",
+    "tssloadrate": "Sediment",
+    "tp": "TotalP",
+    "tn": "TotalN",
+    "tss": "Sediment",
+}
+
+# frames from each group of WikiSRAT result keys
+RESULT_GROUPS = {
+    "catchment_total_local_load": "total_local_load",
+    "reach_concentrations": "reach_conc",
+    "reach_average_flow": "maflowv",
+    "reach_pt_source_conc": "conc_ptsource",
+    "catchment_sources_local_load": "local_loads_by_source",
+}
+
+
+def key_vocabulary(keys, id_key: str = "comid") -> pd.DataFrame:
+    """Splits WikiSRAT result keys (e.g. 'tploadrate_total') into their
+    nutrient and source, and the result groups they belong to.
+
+    Args:
+        keys: The unique keys of the catchment results
+        id_key: The key with the catchment ID. Defaults to "comid".
+
+    Returns:
+        A DataFrame with a row per key, with the 'Nutrient' and 'Source'
+        names, and a boolean column for each group in `RESULT_GROUPS`.
+    """
+    keys = pd.Series(list(keys), dtype=object)
+    names = keys.replace(RENAMED_KEYS)
+    split = names.str.split("_", n=1, expand=True).reindex(columns=[0, 1])
+
+    vocabulary = pd.DataFrame(
+        {
+            "key": keys,
+            "Nutrient": split[0].replace(NUTRIENT_NAMES),
+            "Source": split[1].replace(list(SRAT_KEYS.values()), list(SRAT_KEYS.keys())),
+        }
+    )
+    is_id = keys == id_key
+    maflowv = names == "maflowv"
+    conc_ptsource = names.str.contains("conc_ptsource")
+    reach_conc = names.str.contains("loadrate_conc")
+    total_local_load = names.str.contains("loadrate_total")
+    vocabulary["maflowv"] = maflowv
+    vocabulary["conc_ptsource"] = conc_ptsource
+    vocabulary["reach_conc"] = reach_conc
+    vocabulary["total_local_load"] = total_local_load
+    vocabulary["local_loads_by_source"] = (
+        ~is_id
+        & ~maflowv
+        & ~(conc_ptsource & ~reach_conc & ~total_local_load)
+    )
+    return vocabulary
+
+
+def flatten_wikisrat_result(
+    wikisrat_result: Dict, id_key: str = "comid"
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Flattens every catchment of a WikiSRAT response into one long table.
+
+    Only the keys and values of each catchment are collected in Python; the
+    keys are factorized, and their nutrient, source and groups are looked up
+    from the vocabulary of unique keys.
+
+    Returns:
+        A tuple of the catchments, with their 'comid' and 'huc' in response
+        order; the long table, with the position of the catchment
+        ('catchment'), the 'key' code and the 'Value'; and the vocabulary of
+        keys from `key_vocabulary()`, in the order of their codes.
+    """
+    comids, hucs, lengths, keys, values = [], [], [], [], []
+    for huc12, huc12_wikisrat in wikisrat_result["huc12s"].items():
+        for catch_sources in huc12_wikisrat["catchments"].values():
+            comids.append(catch_sources[id_key])
+            hucs.append(huc12)
+            lengths.append(len(catch_sources))
+            keys.extend(catch_sources.keys())
+            values.extend(catch_sources.values())
+
+    catchments = pd.DataFrame({"comid": comids, "huc": hucs})
+    codes, unique_keys = pd.factorize(pd.Series(keys, dtype=object))
+    long = pd.DataFrame(
+        {
+            "catchment": np.repeat(np.arange(len(lengths)), lengths),
+            "key": codes,
+            "Value": pd.Series(values, dtype=None if values else float),
+        }
+    )
+    return catchments, long, key_vocabulary(unique_keys, id_key)
+
+
+def parse_wikisrat_result(
+    wikisrat_result: Dict, id_key: str = "comid"
+) -> Dict[str, pd.DataFrame]:
+    """Parses every catchment of a WikiSRAT response at once.
+
+    Gives the same frames as calling the former per-catchment
+    `format_wikisrat_return()` on every catchment and concatenating them, but
+    pivots each group once for the whole response.
+
+    Returns:
+        A dict with a DataFrame for each group in `RESULT_GROUPS`: 'maflowv'
+        with a 'Value' column, and the others with a 'Source' column and a
+        column per nutrient; all with 'comid', 'huc', 'gwlfe_endpoint' and
+        'huc_level' columns.
+    """
+    catchments, long, vocabulary = flatten_wikisrat_result(wikisrat_result, id_key)
+    codes = long["key"].to_numpy()
+
+    parsed = {}
+    for group in RESULT_GROUPS.values():
+        rows = long.loc[vocabulary[group].to_numpy()[codes]]
+        if group == "maflowv":
+            frame = rows[["Value"]].reset_index(drop=True)
+        else:
+            frame = (
+                pd.DataFrame(
+                    {
+                        "catchment": rows["catchment"].to_numpy(),
+                        "Source": vocabulary["Source"].to_numpy()[rows["key"]],
+                        "Nutrient": vocabulary["Nutrient"].to_numpy()[rows["key"]],
+                        "Value": rows["Value"].to_numpy(),
+                    }
+                )
+                .pivot(index=["catchment", "Source"], columns="Nutrient", values="Value")
+                .reset_index(level="Source")
+            )
+        position = (
+            rows["catchment"].to_numpy()
+            if group == "maflowv"
+            else frame.index.to_numpy()
+        )
+        frame = frame.reset_index(drop=True)
+        frame["comid"] = catchments["comid"].to_numpy()[position]
+        frame["huc"] = catchments["huc"].to_numpy()[position]
+        frame["gwlfe_endpoint"] = "wikisrat"
+        frame["huc_level"] = 12
+        parsed[group] = frame
+    return parsed
+
+
+def count_rows(results: Dict[str, list]) -> int:
+    """Number of rows of the framed results of a job."""
+    return sum(len(frame) for frames in results.values() for frame in frames)
+
+
+def frame_wikisrat_result(
+    wikisrat_result: Dict,
+    huc8_id: str,
+    run_group: str,
+    funding_source_group: list,
+) -> Dict[str, list]:
+    """Frames a WikiSRAT result for one super-HUC and run group, with
+    `parse_wikisrat_result()`.
+
+    Returns:
+        A dict with a list with the DataFrame of all HUC12s (or an empty
+        list, if there are no rows) for each of `RESULT_KEYS`.
+    """
+    parsed = parse_wikisrat_result(wikisrat_result)
+    results = {key: [] for key in RESULT_KEYS}
+    for result_key, group in RESULT_GROUPS.items():
+        if result_key == "catchment_sources_local_load" and run_group != BASELINE_RUN_GROUP:
+            # NOTE:  Individual land use sources are NOT valid when applying restorations, only the totals
+            continue
+        frame = parsed[group]
+        if len(frame) == 0:
+            continue
+        frame["gwlfe_endpoint"] = "wikiSRAT"
+        frame["run_group"] = run_group
+        frame["run_type"] = "combined" if "x" in huc8_id else "single"
+        frame["funding_sources"] = ", ".join(funding_source_group)
+        results[result_key].append(frame)
+    return results
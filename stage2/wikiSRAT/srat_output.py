@@ -0,0 +1,356 @@
+"""
+Writes the framed SRAT results of each (super-HUC, run group) job to a Parquet
+dataset as soon as the job finishes, instead of keeping every result in memory
+until the end of the run.
+
+The dataset has a directory for each result type (the keys of
+`srat_formatting.RESULT_KEYS`), partitioned by run group:
+
+    <root>/reach_concentrations/run_group_slug=direct_wpf_restoration/02040101.parquet
+
+The partition key isn't 'run_group', which is a column of the files, so a
+result type can also be opened whole with `pd.read_parquet(<root>/<result
+type>)` once the dataset is compacted. Before then, a partition can have both
+a `part-0.parquet` and a newer file of a super-HUC that was run again, and
+`read_results()` reads only the newer rows.
+
+Every file has a 'super_huc' column, so a job that's run again replaces its
+own rows, and `SratResultWriter.copy()` can write the rows of one run group as
+another's. `SratResultWriter.compact()` merges the files of each partition into
+one, sorted by HUC and COMID, and `SratResultWriter.to_csv()` exports the CSVs
+the runner used to write. `read_results()` opens one result type, reading only
+the run groups asked for.
+"""
+import os
+import json
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from srat_formatting import BASELINE_RUN_GROUP, RESULT_KEYS
+
+PathLike = Union[str, Path]
+
+
+def run_group_slug(run_group: str) -> str:
+    """Run group name as used in file and directory names."""
+    return run_group.lower().replace(" ", "_")
+
+
+def partition_path(root: PathLike, result_type: str, run_group: str) -> Path:
+    """Directory of the files for a result type and run group."""
+    return (
+        Path(root)
+        / result_type
+        / "run_group_slug={}".format(run_group_slug(run_group))
+    )
+
+
+def _write_table(table: pa.Table, path: Path, **kwargs):
+    """Writes a table to a temporary file and moves it into place, so a
+    crash never leaves a partial file.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    pq.write_table(table, tmp_path, **kwargs)
+    os.replace(tmp_path, path)
+
+
+def _read_tables(paths: List[Path], columns: Optional[List[str]] = None) -> pa.Table:
+    """Reads and concatenates Parquet files, in order, filling columns
+    missing from some of them (e.g. a nutrient) with nulls.
+    """
+    tables = [pq.read_table(path, columns=columns) for path in paths]
+    return pa.concat_tables(tables, promote_options="permissive")
+
+
+def _read_partition(
+    directory: Path, columns: Optional[List[str]] = None
+) -> Optional[pa.Table]:
+    """Reads the files of one partition, leaving out the rows of a
+    compacted `part-0.parquet` whose super-HUC has a newer file, or None if
+    the partition has no files.
+
+    Returns:
+        The rows of `part-0.parquet` followed by those of the newer files, in
+        order of super-HUC.
+    """
+    compacted = directory / "part-0.parquet"
+    paths = sorted(path for path in directory.glob("*.parquet") if path != compacted)
+    read_columns = columns
+    if columns is not None and "super_huc" not in columns:
+        read_columns = columns + ["super_huc"]
+    tables = []
+    if compacted.is_file():
+        table = pq.read_table(compacted, columns=read_columns)
+        if len(paths) > 0:
+            rerun = pa.array([path.stem for path in paths], pa.string())
+            table = table.filter(pc.invert(pc.is_in(table["super_huc"], rerun)))
+        tables.append(table)
+    if len(paths) > 0:
+        tables.append(_read_tables(paths, read_columns))
+    if len(tables) == 0:
+        return None
+    table = pa.concat_tables(tables, promote_options="permissive")
+    if read_columns is not columns:
+        table = table.drop_columns("super_huc")
+    return table
+
+
+def _sort_table(table: pa.Table, sort_by: List[str]) -> pa.Table:
+    """Sorts a table stably, so rows with the same keys keep their order."""
+    order = [(column, "ascending") for column in sort_by]
+    return table.take(pc.sort_indices(table, sort_keys=order))
+
+
+class SratResultWriter:
+    """Appends framed SRAT results to a Parquet dataset partitioned by result
+    type and run group.
+
+    Args:
+        root: Directory of the dataset
+        compression: Parquet compression. Defaults to "zstd".
+    """
+
+    def __init__(self, root: PathLike, compression: str = "zstd"):
+        self.root = Path(root)
+        self.compression = compression
+        self.run_groups: List[str] = []
+        self._read_manifest()
+
+    @property
+    def _manifest_path(self) -> Path:
+        return self.root / "run_groups.json"
+
+    def _read_manifest(self):
+        if self._manifest_path.is_file():
+            with open(self._manifest_path) as fp:
+                self.run_groups = json.load(fp)
+
+    def _add_run_group(self, run_group: str):
+        """Records the run groups in the order they were first written, for
+        the order of the exported rows.
+        """
+        if run_group in self.run_groups:
+            return
+        self.run_groups.append(run_group)
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self._manifest_path, "w") as fp:
+            json.dump(self.run_groups, fp, indent=2)
+
+    def add_run_groups(self, run_groups: List[str]):
+        """Records run groups before their results are written, so the order
+        of the exported rows doesn't depend on which job finishes first.
+        """
+        for run_group in run_groups:
+            self._add_run_group(run_group)
+
+    def write(
+        self, huc8_id: str, run_group: str, results: Dict[str, list]
+    ) -> List[Path]:
+        """Writes the framed results of one job, replacing any earlier files
+        for the same super-HUC and run group.
+
+        Args:
+            huc8_id: The super-HUC of the job
+            run_group: The run group of the job
+            results: Lists of DataFrames by result type, from
+                `srat_formatting.frame_wikisrat_result()`
+
+        Returns:
+            The paths of the files written.
+        """
+        self._add_run_group(run_group)
+        paths = []
+        for result_type, frames in results.items():
+            if len(frames) == 0:
+                continue
+            path = partition_path(self.root, result_type, run_group) / (
+                "{}.parquet".format(huc8_id)
+            )
+            writer_path = path.with_name(path.name + ".tmp")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # one record batch per frame, without concatenating them first
+            writer = None
+            for frame in frames:
+                table = pa.Table.from_pandas(frame, preserve_index=False)
+                table = table.append_column(
+                    "super_huc", pa.array([huc8_id] * len(table), pa.string())
+                )
+                if writer is None:
+                    writer = pq.ParquetWriter(
+                        writer_path, table.schema, compression=self.compression
+                    )
+                writer.write_table(table.cast(writer.schema))
+            writer.close()
+            os.replace(writer_path, path)
+            paths.append(path)
+        return paths
+
+    def copy(
+        self,
+        huc8_id: str,
+        from_run_group: str,
+        run_group: str,
+        funding_source_group: list,
+    ) -> List[Path]:
+        """Writes the results of a super-HUC for one run group as the results
+        of another, for run groups that would give the same SRAT results.
+
+        The 'run_group' and 'funding_sources' columns are replaced, and the
+        results by land use source are only copied to the baseline run
+        group, as `srat_formatting.frame_wikisrat_result()` does.
+
+        Returns:
+            The paths of the files written.
+        """
+        self._add_run_group(run_group)
+        paths = []
+        for result_type in RESULT_KEYS:
+            if (
+                result_type == "catchment_sources_local_load"
+                and run_group != BASELINE_RUN_GROUP
+            ):
+                continue
+            directory = partition_path(self.root, result_type, from_run_group)
+            path = directory / "{}.parquet".format(huc8_id)
+            if path.is_file():
+                table = pq.read_table(path)
+            elif (directory / "part-0.parquet").is_file():
+                table = pq.read_table(
+                    directory / "part-0.parquet",
+                    filters=[("super_huc", "=", huc8_id)],
+                )
+            else:
+                continue
+            if table.num_rows == 0:
+                continue
+            for column, value in [
+                ("run_group", run_group),
+                ("funding_sources", ", ".join(funding_source_group)),
+            ]:
+                table = table.set_column(
+                    table.schema.get_field_index(column),
+                    column,
+                    pa.array([value] * table.num_rows, table.schema.field(column).type),
+                )
+            path = partition_path(self.root, result_type, run_group) / (
+                "{}.parquet".format(huc8_id)
+            )
+            _write_table(table, path, compression=self.compression)
+            paths.append(path)
+        return paths
+
+    def partitions(self, result_type: str) -> List[str]:
+        """The run groups written for a result type, in the order written."""
+        return [
+            run_group
+            for run_group in self.run_groups
+            if partition_path(self.root, result_type, run_group).is_dir()
+        ]
+
+    def compact(self):
+        """Merges the files of each partition into one `part-0.parquet`,
+        sorted by HUC, COMID and super-HUC.
+
+        Rows of a super-HUC with a newer file replace its rows in an earlier
+        `part-0.parquet`. Only one partition is in memory at a time.
+        """
+        for result_type in RESULT_KEYS:
+            for run_group in self.partitions(result_type):
+                directory = partition_path(self.root, result_type, run_group)
+                compacted = directory / "part-0.parquet"
+                paths = sorted(
+                    path for path in directory.glob("*.parquet") if path != compacted
+                )
+                if len(paths) == 0:
+                    continue
+                table = _read_partition(directory)
+                _write_table(
+                    _sort_table(table, ["huc", "comid", "super_huc"]),
+                    compacted,
+                    compression=self.compression,
+                )
+                for path in paths:
+                    path.unlink()
+
+    def to_csv(
+        self,
+        csv_path: str,
+        csv_extension: str = ".csv",
+        with_attenuation: Optional[bool] = None,
+    ):
+        """Exports one CSV per result type, as `run_srat_with_bmps.py` wrote
+        them before the Parquet dataset: every run group, sorted by HUC and
+        COMID.
+
+        Args:
+            csv_path: Prefix of the CSV paths, followed by the result type
+            csv_extension: Suffix of the CSV paths. Defaults to ".csv".
+            with_attenuation: Value of a 'with_attenuation' column, or None
+                for no column. Defaults to None.
+        """
+        for result_type in RESULT_KEYS:
+            run_groups = self.partitions(result_type)
+            if len(run_groups) == 0:
+                continue
+            # rows of each HUC and COMID by super-HUC, then by run group
+            tables = [
+                _read_partition(partition_path(self.root, result_type, run_group))
+                for run_group in run_groups
+            ]
+            table = pa.concat_tables(
+                [table for table in tables if table is not None],
+                promote_options="permissive",
+            )
+            all_catch_frame = (
+                _sort_table(table, ["huc", "comid", "super_huc"])
+                .drop_columns("super_huc")
+                .to_pandas()
+            )
+            if with_attenuation is not None:
+                all_catch_frame["with_attenuation"] = with_attenuation
+            all_catch_frame.to_csv(csv_path + result_type + csv_extension)
+
+    def clear(self):
+        """Deletes the dataset."""
+        if self.root.is_dir():
+            shutil.rmtree(self.root)
+        self.run_groups = []
+
+
+def read_results(
+    root: PathLike,
+    result_type: str,
+    run_groups: Optional[List[str]] = None,
+    columns: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """Opens one result type of a SRAT results dataset.
+
+    Args:
+        root: Directory of the dataset
+        result_type: One of `srat_formatting.RESULT_KEYS`, such as
+            "reach_concentrations"
+        run_groups: Run groups to read, in this order. Defaults to all.
+        columns: Columns to read. Defaults to all.
+
+    Returns:
+        A DataFrame with the rows of each run group, in order, with the
+        'super_huc' of each row.
+    """
+    root = Path(root)
+    if run_groups is None:
+        run_groups = SratResultWriter(root).partitions(result_type)
+    tables = [
+        _read_partition(partition_path(root, result_type, run_group), columns)
+        for run_group in run_groups
+    ]
+    tables = [table for table in tables if table is not None]
+    if len(tables) == 0:
+        return pd.DataFrame(columns=columns)
+    return pa.concat_tables(tables, promote_options="permissive").to_pandas()
@@ -0,0 +1,216 @@
+"""
+Runs the local SRAT model (or `srat_engine.SratEngine`) for a matrix of
+(super-HUC, run group) jobs over a process pool.
+
+Each worker process creates one `DatabaseAdapter` when it starts and reuses it
+for every job it runs, instead of creating one per call like
+`lambda_handler()`. Results are returned in the order the jobs were given, no
+matter which worker finishes first, so the framed output is the same as a
+serial run.
+"""
+import os
+import sys
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from pollution_assessment.telemetry import timer
+from srat_formatting import (
+    count_rows,
+    format_srat_input,
+    frame_wikisrat_result,
+    run_group_file_stem,
+)
+
+
+@dataclass
+class SratJob:
+    """A SRAT run of the GWLF-E results of one super-HUC for one run group."""
+
+    huc8_id: str
+    run_group: str
+    funding_source_group: list
+    gwlfe_watershed_result: Dict = field(repr=False)
+    with_attenuation: bool = True
+    with_concentration: bool = True
+    json_dump_path: Optional[str] = None
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return (self.huc8_id, self.run_group)
+
+
+# The database adapter or `srat_engine.SratEngine` of this worker process,
+# set by `init_worker()`
+_db = None
+_engine = None
+
+
+def init_worker(
+    local_srat_path: Optional[str],
+    pg_config: Optional[Dict],
+    flag: str = "base",
+    engine=None,
+):
+    """Creates the database adapter for a worker process, or sets the
+    in-process engine to run SRAT with instead.
+    """
+    global _db, _engine
+    if engine is not None:
+        _engine = engine
+        return
+    if local_srat_path not in sys.path:
+        sys.path.append(local_srat_path)
+    from DatabaseAdapter import DatabaseAdapter
+
+    _db = DatabaseAdapter(
+        pg_config["database"],
+        pg_config["user"],
+        pg_config["host"],
+        pg_config["port"],
+        pg_config["password"],
+        flag,
+    )
+
+
+def run_local_srat(data: list, metrics: Optional[Dict] = None) -> Dict:
+    """Runs SRAT on a formatted request body with this worker's adapter.
+
+    The result goes through JSON, as it does in `lambda_handler()`, so it's
+    identical to a result from `run_srat(..., local_lambda=True)`, and its
+    size is added to `metrics` as 'response_bytes'. Workers with an engine
+    run it instead.
+    """
+    if _engine is not None:
+        return _engine.run(data)
+    if _db is None:
+        raise RuntimeError("The SRAT worker wasn't initialized with init_worker()")
+    from StringParser import StringParser
+    from DatabaseAdapter import DatabaseAdapter
+
+    parsed = StringParser.parse(json.dumps(data))
+    input_array = DatabaseAdapter.python_to_array(parsed)
+    response = json.dumps(_db.run_model(input_array))
+    if metrics is not None:
+        metrics["response_bytes"] = len(response)
+    return json.loads(response)
+
+
+def run_job(job: SratJob) -> Tuple[Dict[str, list], Dict]:
+    """Formats, runs and frames one job, dumping its input and result JSON
+    when the job has a `json_dump_path`.
+
+    Returns:
+        A tuple of the framed results and the metrics of the job:
+        'payload_bytes', 'response_bytes', 'retries', 'srat_seconds',
+        'framing_seconds' and 'rows'.
+    """
+    metrics = {"retries": 0}
+    file_stem = None
+    if job.json_dump_path is not None:
+        file_stem = job.json_dump_path + run_group_file_stem(job.huc8_id, job.run_group)
+
+    data = format_srat_input(
+        job.gwlfe_watershed_result,
+        job.with_attenuation,
+        job.with_concentration,
+        job.funding_source_group,
+        srat_input_dump_file=None if file_stem is None else file_stem + "_input.json",
+    )
+    metrics["payload_bytes"] = len(json.dumps(data))
+    with timer(metrics, "srat_seconds"):
+        wikisrat_result = run_local_srat(data, metrics)
+    if wikisrat_result is None:
+        return {}, metrics
+
+    if file_stem is not None:
+        with open(file_stem + ".json", "w") as fp:
+            json.dump(wikisrat_result, fp, indent=2)
+    with timer(metrics, "framing_seconds"):
+        results = frame_wikisrat_result(
+            wikisrat_result, job.huc8_id, job.run_group, job.funding_source_group
+        )
+    metrics["rows"] = count_rows(results)
+    return results, metrics
+
+
+def default_workers(n_jobs: int) -> int:
+    """One worker per core, but no more workers than jobs."""
+    return max(1, min(n_jobs, os.cpu_count() or 1))
+
+
+def run_jobs(
+    jobs: Iterable[SratJob],
+    local_srat_path: Optional[str] = None,
+    pg_config: Optional[Dict] = None,
+    flag: str = "base",
+    max_workers: Optional[int] = None,
+    return_exceptions: bool = False,
+    engine=None,
+) -> Iterator[Tuple[SratJob, Dict[str, list], Dict]]:
+    """Runs SRAT jobs over a process pool.
+
+    Args:
+        jobs: The jobs to run
+        local_srat_path: Directory with the SRAT `DatabaseAdapter` and
+            `StringParser` modules
+        pg_config: The "PG_CONFIG" section of the SRAT `db_config.json`
+        flag: Database adapter flag. Defaults to "base".
+        max_workers: Number of worker processes. Defaults to one per core,
+            up to the number of jobs. With 1, jobs run in this process.
+        return_exceptions: Yield the exception of a failed job in place of
+            its results, and carry on with the other jobs, instead of
+            raising it. Defaults to False.
+        engine: A `srat_engine.SratEngine` to run the jobs with, instead of
+            the SRAT database. Defaults to None.
+
+    Yields:
+        (job, framed results, metrics) tuples in the order of `jobs`, where
+        the framed results are from `srat_formatting.frame_wikisrat_result()`
+        and the metrics from `run_job()` (empty for a failed job).
+    """
+    jobs = list(jobs)
+    if max_workers is None:
+        max_workers = default_workers(len(jobs))
+
+    if max_workers == 1:
+        init_worker(local_srat_path, pg_config, flag, engine)
+        for job in jobs:
+            logging.info("Running SRAT for {} {}".format(*job.key))
+            try:
+                result, metrics = run_job(job)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                result, metrics = e, {}
+            yield job, result, metrics
+        return
+
+    # Workers start from a fork where we can, so they don't re-run the
+    # calling script; otherwise it must guard its runs with __main__
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=context,
+        initializer=init_worker,
+        initargs=(local_srat_path, pg_config, flag, engine),
+    ) as executor:
+        futures = [executor.submit(run_job, job) for job in jobs]
+        logging.info(
+            "Submitted {} SRAT jobs to {} processes".format(len(jobs), max_workers)
+        )
+        for i, job in enumerate(jobs):
+            try:
+                result, metrics = futures[i].result()
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                result, metrics = e, {}
+            # drop the finished future, so results aren't held until the end
+            futures[i] = None
+            yield job, result, metrics
+            logging.info("Finished SRAT for {} {}".format(*job.key))
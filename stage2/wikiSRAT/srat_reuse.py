@@ -0,0 +1,107 @@
+"""
+Finds the run groups whose SRAT results would be the same as another run
+group's, so `run_srat_with_bmps.py` can copy those results instead of running
+SRAT again.
+
+SRAT only applies the BMPs of a run group's restoration sources in the
+catchments of the HUC12s it's sent. If none of a group's sources have BMPs in
+a super-HUC, its result is the baseline ("No restoration or protection")
+result; more generally, two groups with the same sources present in the
+super-HUC give the same result. The sources with BMPs in each catchment are
+read from the same FieldDoc and PADEP/NJDEP reduction tables SRAT uses, and
+the catchments of each super-HUC from its baseline results.
+"""
+from typing import Dict, List, Set, Tuple
+
+import pandas as pd
+
+from srat_formatting import BASELINE_RUN_GROUP
+
+BMP_SOURCE_QUERY = """
+select distinct comid_rest as comid, source
+from datapolassess.fd_api_restoration_lbsreduced_comid
+union
+select distinct comid_prot as comid, source
+from datapolassess.fd_api_protection_lbsavoided_comid
+"""
+
+
+def read_bmp_sources(pg_config: Dict) -> pd.DataFrame:
+    """Reads the restoration source of the BMPs in each catchment from the
+    SRAT database.
+
+    Args:
+        pg_config: The 'PG_CONFIG' of the local SRAT `db_config.json`
+
+    Returns:
+        A DataFrame with a row per 'comid' and 'source'.
+    """
+    import psycopg2
+
+    connection = psycopg2.connect(
+        host=pg_config["host"],
+        database=pg_config["database"],
+        user=pg_config["user"],
+        password=pg_config["password"],
+        port=pg_config["port"],
+    )
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(BMP_SOURCE_QUERY)
+            rows = cursor.fetchall()
+    finally:
+        connection.close()
+    return pd.DataFrame(rows, columns=["comid", "source"])
+
+
+def sources_by_super_huc(
+    bmp_sources: pd.DataFrame, catchments: pd.DataFrame
+) -> Dict[str, Set[str]]:
+    """The restoration sources with BMPs in the catchments of each super-HUC.
+
+    Args:
+        bmp_sources: The 'comid' and 'source' of BMPs, from
+            `read_bmp_sources()`
+        catchments: The 'comid' and 'super_huc' of catchments, such as the
+            baseline reach concentrations
+
+    Returns:
+        A dict of the set of sources by super-HUC, with every super-HUC in
+        `catchments`.
+    """
+    catchments = catchments[["comid", "super_huc"]].drop_duplicates()
+    present = catchments.merge(
+        bmp_sources.astype({"comid": catchments["comid"].dtype}), on="comid"
+    )
+    sources = {super_huc: set() for super_huc in catchments["super_huc"].unique()}
+    for super_huc, source in present[["super_huc", "source"]].drop_duplicates().itertuples(
+        index=False, name=None
+    ):
+        sources[super_huc].add(source)
+    return sources
+
+
+def effective_sources(funding_source_group: List[str], present: Set[str]) -> Tuple[str, ...]:
+    """The sources of a run group that have BMPs in a super-HUC."""
+    return tuple(sorted(source for source in funding_source_group if source in present))
+
+
+def plan_run_groups(
+    funding_source_groups: Dict[str, List[str]], present: Set[str]
+) -> Dict[str, str]:
+    """Picks the run group to take the results of each run group from, for
+    a super-HUC with BMPs from the sources in `present`.
+
+    A group with none of its sources present takes the baseline results;
+    otherwise it takes the results of the first group with the same sources
+    present, which is itself if there's no earlier one.
+
+    Returns:
+        A dict of the run group to run (or copy) by run group.
+    """
+    first_with_sources = {(): BASELINE_RUN_GROUP}
+    plan = {}
+    for run_group, funding_source_group in funding_source_groups.items():
+        sources = effective_sources(funding_source_group, present)
+        plan[run_group] = first_with_sources.setdefault(sources, run_group)
+    return plan
@@ -0,0 +1,101 @@
+"""
+A local stand-in for the WikiSRAT API, to try `srat_client.py` and the remote
+runs of `run_srat_with_bmps.py` without the real service.
+
+It answers each POST with a made-up result in the shape of a WikiSRAT
+response: every HUC12 in the request gets a few catchments with load, load
+rate and concentration keys. The values are pseudo-random but the same for
+the same HUC12 and restoration sources. The server can add latency and fail
+a share of requests, to check concurrency and retries.
+
+Usage:
+    python srat_stub_server.py [port] [delay_seconds] [failure_rate]
+"""
+import sys
+import json
+import zlib
+import random
+import asyncio
+
+from aiohttp import web
+
+
+def stub_catchments(huc12: str, restoration_sources: list) -> dict:
+    """Made-up WikiSRAT catchment results for one HUC12."""
+    seed = zlib.crc32(huc12.encode()) + len(restoration_sources)
+    rng = random.Random(seed)
+    catchments = {}
+    for i in range(rng.randint(2, 6)):
+        comid = seed % 100000 * 10 + i
+        catchment = {
+            "comid": comid,
+            # these keys are renamed by `srat_formatting.RENAMED_KEYS`
+            "tpconc_Crop": rng.random(),
+            "tpconc_hp": rng.random(),
+            "tnconc_hp": rng.random(),
+            "tssconc_hp": rng.random(),
+        }
+        for nutrient in ["tp", "tn", "tss"]:
+            for source in ["hp", "crop", "wooded", "farman"]:
+                catchment["{}load_{}".format(nutrient, source)] = rng.random()
+            catchment["{}loadrate_total".format(nutrient)] = rng.random()
+            catchment["{}loadrate_conc".format(nutrient)] = rng.random()
+        catchments[str(comid)] = catchment
+    return catchments
+
+
+def make_app(delay: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+    """An aiohttp app answering WikiSRAT requests on any path.
+
+    Args:
+        delay: Seconds to wait before answering. Defaults to 0.
+        failure_rate: Share of requests answered with a 503 and a
+            Retry-After of 0. Defaults to 0.
+        seed: Seed of the failures. Defaults to 0.
+    """
+    rng = random.Random(seed)
+    app = web.Application(client_max_size=0)
+    app["requests"] = 0
+
+    async def handle(request: web.Request) -> web.Response:
+        app["requests"] += 1
+        data = json.loads(await request.read())
+        await asyncio.sleep(delay)
+        if rng.random() < failure_rate:
+            return web.Response(status=503, text="stub failure", headers={"Retry-After": "0"})
+        result = {
+            "huc12s": {
+                row["huc12"]: {
+                    "catchments": stub_catchments(
+                        row["huc12"], row.get("restoration_sources", [])
+                    )
+                }
+                for row in data
+            }
+        }
+        return web.json_response(result)
+
+    app.router.add_route("POST", "/{tail:.*}", handle)
+    return app
+
+
+async def start_stub_server(port: int = 0, **app_kwargs):
+    """Starts the stub server on localhost.
+
+    Returns:
+        A tuple of the `web.AppRunner`, to stop it with `await
+        runner.cleanup()`, and the server URL.
+    """
+    runner = web.AppRunner(make_app(**app_kwargs))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, "http://127.0.0.1:{}/".format(port)
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    failure_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+    web.run_app(make_app(delay, failure_rate), host="127.0.0.1", port=port)